@@ -0,0 +1,305 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date:
+// Design Name:
+// Module Name: top_serial_tb
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description: Drives top over the serial link with a behavioural SRAM model
+//              and checks the responses
+//
+// Dependencies:
+//
+// Revision:
+// Revision 0.01 - File Created
+// Additional Comments:
+//
+//////////////////////////////////////////////////////////////////////////////////
+
+module top_serial_tb;
+    parameter DEBOUNCE_DELAY = 'd1;
+    parameter CLKS_PER_BIT = 'd100;
+    parameter BAUD_TIMEOUT = 'd20000;
+    reg clk_in;
+    reg btnT_in;
+    reg btnC_in;
+    reg btnL_in;
+    reg btnR_in;
+    reg btnD_in;
+    reg rx_in;
+    wire tx_out;
+    reg [15:0] sw_in;
+    wire [15:0] led_out;
+    wire [6:0] segment_out;
+    wire dp_out;
+    wire [3:0] digit_out;
+    wire [7:0] JA_out;
+    wire [7:0] JB_out;
+    reg [7:0] JC_in;
+    wire [7:0] JXADC_out;
+    // synthesis translate_off
+    wire [27:0] debug;
+    // synthesis translate_on
+
+    top #(.DEBOUNCE_DELAY(DEBOUNCE_DELAY), .CLK_DIVIDER(CLKS_PER_BIT), .BAUD_TIMEOUT(BAUD_TIMEOUT)) top_sim(
+        .clk(clk_in),
+        .btnT(btnT_in),
+        .btnC(btnC_in),
+        .btnL(btnL_in),
+        .btnR(btnR_in),
+        .btnD(btnD_in),
+        .RsTx(tx_out),
+        .RsRx(rx_in),
+        .sw(sw_in),
+        .led(led_out),
+        .segment(segment_out),
+        .dp(dp_out),
+        .digit(digit_out),
+        .JA(JA_out),
+        .JB(JB_out),
+        .JC(JC_in),
+        .JXADC(JXADC_out)
+        // synthesis translate_off
+        , .debug(debug)
+        // synthesis translate_on
+        );
+
+    parameter PERIOD = 10;
+    always begin
+        clk_in = 1'b1;
+        #(PERIOD/2) clk_in = 1'b0;
+        #(PERIOD/2);
+    end
+
+    // Behavioural SRAM
+    // JA = {0, status, wen, cen, clk, a[8], 0}, JB = a[7:0], JXADC = d, JC = q
+    // STUCK_BITS of STUCK_ADDR always read back as 1
+    parameter [8:0] STUCK_ADDR = 9'h010;
+    parameter [7:0] STUCK_BITS = 8'h01;
+    reg [7:0] sram [0:511];
+    wire [8:0] sram_a = {JA_out[1], JB_out};
+    always @(posedge JA_out[2]) begin
+        if (~JA_out[3]) begin
+            if (~JA_out[4])
+                sram[sram_a] <= JXADC_out;
+            else
+                JC_in <= sram[sram_a] | (sram_a == STUCK_ADDR ? STUCK_BITS : 8'h00);
+        end
+    end
+
+    // UART helpers (8N1) at bit_clks ticks per bit
+    integer bit_clks = CLKS_PER_BIT;
+    task send_byte(input [7:0] data);
+        integer i;
+        begin
+            rx_in = 1'b0;
+            #(PERIOD*bit_clks);
+            for (i = 0; i < 8; i = i + 1) begin
+                rx_in = data[i];
+                #(PERIOD*bit_clks);
+            end
+            rx_in = 1'b1;
+            #(PERIOD*bit_clks);
+        end
+    endtask
+
+    task recv_byte(output [7:0] data);
+        integer i;
+        begin
+            @(negedge tx_out);
+            #(PERIOD*bit_clks/2);
+            for (i = 0; i < 8; i = i + 1) begin
+                #(PERIOD*bit_clks);
+                data[i] = tx_out;
+            end
+            #(PERIOD*bit_clks);
+        end
+    endtask
+
+    integer errors = 0;
+    task check_byte(input [7:0] expected);
+        reg [7:0] data;
+        begin
+            recv_byte(data);
+            if (data !== expected) begin
+                $display("ERROR: read %h, expected %h", data, expected);
+                errors = errors + 1;
+            end
+        end
+    endtask
+
+    // give up if a response never arrives
+    initial begin
+        #(PERIOD*CLKS_PER_BIT*10*1000);
+        $display("FAIL: timeout");
+        $finish;
+    end
+
+    // SET_BAUD to `divider` at the current rate, then confirm it at the new
+    // rate and check a set address and read back
+    task switch_baud(input [11:0] divider, input [8:0] addr);
+        begin
+            send_byte({4'hb, divider[11:8]}); send_byte(divider[7:0]);
+            bit_clks = divider;
+            #(PERIOD*100);
+            send_byte({4'hb, divider[11:8]}); send_byte(divider[7:0]);
+            send_byte({4'h1, 3'b0, addr[8]}); send_byte(addr[7:0]);
+            fork
+                begin send_byte(8'h30); send_byte(8'h00); end
+                begin check_byte({4'h3, 3'b0, addr[8]}); check_byte(addr[7:0]); end
+            join
+            #(PERIOD*100);
+        end
+    endtask
+
+    integer i;
+    initial begin
+        // start in reset
+        rx_in = 1'b1;
+        JC_in = 8'h00;
+        sw_in = 16'h0000;
+        btnT_in = 1'b1;
+        btnC_in = 1'b0;
+        btnL_in = 1'b0;
+        btnR_in = 1'b0;
+        btnD_in = 1'b0;
+        #(PERIOD*10) btnT_in = 1'b0;
+        #(PERIOD*100);
+
+        // SET_CLK 2, SET_ADDR 0x105, WRITE_VAL 0xa5, READ_VAL
+        // (responses start after the first byte of a read command)
+        send_byte(8'h50); send_byte(8'h02);
+        send_byte(8'h11); send_byte(8'h05);
+        send_byte(8'h20); send_byte(8'ha5);
+        #(PERIOD*100);
+        fork
+            begin send_byte(8'h40); send_byte(8'h00); end
+            begin check_byte(8'h40); check_byte(8'ha5); end
+        join
+        #(PERIOD*100);
+
+        $display("done single write/read");
+        // WRITE_BLOCK of 4 values from 0x1fe (wraps around to 0x001)
+        send_byte(8'h11); send_byte(8'hfe);
+        send_byte(8'h80); send_byte(8'h04);
+        for (i = 0; i < 4; i = i + 1)
+            send_byte(8'h10 + i);
+        #(PERIOD*100);
+        // address should have moved past the block
+        fork
+            begin send_byte(8'h30); send_byte(8'h00); end
+            begin check_byte(8'h30); check_byte(8'h02); end
+        join
+        #(PERIOD*100);
+
+        $display("done write block");
+        // READ_BLOCK the same 4 values
+        send_byte(8'h11); send_byte(8'hfe);
+        fork
+            begin send_byte(8'h90); send_byte(8'h04); end
+            for (i = 0; i < 4; i = i + 1)
+                check_byte(8'h10 + i);
+        join
+        #(PERIOD*100);
+
+        $display("done read block");
+        // single value write still in place
+        send_byte(8'h11); send_byte(8'h05);
+        fork
+            begin send_byte(8'h40); send_byte(8'h00); end
+            begin check_byte(8'h40); check_byte(8'ha5); end
+        join
+
+        $display("done single read");
+        #(PERIOD*100);
+
+        // RUNNING_MARCH up(w0); up(r0,w1); down(r1,w0)
+        // expect one fault record (element 1, op 0 at STUCK_ADDR) and the end record
+        fork
+            begin
+                send_byte(8'ha0); send_byte(8'h0d);
+                send_byte(8'h01); send_byte(8'h00); send_byte(8'h00);
+                send_byte(8'h02); send_byte(8'h01); send_byte(8'h00); send_byte(8'h00); send_byte(8'hff);
+                send_byte(8'h82); send_byte(8'h01); send_byte(8'hff); send_byte(8'h00); send_byte(8'h00);
+            end
+            begin
+                check_byte({4'ha, 3'd1, STUCK_ADDR[8]}); check_byte(STUCK_ADDR[7:0]);
+                check_byte(8'h00); check_byte(STUCK_BITS);
+                check_byte(8'ha0); check_byte(8'h00); check_byte(8'h80); check_byte(8'h01);
+            end
+        join
+        #(PERIOD*100);
+        // march ends at address 0 with all values written to 0
+        fork
+            begin send_byte(8'h30); send_byte(8'h00); end
+            begin check_byte(8'h30); check_byte(8'h00); end
+        join
+        #(PERIOD*100);
+        send_byte(8'h11); send_byte(8'hff);
+        fork
+            begin send_byte(8'h40); send_byte(8'h00); end
+            begin check_byte(8'h40); check_byte(8'h00); end
+        join
+        $display("done march");
+
+        // SET_BAUD to each divider and back
+        switch_baud(12'd50, 9'h123);
+        switch_baud(12'd33, 9'h0a5);
+        switch_baud(12'd25, 9'h15a);
+        switch_baud(12'd17, 9'h1ff);
+        switch_baud(12'd8, 9'h001);
+        // a confirmed rate is kept after the timeout
+        #(PERIOD*(BAUD_TIMEOUT + 100));
+        // single and block write/read at the fastest rate
+        send_byte(8'h11); send_byte(8'h05);
+        send_byte(8'h20); send_byte(8'h5a);
+        #(PERIOD*100);
+        fork
+            begin send_byte(8'h40); send_byte(8'h00); end
+            begin check_byte(8'h40); check_byte(8'h5a); end
+        join
+        #(PERIOD*100);
+        send_byte(8'h11); send_byte(8'hfe);
+        send_byte(8'h80); send_byte(8'h04);
+        for (i = 0; i < 4; i = i + 1)
+            send_byte(8'h20 + i);
+        #(PERIOD*100);
+        send_byte(8'h11); send_byte(8'hfe);
+        fork
+            begin send_byte(8'h90); send_byte(8'h04); end
+            for (i = 0; i < 4; i = i + 1)
+                check_byte(8'h20 + i);
+        join
+        #(PERIOD*100);
+        // an unconfirmed rate returns to the last confirmed one
+        send_byte(8'hb0); send_byte(8'd40);
+        #(PERIOD*(BAUD_TIMEOUT + 100));
+        send_byte(8'h10); send_byte(8'h42);
+        fork
+            begin send_byte(8'h30); send_byte(8'h00); end
+            begin check_byte(8'h30); check_byte(8'h42); end
+        join
+        #(PERIOD*100);
+        // dividers below MIN_CLK_DIVIDER are ignored
+        send_byte(8'hb0); send_byte(8'd4);
+        #(PERIOD*100);
+        send_byte(8'h10); send_byte(8'h24);
+        fork
+            begin send_byte(8'h30); send_byte(8'h00); end
+            begin check_byte(8'h30); check_byte(8'h24); end
+        join
+        #(PERIOD*100);
+        switch_baud(CLKS_PER_BIT, 9'h000);
+        $display("done baud");
+
+        if (errors == 0)
+            $display("PASS");
+        else
+            $display("FAIL: %0d errors", errors);
+        $finish;
+    end
+endmodule
@@ -0,0 +1,179 @@
+`timescale 1ns / 1ps
+//////////////////////////////////////////////////////////////////////////////////
+// Company:
+// Engineer:
+//
+// Create Date:
+// Design Name:
+// Module Name: uart_tb
+// Project Name:
+// Target Devices:
+// Tool Versions:
+// Description: Checks uart_rx and uart_tx at each clocks per bit used by
+//              SETTING_BAUD (1, 2, 3, 4, 6 and 12 MBaud at 100MHz)
+//
+// Dependencies:
+//
+// Revision:
+// Revision 0.01 - File Created
+// Additional Comments:
+//
+//////////////////////////////////////////////////////////////////////////////////
+
+module uart_tb;
+    reg clk_in;
+    reg reset_in;
+    reg [15:0] clks_per_bit;
+    reg rx_in;
+    wire rx_dv_out;
+    wire [7:0] rx_byte_out;
+    reg tx_dv_in;
+    reg [7:0] tx_byte_in;
+    wire tx_out;
+    wire tx_active_out;
+    wire tx_done_out;
+
+    uart_rx RX (
+        .i_Clock(clk_in),
+        .i_Clocks_per_Bit(clks_per_bit),
+        .i_Reset(reset_in),
+        .i_Rx_Serial(rx_in),
+        .o_Rx_DV(rx_dv_out),
+        .o_Rx_Byte(rx_byte_out),
+        .o_debug()
+        );
+
+    uart_tx TX (
+        .i_Clock(clk_in),
+        .i_Clocks_per_Bit(clks_per_bit),
+        .i_Reset(reset_in),
+        .i_Tx_DV(tx_dv_in),
+        .i_Tx_Byte(tx_byte_in),
+        .o_Tx_Active(tx_active_out),
+        .o_Tx_Serial(tx_out),
+        .o_Tx_Done(tx_done_out),
+        .o_debug()
+        );
+
+    parameter PERIOD = 10;
+    always begin
+        clk_in = 1'b1;
+        #(PERIOD/2) clk_in = 1'b0;
+        #(PERIOD/2);
+    end
+
+    // 8N1 at clks_per_bit ticks per bit, as sent by the host
+    task send_byte(input [7:0] data);
+        integer i;
+        begin
+            rx_in = 1'b0;
+            #(PERIOD*clks_per_bit);
+            for (i = 0; i < 8; i = i + 1) begin
+                rx_in = data[i];
+                #(PERIOD*clks_per_bit);
+            end
+            rx_in = 1'b1;
+            #(PERIOD*clks_per_bit);
+        end
+    endtask
+
+    // sample each bit at its middle, as the host would
+    task recv_byte(output [7:0] data);
+        integer i;
+        begin
+            @(negedge tx_out);
+            #(PERIOD*clks_per_bit/2);
+            for (i = 0; i < 8; i = i + 1) begin
+                #(PERIOD*clks_per_bit);
+                data[i] = tx_out;
+            end
+            #(PERIOD*clks_per_bit);
+            if (tx_out !== 1'b1) begin
+                $display("ERROR: missing stop bit at %0d clocks per bit", clks_per_bit);
+                errors = errors + 1;
+            end
+        end
+    endtask
+
+    integer errors = 0;
+    task check_rx(input [7:0] data);
+        reg [7:0] read;
+        begin
+            fork
+                send_byte(data);
+                begin
+                    @(posedge rx_dv_out);
+                    read = rx_byte_out;
+                end
+            join
+            if (read !== data) begin
+                $display("ERROR: rx %h, expected %h at %0d clocks per bit", read, data, clks_per_bit);
+                errors = errors + 1;
+            end
+        end
+    endtask
+
+    task check_tx(input [7:0] data);
+        reg [7:0] read;
+        begin
+            fork
+                begin
+                    @(posedge clk_in);
+                    tx_byte_in = data;
+                    tx_dv_in = 1'b1;
+                    @(posedge clk_in);
+                    tx_dv_in = 1'b0;
+                end
+                recv_byte(read);
+            join
+            @(posedge tx_done_out);
+            if (read !== data) begin
+                $display("ERROR: tx %h, expected %h at %0d clocks per bit", read, data, clks_per_bit);
+                errors = errors + 1;
+            end
+        end
+    endtask
+
+    // give up if a byte is never received
+    initial begin
+        #(PERIOD*100*10*200);
+        $display("FAIL: timeout");
+        $finish;
+    end
+
+    // clocks per bit to check, then bytes sent in each direction
+    reg [15:0] dividers [0:5];
+    reg [7:0] patterns [0:5];
+    integer i, j;
+    initial begin
+        dividers[0] = 'd100; dividers[1] = 'd50; dividers[2] = 'd33;
+        dividers[3] = 'd25; dividers[4] = 'd17; dividers[5] = 'd8;
+        patterns[0] = 8'h00; patterns[1] = 8'hff; patterns[2] = 8'h55;
+        patterns[3] = 8'haa; patterns[4] = 8'h01; patterns[5] = 8'h80;
+
+        rx_in = 1'b1;
+        tx_dv_in = 1'b0;
+        tx_byte_in = 8'h00;
+        clks_per_bit = dividers[0];
+        reset_in = 1'b1;
+        #(PERIOD*10) reset_in = 1'b0;
+        #(PERIOD*10);
+
+        // the divider is changed between bytes, as by SETTING_BAUD
+        for (i = 0; i < 6; i = i + 1) begin
+            clks_per_bit = dividers[i];
+            #(PERIOD*10);
+            for (j = 0; j < 6; j = j + 1) begin
+                check_rx(patterns[j]);
+                check_tx(patterns[j]);
+            end
+            $display("done %0d clocks per bit", clks_per_bit);
+        end
+
+        if (errors == 0)
+            $display("PASS");
+        else
+            $display("FAIL: %0d errors", errors);
+        $finish;
+    end
+endmodule
@@ -2,13 +2,15 @@
 //
 // basic serial protocol IO device driver
 //
-// CLKS_BER_BIT = ratio of internal clock to baud rate desired
+// i_Clocks_per_Bit = ratio of internal clock to baud rate desired
+//                    (only change it while neither byte is in progress)
 // o_debug: lower 7 bits come from RX, upper from TX module
 //          see uart_* for what bits are where
 
-module SerialIO #(parameter CLKS_PER_BIT = 'd100) (
+module SerialIO (
     input i_Clock,
     input i_Reset,
+    input [15:0] i_Clocks_per_Bit,
     
     input i_Rx,
     output [7:0] o_Rx_Byte,
@@ -27,10 +29,9 @@ module SerialIO #(parameter CLKS_PER_BIT = 'd100) (
 //
 // for now use the pb_down to trigger the tx
 //
-wire [15:0] clocks_per_bit = CLKS_PER_BIT;
 wire [7:0] tdebug;
 uart_tx TX (
-    .i_Clocks_per_Bit(clocks_per_bit),
+    .i_Clocks_per_Bit(i_Clocks_per_Bit),
     .i_Clock(i_Clock),
     .i_Reset(i_Reset),
     .i_Tx_DV(i_Transmit),
@@ -43,7 +44,7 @@ uart_tx TX (
 
 wire [7:0] rdebug;
 uart_rx RX  (
-    .i_Clocks_per_Bit(clocks_per_bit),
+    .i_Clocks_per_Bit(i_Clocks_per_Bit),
     .i_Clock(i_Clock),
     .i_Reset(i_Reset),
     .i_Rx_Serial(i_Rx),
@@ -41,7 +41,9 @@ module top (
     );
     parameter DEBOUNCE_DELAY = 'd500;
     parameter CLK_DIVIDER = 'd100;
-    parameter VERSION = 'd31;
+    parameter MIN_CLK_DIVIDER = 'd8;
+    parameter BAUD_TIMEOUT = 'd50_000_000;
+    parameter VERSION = 'd34;
     
     // Status of pins
     // 00 == ready
@@ -62,6 +64,10 @@ module top (
     parameter [3:0] SETTING_CLK = 'h5;
     parameter [3:0] READING_CLK = 'h6;
     parameter [3:0] SETTING_READ_DELAY = 'h7;
+    parameter [3:0] WRITING_BLOCK = 'h8;
+    parameter [3:0] READING_BLOCK = 'h9;
+    parameter [3:0] RUNNING_MARCH = 'hA;
+    parameter [3:0] SETTING_BAUD = 'hB;
     reg [3:0] mode = WAITING;
     
     // Stored data for read/write and driving clk
@@ -142,6 +148,25 @@ module top (
     parameter READ_FIRST_BYTE = 'h2;
     parameter READ_SECOND_TRIG = 'h3;
     parameter READ_SECOND_BYTE = 'h4;
+    // block transfer sequence
+    parameter BLOCK_NEXT_BYTE = 'h5;
+    parameter BLOCK_CYCLE_START = 'h6;
+    parameter BLOCK_CYCLE_END = 'h7;
+    parameter BLOCK_TX_TRIG = 'h8;
+    parameter BLOCK_TX_BYTE = 'h9;
+    parameter MARCH_RUN = 'hA;
+    // march sequence
+    parameter MARCH_LOAD = 'h0;
+    parameter MARCH_ELEMENT = 'h1;
+    parameter MARCH_OP = 'h2;
+    parameter MARCH_WRITE_START = 'h3;
+    parameter MARCH_WRITE_END = 'h4;
+    parameter MARCH_READ_START = 'h5;
+    parameter MARCH_READ_END = 'h6;
+    parameter MARCH_NEXT_OP = 'h7;
+    parameter MARCH_TX_LOAD = 'h8;
+    parameter MARCH_TX_TRIG = 'h9;
+    parameter MARCH_TX_BYTE = 'hA;
     reg [3:0] read_seq = READ_READY;
     reg [3:0] write_seq = WRITE_READY;
     wire rx_dv;
@@ -151,9 +176,17 @@ module top (
     wire tx_ready;
     reg [7:0] tx_data = 0;
     wire tx_done;
-    SerialIO  #(.CLKS_PER_BIT(CLK_DIVIDER)) serial (
+    // uart clocks per bit (100MHz/baud), set by SETTING_BAUD
+    // a new value returns to the last confirmed one after BAUD_TIMEOUT ticks
+    // unless it is confirmed by setting it again (at the new rate)
+    reg [11:0] clks_per_bit = CLK_DIVIDER;
+    reg [11:0] confirmed_clks_per_bit = CLK_DIVIDER;
+    reg baud_pending = 0;
+    reg [31:0] baud_timer = 0;
+    SerialIO serial (
         .i_Clock(clk),
         .i_Reset(reset),
+        .i_Clocks_per_Bit({4'b0, clks_per_bit}),
         // transmitter:
         .o_Tx(RsTx),
         .i_Transmit(tx_dv),
@@ -229,10 +262,47 @@ module top (
     // main control loop
     // bits for decoding >8-bit messages
     reg [3:0] rx_overflow = 0;
+    // remaining values in block transfer
+    reg [11:0] block_count = 0;
+    // one byte buffer for block writes received during a write cycle
+    reg [7:0] block_hold = 0;
+    reg block_hold_valid = 0;
+    // march program
+    // element header {direction (1 == down), n_ops[6:0]} followed by n_ops
+    // ops of two bytes {7'b0, read (1) / write (0)}, {data}
+    parameter MARCH_MAX_LEN = 'd128;
+    reg [7:0] march_program [0:MARCH_MAX_LEN-1];
+    reg [7:0] march_len = 0;
+    reg [3:0] march_seq = MARCH_LOAD;
+    reg [7:0] march_ptr = 0; // current element header
+    reg [7:0] march_op_ptr = 0; // current op
+    reg [6:0] march_op = 0; // op index in element
+    reg [2:0] march_element = 0; // element index
+    reg [15:0] march_faults = 0; // number of faults (saturates)
+    reg [1:0] march_tx_idx = 0; // byte of record being transmitted
+    reg march_done = 0; // transmitting end record
+    wire [7:0] march_header = march_program[march_ptr[6:0]];
+    wire [7:0] march_op_kind = march_program[march_op_ptr[6:0]];
+    wire [7:0] march_op_data = march_program[march_op_ptr[6:0] + 1];
+    wire march_down = march_header[7];
+    wire [8:0] march_last_addr = march_down ? 9'h000 : 9'h1ff;
     always @(posedge clk) begin
         reset <= btnT;
+        if (baud_pending) begin
+            // return to the confirmed baud rate if no confirmation arrives
+            if (baud_timer == 0) begin
+                clks_per_bit <= confirmed_clks_per_bit;
+                baud_pending <= 0;
+            end
+            else begin
+                baud_timer <= baud_timer - 1;
+            end
+        end
         if (reset) begin
             // reset
+            clks_per_bit <= CLK_DIVIDER;
+            confirmed_clks_per_bit <= CLK_DIVIDER;
+            baud_pending <= 0;
             read_delay <= 8'd4;
             clk_factor <= 8'd25;
             address <= 9'b0;
@@ -245,6 +315,10 @@ module top (
             tx_dv = 0;
             tx_data = 0;
             rx_overflow = 0;
+            block_count = 0;
+            block_hold_valid = 0;
+            march_len = 0;
+            march_seq = MARCH_LOAD;
         end
         else
         // manual override
@@ -553,6 +627,387 @@ module top (
                 endcase
             end
 
+            SETTING_BAUD : begin
+                // wait for second byte
+                // set clks_per_bit to {overflow, second byte}, or confirm it
+                // if it is already set
+                // return to waiting
+                case (read_seq)
+                    READ_SECOND_TRIG : begin
+                        if (~rx_dv) begin
+                            // wait for first byte to finish
+                            read_seq <= READ_SECOND_BYTE;
+                        end
+                    end
+                    READ_SECOND_BYTE : begin
+                        if (rx_dv) begin
+                            // second byte received (rx and tx are idle)
+                            if ({rx_overflow, rx_data[7:0]} == clks_per_bit) begin
+                                // confirm current rate
+                                confirmed_clks_per_bit <= clks_per_bit;
+                                baud_pending <= 0;
+                            end
+                            else if ({rx_overflow, rx_data[7:0]} >= MIN_CLK_DIVIDER) begin
+                                // switch rate until confirmed or timed out
+                                clks_per_bit <= {rx_overflow, rx_data[7:0]};
+                                baud_pending <= 1;
+                                baud_timer <= BAUD_TIMEOUT;
+                            end
+                            mode <= WAITING;
+                            read_seq <= READ_READY;
+                        end
+                    end
+                    default : begin
+                        mode <= WAITING;
+                    end
+                endcase
+            end
+
+            WRITING_BLOCK : begin
+                // wait for second byte
+                // set block_count to {overflow, second byte}
+                // write each following byte to address, then increment address
+                // return to waiting after block_count bytes
+                case (read_seq)
+                    READ_SECOND_TRIG : begin
+                        if (~rx_dv) begin
+                            // wait for first byte to finish
+                            read_seq <= READ_SECOND_BYTE;
+                        end
+                    end
+                    READ_SECOND_BYTE : begin
+                        if (rx_dv) begin
+                            // latch block length
+                            block_count <= {rx_overflow, rx_data[7:0]};
+                            block_hold_valid <= 0;
+                            if ({rx_overflow, rx_data[7:0]} == 0) begin
+                                mode <= WAITING;
+                                read_seq <= READ_READY;
+                            end
+                            else begin
+                                read_seq <= BLOCK_NEXT_BYTE;
+                            end
+                        end
+                    end
+                    BLOCK_NEXT_BYTE : begin
+                        // wait for next value (or use value received during last cycle)
+                        if (block_hold_valid) begin
+                            write <= block_hold;
+                            serial_write <= 1;
+                            read_seq <= BLOCK_CYCLE_START;
+                            if (rx_dv) begin
+                                block_hold <= rx_data;
+                            end
+                            else begin
+                                block_hold_valid <= 0;
+                            end
+                        end
+                        else
+                        if (rx_dv) begin
+                            write <= rx_data;
+                            serial_write <= 1;
+                            read_seq <= BLOCK_CYCLE_START;
+                        end
+                    end
+                    BLOCK_CYCLE_START : begin
+                        // finish triggering write cycle
+                        serial_write <= 0;
+                        if (rx_dv) begin
+                            block_hold <= rx_data;
+                            block_hold_valid <= 1;
+                        end
+                        if (status == WRITE) begin
+                            read_seq <= BLOCK_CYCLE_END;
+                        end
+                    end
+                    BLOCK_CYCLE_END : begin
+                        if (rx_dv) begin
+                            block_hold <= rx_data;
+                            block_hold_valid <= 1;
+                        end
+                        if (status != WRITE) begin
+                            // after writing move to next address
+                            address <= address + 1;
+                            block_count <= block_count - 1;
+                            if (block_count == 1) begin
+                                mode <= WAITING;
+                                read_seq <= READ_READY;
+                            end
+                            else begin
+                                read_seq <= BLOCK_NEXT_BYTE;
+                            end
+                        end
+                    end
+                    default : begin
+                        mode <= WAITING;
+                    end
+                endcase
+            end
+
+            READING_BLOCK : begin
+                // wait for second byte
+                // set block_count to {overflow, second byte}
+                // read each address and transmit one byte {read[7:0]}, then increment address
+                // return to waiting after block_count bytes
+                case (read_seq)
+                    READ_SECOND_TRIG : begin
+                        if (~rx_dv) begin
+                            // wait for first byte to finish
+                            read_seq <= READ_SECOND_BYTE;
+                        end
+                    end
+                    READ_SECOND_BYTE : begin
+                        if (rx_dv) begin
+                            // latch block length
+                            block_count <= {rx_overflow, rx_data[7:0]};
+                            if ({rx_overflow, rx_data[7:0]} == 0) begin
+                                mode <= WAITING;
+                                read_seq <= READ_READY;
+                            end
+                            else begin
+                                read_seq <= BLOCK_NEXT_BYTE;
+                            end
+                        end
+                    end
+                    BLOCK_NEXT_BYTE : begin
+                        // trigger read cycle
+                        serial_read <= 1;
+                        read_seq <= BLOCK_CYCLE_START;
+                    end
+                    BLOCK_CYCLE_START : begin
+                        // finish triggering read cycle
+                        serial_read <= 0;
+                        if (status == READ) begin
+                            read_seq <= BLOCK_CYCLE_END;
+                        end
+                    end
+                    BLOCK_CYCLE_END : begin
+                        if (status != READ) begin
+                            // transmit read value
+                            tx_data <= {read};
+                            read_seq <= BLOCK_TX_TRIG;
+                        end
+                    end
+                    BLOCK_TX_TRIG : begin
+                        if (~tx_dv) begin
+                            tx_dv <= 1;
+                        end
+                        else begin
+                            // end trigger
+                            tx_dv <= 0;
+                            read_seq <= BLOCK_TX_BYTE;
+                        end
+                    end
+                    BLOCK_TX_BYTE : begin
+                        if (tx_done) begin
+                            // byte transmitted - move to next address
+                            address <= address + 1;
+                            block_count <= block_count - 1;
+                            if (block_count == 1) begin
+                                mode <= WAITING;
+                                read_seq <= READ_READY;
+                            end
+                            else begin
+                                read_seq <= BLOCK_NEXT_BYTE;
+                            end
+                        end
+                    end
+                    default : begin
+                        mode <= WAITING;
+                    end
+                endcase
+            end
+
+            RUNNING_MARCH : begin
+                // wait for second byte
+                // set block_count to program length {overflow, second byte}
+                // store the following block_count bytes as the march program
+                // run each element over all addresses, transmitting a record
+                // {march[3:0], element[2:0], a[8]}, {a[7:0]}, {0, op[6:0]}, {read[7:0]}
+                // for each read that does not match the op data
+                // transmit end record {march[3:0], 0000}, {n_faults[15:8]}, {1000_0000}, {n_faults[7:0]}
+                // return to waiting
+                case (read_seq)
+                    READ_SECOND_TRIG : begin
+                        if (~rx_dv) begin
+                            // wait for first byte to finish
+                            read_seq <= READ_SECOND_BYTE;
+                        end
+                    end
+                    READ_SECOND_BYTE : begin
+                        if (rx_dv) begin
+                            // latch program length
+                            block_count <= {rx_overflow, rx_data[7:0]};
+                            march_len <= 0;
+                            march_seq <= MARCH_LOAD;
+                            if ({rx_overflow, rx_data[7:0]} == 0) begin
+                                mode <= WAITING;
+                                read_seq <= READ_READY;
+                            end
+                            else begin
+                                read_seq <= MARCH_RUN;
+                            end
+                        end
+                    end
+                    MARCH_RUN : begin
+                        case (march_seq)
+                            MARCH_LOAD : begin
+                                // store program bytes (bytes beyond MARCH_MAX_LEN are dropped)
+                                if (rx_dv) begin
+                                    if (march_len < MARCH_MAX_LEN) begin
+                                        march_program[march_len[6:0]] <= rx_data;
+                                        march_len <= march_len + 1;
+                                    end
+                                    block_count <= block_count - 1;
+                                    if (block_count == 1) begin
+                                        march_ptr <= 0;
+                                        march_element <= 0;
+                                        march_faults <= 0;
+                                        march_seq <= MARCH_ELEMENT;
+                                    end
+                                end
+                            end
+                            MARCH_ELEMENT : begin
+                                if (march_ptr >= march_len) begin
+                                    // all elements run - send end record
+                                    march_done <= 1;
+                                    march_tx_idx <= 0;
+                                    march_seq <= MARCH_TX_LOAD;
+                                end
+                                else
+                                if (march_header[6:0] == 0) begin
+                                    // skip empty element
+                                    march_ptr <= march_ptr + 1;
+                                    march_element <= march_element + 1;
+                                end
+                                else begin
+                                    // start element at first (last) address
+                                    address <= march_down ? 9'h1ff : 9'h000;
+                                    march_op <= 0;
+                                    march_op_ptr <= march_ptr + 1;
+                                    march_seq <= MARCH_OP;
+                                end
+                            end
+                            MARCH_OP : begin
+                                // trigger read or write cycle
+                                if (march_op_kind[0]) begin
+                                    serial_read <= 1;
+                                    march_seq <= MARCH_READ_START;
+                                end
+                                else begin
+                                    write <= march_op_data;
+                                    serial_write <= 1;
+                                    march_seq <= MARCH_WRITE_START;
+                                end
+                            end
+                            MARCH_WRITE_START : begin
+                                // finish triggering write cycle
+                                serial_write <= 0;
+                                if (status == WRITE) begin
+                                    march_seq <= MARCH_WRITE_END;
+                                end
+                            end
+                            MARCH_WRITE_END : begin
+                                if (status != WRITE) begin
+                                    march_seq <= MARCH_NEXT_OP;
+                                end
+                            end
+                            MARCH_READ_START : begin
+                                // finish triggering read cycle
+                                serial_read <= 0;
+                                if (status == READ) begin
+                                    march_seq <= MARCH_READ_END;
+                                end
+                            end
+                            MARCH_READ_END : begin
+                                if (status != READ) begin
+                                    if (read != march_op_data) begin
+                                        // fault - send record
+                                        if (~&march_faults) begin
+                                            march_faults <= march_faults + 1;
+                                        end
+                                        march_done <= 0;
+                                        march_tx_idx <= 0;
+                                        march_seq <= MARCH_TX_LOAD;
+                                    end
+                                    else begin
+                                        march_seq <= MARCH_NEXT_OP;
+                                    end
+                                end
+                            end
+                            MARCH_NEXT_OP : begin
+                                if (march_op + 1 < march_header[6:0]) begin
+                                    // next op at this address
+                                    march_op <= march_op + 1;
+                                    march_op_ptr <= march_op_ptr + 2;
+                                    march_seq <= MARCH_OP;
+                                end
+                                else
+                                if (address != march_last_addr) begin
+                                    // next address
+                                    address <= march_down ? address - 1 : address + 1;
+                                    march_op <= 0;
+                                    march_op_ptr <= march_ptr + 1;
+                                    march_seq <= MARCH_OP;
+                                end
+                                else begin
+                                    // next element
+                                    march_ptr <= march_op_ptr + 2;
+                                    march_element <= march_element + 1;
+                                    march_seq <= MARCH_ELEMENT;
+                                end
+                            end
+                            MARCH_TX_LOAD : begin
+                                case (march_tx_idx)
+                                    'd0 : tx_data <= march_done ? {mode, 4'b0} : {mode, march_element, address[8]};
+                                    'd1 : tx_data <= march_done ? march_faults[15:8] : address[7:0];
+                                    'd2 : tx_data <= march_done ? 8'h80 : {1'b0, march_op};
+                                    'd3 : tx_data <= march_done ? march_faults[7:0] : read;
+                                endcase
+                                march_seq <= MARCH_TX_TRIG;
+                            end
+                            MARCH_TX_TRIG : begin
+                                if (~tx_dv) begin
+                                    tx_dv <= 1;
+                                end
+                                else begin
+                                    // end trigger
+                                    tx_dv <= 0;
+                                    march_seq <= MARCH_TX_BYTE;
+                                end
+                            end
+                            MARCH_TX_BYTE : begin
+                                if (tx_done) begin
+                                    if (march_tx_idx != 3) begin
+                                        march_tx_idx <= march_tx_idx + 1;
+                                        march_seq <= MARCH_TX_LOAD;
+                                    end
+                                    else
+                                    if (march_done) begin
+                                        // record transmitted - reset
+                                        march_seq <= MARCH_LOAD;
+                                        mode <= WAITING;
+                                        read_seq <= READ_READY;
+                                    end
+                                    else begin
+                                        // continue march
+                                        march_seq <= MARCH_NEXT_OP;
+                                    end
+                                end
+                            end
+                            default : begin
+                                march_seq <= MARCH_LOAD;
+                                mode <= WAITING;
+                                read_seq <= READ_READY;
+                            end
+                        endcase
+                    end
+                    default : begin
+                        mode <= WAITING;
+                    end
+                endcase
+            end
+
             default : begin
                 mode <= WAITING;
                 read_seq <= READ_READY;
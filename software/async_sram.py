@@ -0,0 +1,220 @@
+'''
+asyncio interface to the cryoSRAM fpga
+Run with e.g.:
+  async def main():
+      c = AsyncCryoSRAM(io=quick_serial(), window=16)
+      await c.set_addr(255)
+      await c.write_value(127)
+      print(await c.read_value())
+      await c.close()
+  asyncio.run(main())
+'''
+import asyncio
+import collections
+from cryoCMOS import *
+
+class AsyncTransport :
+    '''
+    Sends requests to an io object with `read(<nbytes>)` and `write(<bytes>)`
+    methods (e.g. a `Serial`) without waiting for each response
+    Requests are written in the order they are submitted, with at most
+    `window` frames waiting for their responses (a request larger than the
+    window is sent on its own). Responses are matched to requests in order.
+    The blocking io calls are run in the default executor, so other tasks
+    keep running while they wait. Reads and writes run at the same time on
+    different threads, so the io object (and its `CryoLogger` capture) must
+    allow this, as `Serial` and `SimFPGA` do
+    '''
+
+    def __init__(self, io, window=16):
+        self.io = io
+        self.window = window
+        self.send_queue = None
+        self.in_flight = collections.deque() # (n_rx, n_frames, future) written, awaiting response
+        self.in_flight_frames = 0
+        self.window_open = None
+        self.response_ready = None
+        self.tasks = []
+
+    def start(self):
+        '''
+        Start the writer and reader tasks on the running event loop
+        '''
+        self.send_queue = asyncio.Queue()
+        self.window_open = asyncio.Condition()
+        self.response_ready = asyncio.Event()
+        self.tasks = [asyncio.ensure_future(self.writer_loop()), asyncio.ensure_future(self.reader_loop())]
+
+    def submit(self, tx_bytes, n_rx=0, n_frames=None):
+        '''
+        Queue bytes to write and the number of response bytes expected
+        `n_frames` is the number of frames awaiting a response (defaults to
+        one per 2 response bytes)
+        Returns a future of the response bytes (fewer than `n_rx` if the read
+        timed out)
+        '''
+        if not len(self.tasks):
+            self.start()
+        if n_frames is None:
+            n_frames = (n_rx + 1)//2
+        future = asyncio.get_running_loop().create_future()
+        self.send_queue.put_nowait((tx_bytes, n_rx, n_frames, future))
+        return future
+
+    def window_free(self, n_frames):
+        return not self.in_flight_frames or self.in_flight_frames + n_frames <= self.window
+
+    async def writer_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            tx_bytes, n_rx, n_frames, future = await self.send_queue.get()
+            if n_rx:
+                async with self.window_open:
+                    await self.window_open.wait_for(lambda: self.window_free(n_frames))
+                    self.in_flight_frames += n_frames
+            if len(tx_bytes):
+                await loop.run_in_executor(None, self.io.write, tx_bytes)
+            if n_rx:
+                self.in_flight.append((n_rx, n_frames, future))
+                self.response_ready.set()
+            elif not future.done():
+                future.set_result(b'')
+
+    async def reader_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if not len(self.in_flight):
+                self.response_ready.clear()
+                await self.response_ready.wait()
+                continue
+            n_rx, n_frames, future = self.in_flight[0]
+            read_bytes = await loop.run_in_executor(None, self.io.read, n_rx)
+            self.in_flight.popleft()
+            async with self.window_open:
+                self.in_flight_frames -= n_frames
+                self.window_open.notify_all()
+            if not future.done():
+                future.set_result(read_bytes)
+
+    async def drain(self):
+        '''
+        Wait until all submitted requests are complete
+        '''
+        if not len(self.tasks):
+            return
+        await self.submit(b'', 0)
+        while len(self.in_flight):
+            await asyncio.shield(self.in_flight[-1][2])
+
+    async def close(self):
+        '''
+        Wait for all submitted requests and stop the writer and reader tasks
+        '''
+        await self.drain()
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+class AsyncCryoSRAM :
+    '''
+    Async version of the `CryoSRAM` commands, e.g.
+      await c.read_value()
+    Frames are built (and padded with NOPs) by a `CryoSRAM` in batch mode, so
+    no `rw_delay` is needed, and sent through an `AsyncTransport` with up
+    to `window` read frames (one per value read) awaiting responses. Commands are queued when they
+    are called (and awaited for their results), so e.g.
+      await asyncio.gather(c.read_block(0, 256), c.read_block(256, 256))
+    sends both requests before the first response arrives
+    Other attributes are those of the underlying `CryoSRAM` (`c.sram`)
+    '''
+
+    def __init__(self, io=None, log=None, window=16, **kwargs):
+        '''
+        `io`, `log` and extra keyword arguments are passed to `CryoSRAM`
+        '''
+        self.sram = CryoSRAM(io=io, log=log, **kwargs)
+        self.sram.max_batch_bytes = float('inf') # each call is sent as one request
+        self.transport = AsyncTransport(self.sram.io, window)
+        self.n_requests = 0
+        self.last_modified = {} # key : last request to modify it
+
+    def __getattr__(self, name):
+        if name == 'sram':
+            raise AttributeError(name)
+        return getattr(self.sram, name)
+
+    def submit(self, method, modifies, result, *args):
+        '''
+        Queue the frames of a `CryoSRAM` method as one request
+        `modifies` lists the state keys it changes, `result` selects the
+        value returned by the coroutine ('last' read value, 'all' values or
+        None)
+        Returns a coroutine
+        '''
+        self.sram.batching = True
+        try:
+            method(*args)
+        finally:
+            self.sram.batching = False
+        tx_bytes, n_rx, pending, pending_last = self.sram.take_batch()
+        request = self.n_requests
+        self.n_requests += 1
+        for key in modifies:
+            self.last_modified[key] = request
+        future = self.transport.submit(tx_bytes, n_rx, len(pending)) if len(tx_bytes) else None
+        return self.complete(request, future, n_rx, pending, pending_last, result)
+
+    async def complete(self, request, future, n_rx, pending, pending_last, result):
+        values = []
+        if future is not None:
+            read_bytes = await future
+            superseded = set([key for key in pending_last if self.last_modified.get(key, -1) > request])
+            values = self.sram.apply_responses(read_bytes, n_rx, pending, pending_last, superseded)
+        if result == 'last':
+            return values[-1] if len(values) else None
+        if result == 'all':
+            return values
+        return None
+
+    # The commands below queue their frames when called and return a
+    # coroutine that completes when the response has been received
+
+    def set_addr(self, addr):
+        return self.submit(self.sram.set_addr, ['curr_addr'], None, addr)
+
+    def write_value(self, val):
+        return self.submit(self.sram.write_value, [self.sram.curr_addr], None, val)
+
+    def read_addr(self, stage=None):
+        return self.submit(self.sram.read_addr, [], 'last', stage)
+
+    def read_value(self, stage=None, expected=None):
+        return self.submit(self.sram.read_value, [], 'last', stage, expected)
+
+    def set_clk(self, clk_factor):
+        return self.submit(self.sram.set_clk, ['clk_factor'], None, clk_factor)
+
+    def read_clk(self):
+        return self.submit(self.sram.read_clk, [], 'last')
+
+    def set_delay(self, delay_factor):
+        return self.submit(self.sram.set_delay, [], None, delay_factor)
+
+    def write_block(self, start, values):
+        addrs = ((start + np.arange(len(values))) % self.sram.addr_range[-1]).tolist()
+        return self.submit(self.sram.write_block, addrs + ['curr_addr'], None, start, values)
+
+    def read_block(self, start, n, stage=None, expected=None):
+        return self.submit(self.sram.read_block, ['curr_addr'], 'all', start, n, stage, expected)
+
+    async def drain(self):
+        '''
+        Wait for all outstanding requests
+        '''
+        await self.transport.drain()
+
+    async def close(self):
+        '''
+        Wait for all outstanding requests and stop the transport tasks
+        '''
+        await self.transport.close()
@@ -0,0 +1,682 @@
+#!/usr/bin/env python
+'''
+Benchmarks of the host-side cryoSRAM code against a simulated FPGA
+Run with:
+  ./benchmark.py
+or the reproducible suite, compared against the stored baseline:
+  ./benchmark.py suite
+  ./benchmark.py baseline # (re)write the baseline
+'''
+import os
+import sys
+import time
+import json
+import random
+import logging
+import tempfile
+import tracemalloc
+from bitarray import bitarray
+from cryoCMOS import *
+from sram_sim import *
+from bitcounts import BitCounts
+
+def quiet_logger(**kwargs):
+    '''
+    Returns a `CryoLogger` in a temporary directory that only prints warnings
+    '''
+    log = CryoLogger(directory=tempfile.mkdtemp(), **kwargs)
+    log.stdout.setLevel(logging.WARNING)
+    return log
+
+def bench_pipeline(test_name='mats_test'):
+    '''
+    Compare frames/sec of a standard test with and without batched commands
+    Returns dict of pipeline : frames/sec
+    '''
+    results = {}
+    for pipeline in (False, True):
+        io = SimFPGA(realtime=True)
+        c = CryoSRAM(io=io, log=quiet_logger(), pipeline=pipeline)
+        start = time.time()
+        faults, bitmaps = getattr(c, test_name)()
+        elapsed = time.time() - start
+        results[pipeline] = io.n_frames/elapsed
+        print('{} pipeline={}: {:.3f}s, {:.0f} frames/s, faults {}'.format(
+            test_name, pipeline, elapsed, results[pipeline],
+            sum([len(fault) for fault in faults.values()])))
+        c.log.close()
+    print('{} speedup: {:.1f}x'.format(test_name, results[True]/results[False]))
+    return results
+
+def bench_block(test_name='pattern_test'):
+    '''
+    Compare run time and bytes sent by a standard test with and without
+    block transfers
+    Returns dict of block_transfers : seconds
+    '''
+    results = {}
+    for block_transfers in (False, True):
+        io = SimFPGA(realtime=True)
+        c = CryoSRAM(io=io, log=quiet_logger(), block_transfers=block_transfers)
+        tx_bytes = [0]
+        write = c.io.write
+        def counted_write(write_bytes):
+            tx_bytes[0] += len(write_bytes)
+            return write(write_bytes)
+        c.io.write = counted_write
+        start = time.time()
+        faults, bitmaps = getattr(c, test_name)()
+        results[block_transfers] = time.time() - start
+        print('{} block_transfers={}: {:.3f}s, {} bytes sent'.format(
+            test_name, block_transfers, results[block_transfers], tx_bytes[0]))
+        c.log.close()
+    print('{} speedup: {:.1f}x'.format(test_name, results[False]/results[True]))
+    return results
+
+def bench_engine(test_name='mats_test'):
+    '''
+    Compare run time of a march test executed from the host and by the
+    fpga march sequencer
+    Returns dict of engine : seconds
+    '''
+    results = {}
+    for engine in ('host', 'fpga'):
+        io = SimFPGA(realtime=True)
+        c = CryoSRAM(io=io, log=quiet_logger(), engine=engine)
+        start = time.time()
+        faults, bitmaps = getattr(c, test_name)()
+        results[engine] = time.time() - start
+        print('{} engine={}: {:.3f}s, faults {}'.format(test_name, engine, results[engine],
+            sum([len(fault) for fault in faults.values()])))
+        c.log.close()
+    print('{} speedup: {:.1f}x'.format(test_name, results['host']/results['fpga']))
+    return results
+
+def bench_optimize(test_names=('mats_test', 'pattern_test', 'single_bit_test', 'rand_test')):
+    '''
+    Compare run time and frames sent by standard tests with and without the
+    SET_ADDR optimizer
+    Returns dict of (test name, optimize) : (seconds, frames, frames saved)
+    The frames saved must equal the drop in frames sent
+    '''
+    results = {}
+    for test_name in test_names:
+        for optimize in (False, True):
+            io = SimFPGA(realtime=True)
+            c = CryoSRAM(io=io, log=quiet_logger(), optimize=optimize)
+            random.seed(0)
+            start = time.time()
+            getattr(c, test_name)()
+            results[(test_name, optimize)] = (time.time() - start, io.n_frames, c.n_frames_saved)
+            print('{} optimize={}: {:.3f}s, {} frames, {} SET_ADDR frames saved'.format(
+                test_name, optimize, *results[(test_name, optimize)]))
+            c.log.close()
+        drop = results[(test_name, False)][1] - results[(test_name, True)][1]
+        assert results[(test_name, True)][2] == drop, \
+            '{}: {} frames saved, but frames sent dropped by {}'.format(test_name, results[(test_name, True)][2], drop)
+    return results
+
+def bench_boards(n_boards=4, clk_factors=[25]):
+    '''
+    Compare the time to run the test suite on simulated boards one after
+    another and with `run_boards`
+    Returns dict of mode : seconds
+    '''
+    from test_suite import run_board, run_boards
+    directory = tempfile.mkdtemp()
+    boards = lambda: dict([('board{}'.format(i), SimFPGA(realtime=True)) for i in range(n_boards)])
+    logging.getLogger('CryoLogger').setLevel(logging.WARNING)
+    results = {}
+    start = time.time()
+    for board, io in boards().items():
+        run_board(board, io, directory, clk_factors)
+    results['serial'] = time.time() - start
+    for processes in (False, True):
+        start = time.time()
+        run_boards(boards(), clk_factors, directory, processes=processes)
+        results['processes' if processes else 'threads'] = time.time() - start
+    for key in ('serial', 'threads', 'processes'):
+        print('{} boards {}: {:.2f}s'.format(n_boards, key, results[key]))
+    return results
+
+def bench_async(windows=(1, 16, 64, 512), n_boards=2, n_reads=64, latency=1e-3):
+    '''
+    Compare the time for `AsyncCryoSRAM` to read the memory in small blocks
+    from several simulated boards on one event loop, for different windows of
+    frames in flight
+    Responses take `latency` [s] to reach the host (as through a usb-uart
+    bridge), which a larger window hides
+    Returns dict of window : seconds
+    '''
+    import asyncio
+    from async_sram import AsyncCryoSRAM
+
+    async def read_board(window):
+        c = AsyncCryoSRAM(io=SimFPGA(realtime=True, latency=latency), log=quiet_logger(), window=window)
+        await c.write_block(0, list(range(256))*2)
+        n = 512//n_reads
+        reads = await asyncio.gather(*[c.read_block(i*n, n, stage='read') for i in range(n_reads)])
+        await c.close()
+        c.log.close()
+        assert sum(reads, []) == list(range(256))*2
+
+    async def read_boards(window):
+        await asyncio.gather(*[read_board(window) for i in range(n_boards)])
+
+    results = {}
+    for window in windows:
+        start = time.time()
+        asyncio.run(read_boards(window))
+        results[window] = time.time() - start
+        print('{} boards async window={}: {:.3f}s'.format(n_boards, window, results[window]))
+    print('window {} speedup over {}: {:.1f}x'.format(windows[-1], windows[0], results[windows[0]]/results[windows[-1]]))
+    return results
+
+def bitarray_frame(opcode, message):
+    '''
+    Reference frame encoding using bitarrays (the original command path)
+    '''
+    binary_word = format(message,'012b')
+    header = bitarray(format(opcode,'04b')) + bitarray(binary_word[:4])
+    word = bitarray(binary_word[4:])
+    return header.tobytes() + word.tobytes()
+
+def bitarray_decode(read_bytes):
+    '''
+    Reference response decoding using bitarrays (the original command path)
+    '''
+    read = bitarray()
+    read.frombytes(read_bytes)
+    return int(read[-8:].to01(),2)
+
+def bench_codec(n=100000):
+    '''
+    Compare frame encoding/decoding rates of the bitarray, lookup table and
+    numpy paths
+    Returns dict of path : frames/sec
+    '''
+    addrs = np.random.randint(0, 2**9, size=n)
+    values = np.random.randint(0, 2**8, size=n)
+    addr_list, value_list = addrs.tolist(), values.tolist()
+    results = {}
+
+    start = time.time()
+    tx = b''.join([bitarray_frame(FrameCodec.SET_ADDR, addr) + bitarray_frame(FrameCodec.WRITE_VAL, value)
+                   for addr, value in zip(addr_list, value_list)])
+    results['encode bitarray'] = 2*n/(time.time() - start)
+
+    start = time.time()
+    table_tx = b''.join([FrameCodec.SET_ADDR_FRAMES[addr] + FrameCodec.WRITE_VAL_FRAMES[value]
+                         for addr, value in zip(addr_list, value_list)])
+    results['encode table'] = 2*n/(time.time() - start)
+
+    start = time.time()
+    opcodes = np.tile([FrameCodec.SET_ADDR, FrameCodec.WRITE_VAL], n)
+    messages = np.stack([addrs, values], axis=-1).ravel()
+    numpy_tx = FrameCodec.encode(opcodes, messages)
+    results['encode numpy'] = 2*n/(time.time() - start)
+    assert tx == table_tx == numpy_tx
+
+    rx = FrameCodec.encode(FrameCodec.READ_VAL, values)
+    rx_frames = [rx[2*i:2*i+2] for i in range(n)]
+    start = time.time()
+    decoded = [bitarray_decode(frame) for frame in rx_frames]
+    results['decode bitarray'] = n/(time.time() - start)
+
+    start = time.time()
+    int_decoded = [FrameCodec.decode_message(frame) & 0xff for frame in rx_frames]
+    results['decode int'] = n/(time.time() - start)
+
+    start = time.time()
+    numpy_decoded = FrameCodec.decode(rx)[1] & 0xff
+    results['decode numpy'] = n/(time.time() - start)
+    assert decoded == int_decoded == numpy_decoded.tolist()
+
+    for key in sorted(results.keys()):
+        print('{}: {:.3g} frames/s'.format(key, results[key]))
+    return results
+
+def string_bit_errors(fault_list):
+    '''
+    Reference bit error collection using string formatting (the original
+    plotting path)
+    '''
+    bit_errors = []
+    for addr, expected, actual in fault_list:
+        expected_binary, actual_binary = format(expected,'08b'), format(actual,'08b')
+        for i, bit in enumerate(actual_binary):
+            if bit != expected_binary[i]:
+                bit_errors += [(addr, i, int(bit) - int(expected_binary[i]))]
+    return bit_errors
+
+def string_bit_map(bit_map):
+    '''
+    Reference bit map histogram inputs using string formatting (the original
+    plotting path)
+    '''
+    x, y, w = [], [], []
+    for addr, byte in bit_map:
+        for i, bit in enumerate(format(byte,'08b')):
+            x += [i/8. + int(addr/64)]
+            y += [addr%64]
+            w += [2*int(bit) - 1]
+    return x, y, w
+
+def bench_plotting(n=100000):
+    '''
+    Compare the time to histogram bit errors and bit maps of `n` reads with
+    the string formatting and numpy paths
+    Returns dict of path : seconds
+    '''
+    import plotting
+    bins = [np.linspace(0,8,65),range(0,65)]
+    faults = list(zip(np.random.randint(0, 2**9, size=n).tolist(), np.random.randint(0, 2**8, size=n).tolist(),
+                      np.random.randint(0, 2**8, size=n).tolist()))
+    bit_map = [(addr, actual) for addr, expected, actual in faults]
+    results = {}
+
+    start = time.time()
+    bit_errors = string_bit_errors(faults)
+    x = [bit_idx/8. + int(addr/64) for addr, bit_idx, error in bit_errors]
+    y = [addr%64 for addr, bit_idx, error in bit_errors]
+    w = [error for addr, bit_idx, error in bit_errors]
+    counts, net = np.histogram2d(x,y,bins)[0], np.histogram2d(x,y,bins,weights=w)[0]
+    results['bit errors string'] = time.time() - start
+
+    start = time.time()
+    numpy_counts, numpy_net = plotting.bit_error_histograms(faults)
+    results['bit errors numpy'] = time.time() - start
+    assert np.array_equal(counts, numpy_counts) and np.array_equal(net, numpy_net)
+
+    start = time.time()
+    x, y, w = string_bit_map(bit_map)
+    values, counts = np.histogram2d(x,y,bins,weights=w)[0], np.histogram2d(x,y,bins)[0]
+    results['bit map string'] = time.time() - start
+
+    start = time.time()
+    numpy_values, numpy_counts = plotting.bit_map_histograms(bit_map)
+    results['bit map numpy'] = time.time() - start
+    assert np.array_equal(values, numpy_values) and np.array_equal(counts, numpy_counts)
+
+    for key in sorted(results.keys()):
+        print('{} ({} reads): {:.3f}s'.format(key, n, results[key]))
+    print('bit errors speedup: {:.1f}x, bit map speedup: {:.1f}x'.format(
+        results['bit errors string']/results['bit errors numpy'], results['bit map string']/results['bit map numpy']))
+    return results
+
+def bench_bitmaps(n_reads=(1e4, 1e5, 1e6)):
+    '''
+    Compare the memory and time to collect and histogram the bitmap of
+    `n_reads` reads as a list of (addr, read) and as `BitCounts`
+    '''
+    import plotting
+    print('bitmap\treads\ttime [s]\tpeak [kB]')
+    for n in n_reads:
+        n = int(n)
+        addrs = np.random.randint(0, 2**9, size=n)
+        reads = np.random.randint(0, 2**8, size=n)
+        for kind in ('list', 'BitCounts'):
+            tracemalloc.start()
+            start = time.time()
+            if kind == 'list':
+                bit_map = []
+                for chunk in range(0, n, 4096):
+                    bit_map += list(zip(addrs[chunk:chunk+4096].tolist(), reads[chunk:chunk+4096].tolist()))
+            else:
+                bit_map = BitCounts()
+                for chunk in range(0, n, 4096):
+                    bit_map.add(addrs[chunk:chunk+4096], reads[chunk:chunk+4096])
+            values, counts = plotting.bit_map_histograms(bit_map)
+            seconds = time.time() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('{}\t{}\t{:.3g}\t{:.0f}'.format(kind, n, seconds, peak/1e3))
+            del bit_map
+
+def bench_logger(n=100000):
+    '''
+    Compare capture rates of the .csv.gz and binary `CryoLogger` formats
+    Returns dict of format : frames/sec
+    '''
+    frames = FrameCodec.encode(FrameCodec.WRITE_VAL, np.random.randint(0, 2**8, size=n))
+    frames = [frames[2*i:2*i+2] for i in range(n)]
+    results = {}
+    for binary in (False, True):
+        log = quiet_logger(binary=binary)
+        write = log.capture_write(lambda write_bytes: len(write_bytes))
+        start = time.time()
+        for frame in frames:
+            write(frame)
+        log.close()
+        key = 'binary' if binary else 'csv'
+        results[key] = n/(time.time() - start)
+        print('logger {}: {:.3g} frames/s, {} bytes'.format(key, results[key],
+            os.path.getsize(log.directory + '/' + log.dat_filename)))
+    return results
+
+def bench_logger_jitter(n=100000, max_buffer_len=1000, interval=2e-5):
+    '''
+    Compare per-command latency of captured writes with synchronous and
+    background flushing
+    Writes are `interval` [s] apart (a 2-byte frame at 1 MBaud), sleeping in
+    between as the serial io would (0 to write back to back)
+    Returns dict of mode : (median, 99.9th percentile, max) latency [s] and
+    the number of writes that took over 1 ms
+    '''
+    frames = FrameCodec.encode(FrameCodec.WRITE_VAL, np.random.randint(0, 2**8, size=n))
+    frames = [frames[2*i:2*i+2] for i in range(n)]
+    results = {}
+    for binary in (False, True):
+        for async_flush in (False, True):
+            log = quiet_logger(binary=binary, async_flush=async_flush, max_buffer_len=max_buffer_len)
+            write = log.capture_write(lambda write_bytes: len(write_bytes))
+            latency = np.zeros(n)
+            for i, frame in enumerate(frames):
+                start = time.perf_counter()
+                write(frame)
+                latency[i] = time.perf_counter() - start
+                if interval:
+                    time.sleep(interval)
+            log.close()
+            key = '{} async={}'.format('binary' if binary else 'csv', async_flush)
+            results[key] = (np.median(latency), np.percentile(latency, 99.9), latency.max(), int(np.sum(latency > 1e-3)))
+            print('logger latency {}: median {:.2g}s, p99.9 {:.2g}s, max {:.2g}s, {} over 1ms {}'.format(
+                key, results[key][0], results[key][1], results[key][2], results[key][3],
+                log.writer_stats() if async_flush else ''))
+    return results
+
+def bench_metrics(test_name='mats_test', n=5):
+    '''
+    Compare run time of a standard test with and without metrics
+    Returns dict of metrics : seconds
+    '''
+    results = {}
+    for metrics in (False, True):
+        c = CryoSRAM(io=SimFPGA(), log=quiet_logger(), metrics=metrics)
+        start = time.time()
+        for i in range(n):
+            getattr(c, test_name)()
+        results[metrics] = (time.time() - start)/n
+        print('{} metrics={}: {:.4f}s'.format(test_name, metrics, results[metrics]))
+        c.log.close()
+    print('metrics overhead: {:.1%}'.format(results[True]/results[False] - 1))
+    return results
+
+def bench_replay(n_tests=20):
+    '''
+    Measure the rate at which `Replay` decodes the capture of `n_tests`
+    pattern and mats tests, in both capture formats
+    Returns dict of format : frames/sec
+    '''
+    from replay import Replay
+    results = {}
+    for binary in (False, True):
+        c = CryoSRAM(io=SimFPGA(), log=quiet_logger(binary=binary))
+        for i in range(n_tests):
+            c.set_clk(25)
+            c.pattern_test()
+            c.mats_test()
+        c.log.close()
+        r = Replay()
+        r.replay(c.log.directory + '/' + c.log.dat_filename)
+        key = 'binary' if binary else 'csv'
+        results[key] = r.stats['frames']/r.stats['seconds']
+        print('replay {}: {} frames, {:.3g} frames/s'.format(key, r.stats['frames'], results[key]))
+    return results
+
+baseline_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+def measure(setup, repeat=5):
+    '''
+    Runs a benchmark case: `setup()` returns (callable, cleanup or None) and
+    the callable returns the number of ops it did
+    The wall time is the fastest of `repeat` runs, then one more run is
+    traced for the peak memory and number of allocated blocks
+    Random generators are seeded before each run
+    returns dict of seconds, ops, ops_per_s, peak_bytes, allocations
+    '''
+    def run(trace=False):
+        random.seed(0)
+        np.random.seed(0)
+        fn, cleanup = setup()
+        try:
+            if trace:
+                tracemalloc.start()
+                before = tracemalloc.take_snapshot()
+                tracemalloc.reset_peak()
+            start = time.perf_counter()
+            ops = fn()
+            seconds = time.perf_counter() - start
+            if trace:
+                peak = tracemalloc.get_traced_memory()[1]
+                stats = tracemalloc.take_snapshot().compare_to(before, 'lineno')
+                allocations = sum([stat.count_diff for stat in stats if stat.count_diff > 0])
+                tracemalloc.stop()
+                return seconds, ops, peak, allocations
+            return seconds, ops
+        finally:
+            if cleanup is not None:
+                cleanup()
+
+    seconds, ops = min([run() for i in range(repeat)])
+    peak, allocations = run(trace=True)[2:]
+    return dict(seconds=seconds, ops=ops, ops_per_s=ops/max(seconds, 1e-9), peak_bytes=peak,
+                allocations=allocations)
+
+def sim_test_case(test_name, **kwargs):
+    '''
+    Returns a `measure` setup that runs a standard test on a `SimFPGA`
+    (ops are frames received by the fpga)
+    '''
+    def setup():
+        io = SimFPGA()
+        c = CryoSRAM(io=io, log=quiet_logger(), **kwargs)
+        def fn():
+            getattr(c, test_name)()
+            return io.n_frames
+        return fn, c.log.close
+    return setup
+
+def rand_case(n_dynamic, stream=False):
+    '''
+    Returns a `measure` setup that runs `rand_test` (or drains `rand_stream`)
+    with `n_dynamic` ops on a `SimFPGA` with a binary capture (ops are
+    frames received by the fpga)
+    '''
+    def setup():
+        io = SimFPGA()
+        c = CryoSRAM(io=io, log=quiet_logger(binary=True))
+        def fn():
+            if stream:
+                for record in c.rand_stream(n_dynamic=n_dynamic, seed=0):
+                    pass
+            else:
+                c.rand_test(n_dynamic=n_dynamic)
+            return io.n_frames
+        return fn, c.log.close
+    return setup
+
+def bench_rand_stream(n_ops=(1e4, 4e4, 1.6e5)):
+    '''
+    Compare the peak memory of `rand_test` and `rand_stream` as the number
+    of dynamic ops grows
+    Returns dict of (stream, n) : `measure` results
+    '''
+    results = {}
+    print('test\tops\tframes/s\tpeak [kB]')
+    for n in n_ops:
+        for stream in (False, True):
+            results[stream, n] = measure(rand_case(n, stream), repeat=1)
+            print('{}\t{:.0f}\t{:.3g}\t{:.0f}'.format('rand_stream' if stream else 'rand_test', n,
+                                                     results[stream, n]['ops_per_s'],
+                                                     results[stream, n]['peak_bytes']/1e3))
+    return results
+
+def suite_case(clk_factors=(25, 5, 1)):
+    '''
+    Returns a `measure` setup that runs `run_test_suite` on a `SimFPGA`
+    '''
+    from test_suite import run_test_suite
+    def setup():
+        io = SimFPGA()
+        c = CryoSRAM(io=io, log=quiet_logger())
+        def fn():
+            run_test_suite(c, clk_factors=list(clk_factors))
+            return io.n_frames
+        return fn, c.log.close
+    return setup
+
+def codec_case(mode, n=100000):
+    '''
+    Returns a `measure` setup for frame encoding ('encode') or response
+    decoding ('decode') of `n` frames
+    '''
+    def setup():
+        values = np.random.randint(0, 2**8, size=n)
+        if mode == 'encode':
+            addrs = np.random.randint(0, 2**9, size=n)
+            opcodes = np.tile([FrameCodec.SET_ADDR, FrameCodec.WRITE_VAL], n)
+            messages = np.stack([addrs, values], axis=-1).ravel()
+            return (lambda: len(FrameCodec.encode(opcodes, messages))//2), None
+        rx = FrameCodec.encode(FrameCodec.READ_VAL, values)
+        return (lambda: len(FrameCodec.decode_responses(rx, [FrameCodec.READ_VAL]*n))), None
+    return setup
+
+def logger_case(n=100000, **kwargs):
+    '''
+    Returns a `measure` setup that captures `n` frames with a `CryoLogger`
+    (ops are frames, including the final flush)
+    '''
+    def setup():
+        frames = FrameCodec.encode(FrameCodec.WRITE_VAL, np.random.randint(0, 2**8, size=n))
+        frames = [frames[2*i:2*i+2] for i in range(n)]
+        log = quiet_logger(**kwargs)
+        write = log.capture_write(lambda write_bytes: len(write_bytes))
+        def fn():
+            for frame in frames:
+                write(frame)
+            log.close()
+            return n
+        return fn, log.close
+    return setup
+
+def plotting_case(kind, n=100000):
+    '''
+    Returns a `measure` setup that histograms `n` faults ('bit_errors') or
+    reads ('bit_map'), or counts and histograms `n` reads ('bit_counts')
+    '''
+    import plotting
+    def setup():
+        addrs = np.random.randint(0, 2**9, size=n).tolist()
+        reads = np.random.randint(0, 2**8, size=n).tolist()
+        if kind == 'bit_errors':
+            faults = list(zip(addrs, np.random.randint(0, 2**8, size=n).tolist(), reads))
+            return (lambda: plotting.bit_error_histograms(faults) and n), None
+        if kind == 'bit_counts':
+            def fn():
+                bit_counts = BitCounts()
+                bit_counts.add(addrs, reads, reads)
+                plotting.bit_map_histograms(bit_counts)
+                return n
+            return fn, None
+        bit_map = list(zip(addrs, reads))
+        return (lambda: plotting.bit_map_histograms(bit_map) and n), None
+    return setup
+
+def suite_cases():
+    '''
+    Returns dict of case name : `measure` setup of the benchmark suite
+    '''
+    cases = {
+        'codec encode': codec_case('encode', n=1000000),
+        'codec decode': codec_case('decode'),
+        'plotting bit_errors': plotting_case('bit_errors'),
+        'plotting bit_map': plotting_case('bit_map'),
+        'plotting bit_counts': plotting_case('bit_counts'),
+        'logger csv': logger_case(n=20000),
+        'logger binary': logger_case(n=20000, binary=True),
+        'logger csv async': logger_case(n=20000, async_flush=True),
+        'logger binary async': logger_case(n=20000, binary=True, async_flush=True),
+    }
+    for test_name in ('mats_test', 'pattern_test', 'single_bit_test', 'rand_test'):
+        cases[test_name] = sim_test_case(test_name)
+    cases['mats_test fpga'] = sim_test_case('mats_test', engine='fpga')
+    cases['rand_test 20000'] = rand_case(20000)
+    cases['rand_stream'] = rand_case(20000, stream=True)
+    cases['run_test_suite'] = suite_case()
+    return cases
+
+def bench_suite(save=False, tolerance=0.3, filename=baseline_file):
+    '''
+    Runs every case of `suite_cases` and compares it with the baseline in
+    `filename`: a case regresses if its ops/s fall, or its peak memory
+    grows, by more than `tolerance`
+    If `save`, the results are written as the new baseline
+    Returns dict of case : results and list of regressed cases
+    '''
+    baseline = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            baseline = json.load(f)
+    results = {}
+    regressions = []
+    print('case\tops/s\tbaseline\twall [s]\tpeak [kB]\tallocations')
+    for name, setup in suite_cases().items():
+        results[name] = measure(setup)
+        previous = baseline.get(name)
+        flag = ''
+        if previous is not None and not save:
+            if (results[name]['ops_per_s'] < (1 - tolerance)*previous['ops_per_s']
+                or results[name]['peak_bytes'] > (1 + tolerance)*previous['peak_bytes']):
+                regressions += [name]
+                flag = ' REGRESSION'
+        print('{}\t{:.3g}\t{}\t{:.4f}\t{:.0f}\t{}{}'.format(
+            name, results[name]['ops_per_s'], '-' if previous is None else '{:.3g}'.format(previous['ops_per_s']),
+            results[name]['seconds'], results[name]['peak_bytes']/1e3, results[name]['allocations'], flag))
+    if save:
+        with open(filename, 'w') as f:
+            json.dump(results, f, indent=1, sort_keys=True)
+        print('Saved baseline to {}'.format(filename))
+    elif len(regressions):
+        print('{} regressions: {}'.format(len(regressions), ', '.join(regressions)))
+    return results, regressions
+
+def main(args):
+    tests = args[1:] if len(args) > 1 else ['codec', 'plotting', 'logger', 'logger_jitter', 'replay', 'block', 'engine', 'optimize', 'mats_test', 'pattern_test']
+    for test_name in tests:
+        if test_name == 'suite':
+            if len(bench_suite()[1]):
+                sys.exit(1)
+        elif test_name == 'baseline':
+            bench_suite(save=True)
+        elif test_name == 'codec':
+            bench_codec()
+        elif test_name == 'logger':
+            bench_logger()
+        elif test_name == 'metrics':
+            bench_metrics()
+        elif test_name == 'rand_stream':
+            bench_rand_stream()
+        elif test_name == 'replay':
+            bench_replay()
+        elif test_name == 'plotting':
+            bench_plotting()
+        elif test_name == 'bitmaps':
+            bench_bitmaps()
+        elif test_name == 'logger_jitter':
+            bench_logger_jitter()
+        elif test_name == 'block':
+            bench_block()
+        elif test_name == 'engine':
+            bench_engine()
+        elif test_name == 'optimize':
+            bench_optimize()
+        elif test_name == 'boards':
+            bench_boards()
+        elif test_name == 'async':
+            bench_async()
+        else:
+            bench_pipeline(test_name)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,120 @@
+'''
+Per-address, per-bit counters of the reads of a test stage, used in place of
+lists of every (addr, read):
+  counts = BitCounts(512)
+  counts.add(addrs, reads, expected) # arrays, None for unknown values
+  counts.ones[addr, bit] # reads of 1 (also zeros, errors_01, errors_10)
+  len(counts) # number of reads
+  total = merge_counts([counts_a, counts_b])
+Memory use is O(addresses x bits) however many reads are added. Bit index 0
+is the most significant bit (as `np.unpackbits`)
+'''
+import numpy as np
+
+def optional_array(values, n=None):
+    '''
+    Converts a list or array of values (None for unknown) to an int array
+    with -1 for unknown values (all unknown if `values` is None)
+    '''
+    if values is None:
+        return np.full(n, -1, dtype=np.int64)
+    values = np.asarray(values)
+    if values.dtype != object:
+        return values.astype(np.int64)
+    known = values != None
+    array = np.full(len(values), -1, dtype=np.int64)
+    array[known] = values[known].astype(np.int64)
+    return array
+
+class BitCounts :
+    '''
+    Counts of each bit of each address read as 1 (`ones`) and 0 (`zeros`),
+    and of reads of 1 where 0 was expected (`errors_01`) and of 0 where 1 was
+    expected (`errors_10`). Each is an array indexed by [addr, bit]
+    '''
+    def __init__(self, n_addr=512):
+        self.n_addr = n_addr
+        self.counts = np.zeros((4, n_addr, 8), dtype=np.int64) # ones, zeros, errors_01, errors_10
+
+    @property
+    def ones(self):
+        return self.counts[0]
+
+    @property
+    def zeros(self):
+        return self.counts[1]
+
+    @property
+    def errors_01(self):
+        return self.counts[2]
+
+    @property
+    def errors_10(self):
+        return self.counts[3]
+
+    def __len__(self):
+        '''
+        Number of reads added (with a known value)
+        '''
+        return int(self.ones[:,0].sum() + self.zeros[:,0].sum())
+
+    def __repr__(self):
+        return 'BitCounts(n_addr={}, reads={}, bit errors={})'.format(
+            self.n_addr, len(self), int(self.errors_01.sum() + self.errors_10.sum()))
+
+    def __eq__(self, other):
+        return isinstance(other, BitCounts) and np.array_equal(self.counts, other.counts)
+
+    def __iadd__(self, other):
+        self.counts += other.counts
+        return self
+
+    def __add__(self, other):
+        return self.copy().__iadd__(other)
+
+    def copy(self):
+        '''
+        Returns a snapshot of the counters
+        '''
+        counts = BitCounts(self.n_addr)
+        counts.counts[:] = self.counts
+        return counts
+
+    def add(self, addrs, reads, expected=None):
+        '''
+        Counts the bits of `reads` at `addrs` (unknown reads are skipped)
+        Reads are checked against `expected` where it is known
+        '''
+        addrs = np.asarray(addrs, dtype=np.int64).ravel()
+        reads = optional_array(reads, len(addrs))
+        expected = optional_array(expected, len(addrs))
+        known = reads >= 0
+        if not np.all(known):
+            addrs, reads, expected = addrs[known], reads[known], expected[known]
+        if not len(addrs):
+            return
+        size = self.n_addr*8
+        bits = np.unpackbits(reads.astype(np.uint8)[:,np.newaxis], axis=1).view(bool)
+        bins = addrs[:,np.newaxis]*8 + np.arange(8)
+        ones = np.bincount(bins[bits], minlength=size).reshape(self.n_addr, 8)
+        self.counts[0] += ones
+        self.counts[1] += np.bincount(addrs, minlength=self.n_addr)[:,np.newaxis] - ones
+        # only reads that differ from a known expected value have errors
+        wrong = (expected >= 0) & (reads != expected)
+        if not np.any(wrong):
+            return
+        bits, bins = bits[wrong], bins[wrong]
+        expected_bits = np.unpackbits(expected[wrong].astype(np.uint8)[:,np.newaxis], axis=1).view(bool)
+        # a single bincount of errors_01 and errors_10 (offset by size)
+        errors = np.bincount(np.concatenate((bins[bits & ~expected_bits], bins[expected_bits & ~bits] + size)),
+                             minlength=2*size).reshape(2, self.n_addr, 8)
+        self.counts[2:] += errors
+
+def merge_counts(counts):
+    '''
+    Returns the sum of a list of `BitCounts` (None if empty)
+    '''
+    total = None
+    for stage_counts in counts:
+        total = stage_counts.copy() if total is None else total.__iadd__(stage_counts)
+    return total
@@ -0,0 +1,276 @@
+import os
+import time
+import gzip
+import zlib
+import mmap
+import struct
+from datetime import datetime
+import numpy as np
+
+# fixed-width capture record
+#  time - monotonic time of the read/write call [ns]
+#  direction - TX (0) or RX (1)
+#  n_bytes - valid bytes in data (1 or 2)
+#  data - raw bytes
+capture_dtype = np.dtype([('time', '<i8'), ('direction', 'u1'), ('n_bytes', 'u1'), ('data', 'u1', (2,))])
+TX = 0
+RX = 1
+directions = ['TX', 'RX']
+
+file_magic = b'CRYOCAP1'
+file_header = struct.Struct('<8sqq') # magic, wall clock time [ns], monotonic time [ns]
+chunk_magic = b'CHNK'
+chunk_header = struct.Struct('<4sII') # magic, n records, compressed size
+
+class CaptureWriter :
+    '''
+    Buffers capture records in a preallocated array and appends them to a
+    binary capture file as zlib-compressed chunks
+    File layout:
+      header: 'CRYOCAP1', wall clock time [ns], monotonic time [ns]
+      chunks: 'CHNK', n records, compressed size, compressed columns
+    Within a chunk each field is stored as a contiguous column (times as
+    differences) to improve compression
+    Each chunk can be skipped without decompressing it, and new chunks can
+    be appended to an existing file
+    '''
+
+    def __init__(self, filename, max_buffer_len=10e3, compression=1):
+        self.filename = filename
+        self.compression = compression
+        self.buffer = np.zeros(int(max_buffer_len), dtype=capture_dtype)
+        self.n_records = 0
+        self.metrics = None # `metrics.Metrics` of chunk writes
+
+        append = os.path.exists(filename) and os.path.getsize(filename) >= file_header.size
+        self.file = open(filename, 'ab')
+        if not append:
+            self.file.write(file_header.pack(file_magic, time.time_ns(), time.monotonic_ns()))
+            self.file.flush()
+
+    @property
+    def closed(self):
+        return self.file.closed
+
+    def capture(self, direction, data, t=None):
+        '''
+        Store raw bytes read or written in one call (split into 2-byte records)
+        `t` is the monotonic time of the call [ns] (defaults to now)
+        '''
+        data = np.frombuffer(bytes(data), dtype=np.uint8)
+        n = (len(data) + 1)//2
+        if not n:
+            return
+        if self.n_records + n > len(self.buffer):
+            self.flush()
+        if n > len(self.buffer):
+            # too large to buffer - write directly
+            self.write_chunk(make_records(direction, data, t))
+            return
+        fill_records(self.buffer[self.n_records:self.n_records+n], direction, data, t)
+        self.n_records += n
+
+    def capture_records(self, records):
+        '''
+        Store prepared capture records (e.g. from `call_records`)
+        '''
+        if self.n_records + len(records) > len(self.buffer):
+            self.flush()
+        if len(records) > len(self.buffer):
+            self.write_chunk(records)
+            return
+        self.buffer[self.n_records:self.n_records+len(records)] = records
+        self.n_records += len(records)
+
+    def write_chunk(self, records):
+        '''
+        Compress and append records to file
+        '''
+        start = time.perf_counter()
+        payload = zlib.compress(pack_columns(records), self.compression)
+        self.file.write(chunk_header.pack(chunk_magic, len(records), len(payload)))
+        self.file.write(payload)
+        if self.metrics is not None:
+            self.metrics.flush(time.perf_counter() - start, len(records))
+
+    def flush(self):
+        '''
+        Write buffered records as one chunk, clearing buffer
+        '''
+        if self.n_records:
+            self.write_chunk(self.buffer[:self.n_records])
+            self.n_records = 0
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+def fill_records(records, direction, data, t=None):
+    '''
+    Fills capture records with the raw bytes (uint8 array) of a single call
+    '''
+    records['time'] = time.monotonic_ns() if t is None else t
+    records['direction'] = direction
+    records['n_bytes'] = 2
+    # the data field is not contiguous, so it is filled as (n, 2) rather than
+    # through a flattened copy
+    n_full = len(data)//2
+    records['data'][:n_full] = data[:2*n_full].reshape(-1,2)
+    if len(data) % 2:
+        records['n_bytes'][-1] = 1
+        records['data'][-1] = (data[-1], 0)
+
+def make_records(direction, data, t=None):
+    '''
+    Returns capture records for the raw bytes of a single call
+    '''
+    data = np.frombuffer(bytes(data), dtype=np.uint8)
+    records = np.zeros((len(data) + 1)//2, dtype=capture_dtype)
+    fill_records(records, direction, data, t)
+    return records
+
+def call_records(calls):
+    '''
+    Returns capture records for a list of (time [ns], direction, raw bytes)
+    read/write calls, built with one numpy pass rather than per call
+    '''
+    if not len(calls):
+        return np.zeros(0, dtype=capture_dtype)
+    times, call_directions, datas = zip(*calls)
+    lengths = np.array([len(data) for data in datas], dtype=np.int64)
+    n = (lengths + 1)//2
+    records = np.zeros(int(n.sum()), dtype=capture_dtype)
+    records['time'] = np.repeat(np.array(times, dtype=np.int64), n)
+    records['direction'] = np.repeat(np.array(call_directions, dtype=np.uint8), n)
+    records['n_bytes'] = 2
+    records['n_bytes'][(np.cumsum(n) - 1)[lengths % 2 == 1]] = 1
+    data = b''.join([data + b'\x00' if len(data) % 2 else data for data in datas])
+    records['data'] = np.frombuffer(data, dtype=np.uint8).reshape(-1,2)
+    return records
+
+def pack_columns(records):
+    '''
+    Serializes records column by column, with times stored as differences
+    '''
+    times = np.diff(records['time'], prepend=np.int64(0))
+    return b''.join([times.astype('<i8').tobytes(), records['direction'].tobytes(),
+                     records['n_bytes'].tobytes(), records['data'].tobytes()])
+
+def unpack_columns(payload, n_records):
+    '''
+    Inverse of `pack_columns`
+    '''
+    records = np.zeros(n_records, dtype=capture_dtype)
+    offset = 8*n_records
+    records['time'] = np.cumsum(np.frombuffer(payload[:offset], dtype='<i8'))
+    records['direction'] = np.frombuffer(payload[offset:offset+n_records], dtype=np.uint8)
+    offset += n_records
+    records['n_bytes'] = np.frombuffer(payload[offset:offset+n_records], dtype=np.uint8)
+    offset += n_records
+    records['data'] = np.frombuffer(payload[offset:offset+2*n_records], dtype=np.uint8).reshape(-1,2)
+    return records
+
+def read_capture_header(filename):
+    '''
+    Returns (wall clock time [ns], monotonic time [ns]) at the start of a
+    binary capture file
+    '''
+    with open(filename, 'rb') as f:
+        magic, wall_ns, mono_ns = file_header.unpack(f.read(file_header.size))
+    if magic != file_magic:
+        raise ValueError('{} is not a capture file'.format(filename))
+    return wall_ns, mono_ns
+
+def iter_capture(filename):
+    '''
+    Generator of record arrays from a binary capture file (one per chunk)
+    The file is memory-mapped, so only one chunk is decompressed at a time
+    An incomplete final chunk (e.g. from a crash) is ignored
+    '''
+    read_capture_header(filename)
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= file_header.size:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = file_header.size
+            while offset + chunk_header.size <= len(mm):
+                magic, n_records, size = chunk_header.unpack_from(mm, offset)
+                offset += chunk_header.size
+                if magic != chunk_magic or offset + size > len(mm):
+                    break
+                records = unpack_columns(zlib.decompress(mm[offset:offset+size]), n_records)
+                offset += size
+                yield records
+        finally:
+            mm.close()
+
+def load_capture(filename):
+    '''
+    Returns all records of a binary capture file as one array
+    '''
+    chunks = list(iter_capture(filename))
+    if not len(chunks):
+        return np.zeros(0, dtype=capture_dtype)
+    return np.concatenate(chunks)
+
+def capture_bytes(records, direction):
+    '''
+    Returns the raw byte stream in one direction from capture records
+    '''
+    records = records[records['direction'] == direction]
+    data = records['data'].reshape(-1)
+    if np.all(records['n_bytes'] == 2):
+        return data.tobytes()
+    valid = np.ones((len(records), 2), dtype=bool)
+    valid[:,1] = records['n_bytes'] == 2
+    return data[valid.reshape(-1)].tobytes()
+
+def export_csv(filename, csv_filename, msgtime_fmt='%Y_%m_%d_%H_%M_%S_%f'):
+    '''
+    Converts a binary capture file into the `CryoLogger` .csv.gz format
+    One row per read/write call: <time>, <TX/RX>, <bits>
+    '''
+    wall_ns, mono_ns = read_capture_header(filename)
+    with gzip.open(csv_filename, 'wt') as csv_file:
+        row = None
+        for records in iter_capture(filename):
+            for record in records.tolist():
+                key = record[:2]
+                bits = ''.join([format(byte,'08b') for byte in record[3][:record[2]]])
+                if row is not None and row[0] == key:
+                    row[1].append(bits)
+                    continue
+                if row is not None:
+                    csv_file.write(format_row(row, wall_ns, mono_ns, msgtime_fmt))
+                row = (key, [bits])
+        if row is not None:
+            csv_file.write(format_row(row, wall_ns, mono_ns, msgtime_fmt))
+
+def format_rows(calls, wall_ns, mono_ns, msgtime_fmt, to01):
+    '''
+    Formats a list of (time [ns], direction, raw bytes) calls as .csv.gz
+    rows (as `format_row`), formatting the date of each second only once
+    when `msgtime_fmt` ends with microseconds
+    '''
+    if not msgtime_fmt.endswith('%f'):
+        return ''.join([format_row(((t, direction), [to01(data)]), wall_ns, mono_ns, msgtime_fmt)
+                        for t, direction, data in calls])
+    seconds_fmt = msgtime_fmt[:-2]
+    prefixes = {}
+    rows = []
+    for t, direction, data in calls:
+        us = (wall_ns + t - mono_ns + 500)//1000
+        second, us = divmod(us, 1000000)
+        prefix = prefixes.get(second)
+        if prefix is None:
+            prefix = prefixes[second] = datetime.fromtimestamp(second).strftime(seconds_fmt)
+        rows.append('{}{:06d}, {}, {}\n'.format(prefix, us, directions[direction], to01(data)))
+    return ''.join(rows)
+
+def format_row(row, wall_ns, mono_ns, msgtime_fmt):
+    (t, direction), bits = row
+    timestamp = datetime.fromtimestamp((wall_ns + t - mono_ns)*1e-9).strftime(msgtime_fmt)
+    return ', '.join([timestamp, directions[direction], ''.join(bits)]) + '\n'
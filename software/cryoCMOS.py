@@ -1,13 +1,23 @@
 #!/usr/bin/python
 import time
+import math
 from datetime import datetime
 import struct
+import json
 import os
 import sys
 import logging
 import gzip
+import threading
+import queue
 from random import randint
 from bitarray import bitarray
+import numpy as np
+from sram_sim import SimFPGA
+import capture
+from metrics import Metrics
+from march import parse_march, format_march, march_algorithms, march_results, march_end_addr
+from bitcounts import BitCounts
 
 class CryoLogger :
     '''
@@ -16,33 +26,70 @@ class CryoLogger :
     filename_fmt = '%Y_%m_%d_%H_%M_%S'
     msgtime_fmt = '%Y_%m_%d_%H_%M_%S_%f'
     log_level = logging.DEBUG
+    max_buffer_bytes = 2**19 # captured bytes buffered before a flush (in addition to `max_buffer_len` messages)
 
-    def __init__(self, directory='.', max_buffer_len=10e3):
+    def __init__(self, directory='.', max_buffer_len=10e3, binary=False,
+                 async_flush=False, max_pending_buffers=64, backpressure='block', name=None):
+        '''
+        `name` gives the logger its own `logging` name ('CryoLogger.<name>')
+        and tags its messages, so several loggers can be used at once (e.g.
+        one per board)
+        `binary` stores read/write messages as fixed-width records in a
+        compressed binary capture file (see `capture.py`) rather than a
+        .csv.gz of bit strings
+        `async_flush` formats and writes messages on a background thread.
+        Captured messages are handed to the thread in buffers of
+        `max_buffer_len`, with at most `max_pending_buffers` waiting. When
+        the queue is full `backpressure` sets whether the capture blocks
+        ('block') or the buffer is dropped ('drop')
+        '''
         self.directory = directory
+        self.binary = binary
 
         self.filename = time.strftime(CryoLogger.filename_fmt)
         self.log_filename = self.filename + '.log'
-        self.dat_filename = self.filename + '.csv.gz'
+        self.dat_filename = self.filename + ('.cap' if binary else '.csv.gz')
 
-        self.formatter = logging.Formatter(fmt='%(asctime)s %(levelname)s: %(message)s',
-                                           datefmt='%d-%b-%y %H:%M:%S')
+        fmt = '%(asctime)s %(levelname)s: %(message)s' if name is None else '%(asctime)s %(name)s %(levelname)s: %(message)s'
+        self.formatter = logging.Formatter(fmt=fmt, datefmt='%d-%b-%y %H:%M:%S')
         self.stdout = logging.StreamHandler(stream=sys.stdout)
         self.stdout.setFormatter(self.formatter)
         self.stdout.setLevel(self.log_level)
         self.logfile = logging.FileHandler(filename=self.directory + '/' + self.log_filename)
         self.logfile.setFormatter(self.formatter)
         self.logfile.setLevel(self.log_level)
-        self.logger = logging.getLogger('CryoLogger')
+        self.logger = logging.getLogger('CryoLogger' if name is None else 'CryoLogger.' + name)
+        self.logger.propagate = name is None
         self.logger.setLevel(self.log_level)
         self.logger.addHandler(self.stdout)
         self.logger.addHandler(self.logfile)
 
-        self.dat_file = gzip.open(self.directory + '/' + self.dat_filename, 'wt')
         self.max_buffer_len = max_buffer_len
+        if self.binary:
+            self.dat_file = capture.CaptureWriter(self.directory + '/' + self.dat_filename, max_buffer_len)
+        else:
+            self.dat_file = gzip.open(self.directory + '/' + self.dat_filename, 'wt')
         self.write_buffer = []
+        self.buffer_bytes = 0
+        self.metrics = None # `metrics.Metrics` of flushes (set by `CryoSRAM`)
+        self.lock = threading.RLock() # captures may come from the read and write threads of an `AsyncTransport`
         self.captured_read_method = None
         self.captured_write_method = None
 
+        self.async_flush = async_flush
+        self.backpressure = backpressure
+        self.writer = None
+        self.n_blocked = 0 # buffers that waited for space in the queue
+        self.n_dropped = 0 # messages dropped due to a full queue
+        self.n_written = 0 # messages written by the background thread
+        self.max_pending = 0 # most buffers waiting at once
+        if self.async_flush:
+            self.wall_ns, self.mono_ns = time.time_ns(), time.monotonic_ns()
+            self.pending_buffers = queue.Queue(maxsize=max_pending_buffers)
+            self.writer = threading.Thread(target=self.writer_loop, name='CryoLogger writer')
+            self.writer.daemon = True
+            self.writer.start()
+
         self.info('Logging to %s', self.directory)
         self.info('data: %s', self.dat_filename)
         self.info('log: %s', self.log_filename)
@@ -56,12 +103,22 @@ class CryoLogger :
     def close(self):
         '''
         Closes file after flushing buffer
+        With `async_flush`, waits for the background thread to write all
+        captured messages
         '''
+        if self.writer is not None:
+            with self.lock:
+                self.hand_off(block=True)
+            self.pending_buffers.put(None)
+            self.writer.join()
+            self.writer = None
         if self.dat_file and not self.dat_file.closed:
             self.flush_buffer()
             self.dat_file.close()
         if self.logfile:
             self.logfile.close()
+            self.logger.removeHandler(self.logfile)
+            self.logger.removeHandler(self.stdout)
 
     def format_msg(self, msg):
         '''
@@ -75,10 +132,117 @@ class CryoLogger :
     def flush_buffer(self):
         '''
         writes full buffer to file, clearing buffer
+        With `async_flush`, waits for the background thread to write all
+        captured messages
+        '''
+        with self.lock:
+            if self.writer is not None:
+                self.hand_off(block=True)
+                self.pending_buffers.join()
+                return
+            if self.binary:
+                self.dat_file.flush()
+                return
+            start = time.perf_counter()
+            data = ''.join([self.format_msg(msg) for msg in self.write_buffer])
+            self.dat_file.write(data)
+            if self.metrics is not None:
+                self.metrics.flush(time.perf_counter() - start, len(self.write_buffer))
+            self.write_buffer = []
+            self.buffer_bytes = 0
+
+    def hand_off(self, block=False):
+        '''
+        passes buffered messages to the background thread
         '''
-        data = ''.join([self.format_msg(msg) for msg in self.write_buffer])
-        self.dat_file.write(data)
+        if not len(self.write_buffer):
+            return
+        msgs = self.write_buffer
         self.write_buffer = []
+        self.buffer_bytes = 0
+        try:
+            self.pending_buffers.put_nowait(msgs)
+        except queue.Full:
+            if self.backpressure == 'drop' and not block:
+                self.n_dropped += len(msgs)
+                return
+            self.n_blocked += 1
+            self.pending_buffers.put(msgs)
+        self.max_pending = max(self.max_pending, self.pending_buffers.qsize())
+
+    def writer_loop(self):
+        '''
+        background thread: formats and writes buffers of messages until a
+        None is received
+        '''
+        while True:
+            msgs = self.pending_buffers.get()
+            try:
+                if msgs is None:
+                    return
+                if self.binary:
+                    self.dat_file.capture_records(capture.call_records(msgs))
+                else:
+                    start = time.perf_counter()
+                    data = capture.format_rows(msgs, self.wall_ns, self.mono_ns, self.msgtime_fmt, self.to01)
+                    self.dat_file.write(data)
+                    if self.metrics is not None:
+                        self.metrics.flush(time.perf_counter() - start, len(msgs))
+                self.n_written += len(msgs)
+            finally:
+                self.pending_buffers.task_done()
+
+    def writer_stats(self):
+        '''
+        returns dict of background writer counters
+        '''
+        return dict(
+            pending=self.pending_buffers.qsize() if self.async_flush else 0,
+            max_pending=self.max_pending,
+            blocked=self.n_blocked,
+            dropped=self.n_dropped,
+            written=self.n_written
+            )
+
+    @staticmethod
+    def to01(data):
+        '''
+        returns bit string of bytes
+        '''
+        msg = bitarray()
+        msg.frombytes(bytes(data))
+        return msg.to01()
+
+    def store_msg(self, direction, data):
+        '''
+        buffers raw bytes read (`capture.RX`) or written (`capture.TX`)
+        '''
+        with self.lock:
+            if self.writer is not None:
+                self.write_buffer.append((time.monotonic_ns(), direction, bytes(data)))
+                self.buffer_bytes += len(data)
+                if len(self.write_buffer) >= self.max_buffer_len or self.buffer_bytes >= self.max_buffer_bytes:
+                    self.hand_off()
+                return
+            if self.binary:
+                self.dat_file.capture(direction, data)
+                return
+            self.write_buffer += [(datetime.now().strftime(self.msgtime_fmt),
+                                   capture.directions[direction], self.to01(data))]
+            self.buffer_bytes += len(data)
+            if len(self.write_buffer) > self.max_buffer_len or self.buffer_bytes > self.max_buffer_bytes:
+                self.flush_buffer()
+
+    def export_csv(self, csv_filename=None):
+        '''
+        Converts the binary capture file to the .csv.gz format
+        '''
+        if csv_filename is None:
+            csv_filename = self.directory + '/' + self.filename + '.csv.gz'
+        if not self.dat_file.closed:
+            self.flush_buffer()
+        capture.export_csv(self.directory + '/' + self.dat_filename, csv_filename, self.msgtime_fmt)
+        return csv_filename
 
     def capture_read(self, method):
         '''
@@ -87,12 +251,7 @@ class CryoLogger :
         self.captured_read_method = method
         def new_method(*args, **kwargs):
             return_value = method(*args, **kwargs)
-            data = bitarray()
-            data.frombytes(return_value)
-            self.write_buffer += [(datetime.now().strftime(self.msgtime_fmt),
-                                   'RX', data.to01())]
-            if len(self.write_buffer) > self.max_buffer_len:
-                self.flush_buffer()
+            self.store_msg(capture.RX, return_value)
             return return_value
         return new_method
 
@@ -113,12 +272,7 @@ class CryoLogger :
         '''
         self.captured_write_method = method
         def new_method(*args, **kwargs):
-            data = bitarray()
-            data.frombytes(args[0])
-            self.write_buffer += [(datetime.now().strftime(self.msgtime_fmt),
-                                   'TX', data.to01())]
-            if len(self.write_buffer) > self.max_buffer_len:
-                self.flush_buffer()
+            self.store_msg(capture.TX, args[0])
             return method(*args, **kwargs)
         return new_method
 
@@ -149,6 +303,216 @@ class CryoLogger :
     def critical(self, *args, **kwargs):
         self.logger.critical(*args, **kwargs)
 
+class FrameCodec :
+    '''
+    Precomputed encoding/decoding of the 2-byte fpga messages
+      byte0[7:4] = message type
+      byte0[3:0] = message[11:8]
+      byte1[7:0] = message[7:0]
+    '''
+    NOP = 0x0
+    SET_ADDR = 0x1
+    WRITE_VAL = 0x2
+    READ_ADDR = 0x3
+    READ_VAL = 0x4
+    SET_CLK = 0x5
+    READ_CLK = 0x6
+    SET_DELAY = 0x7
+    WRITE_BLOCK = 0x8
+    READ_BLOCK = 0x9
+    MARCH = 0xA
+    SET_BAUD = 0xB
+    names = {NOP: 'NOP', SET_ADDR: 'SET_ADDR', WRITE_VAL: 'WRITE_VAL', READ_ADDR: 'READ_ADDR', READ_VAL: 'READ_VAL',
+             SET_CLK: 'SET_CLK', READ_CLK: 'READ_CLK', SET_DELAY: 'SET_DELAY', WRITE_BLOCK: 'WRITE_BLOCK',
+             READ_BLOCK: 'READ_BLOCK', MARCH: 'MARCH', SET_BAUD: 'SET_BAUD'}
+
+    @staticmethod
+    def frame(opcode, message=0):
+        '''
+        Encode a single message as 2 bytes
+        '''
+        return bytes(bytearray([(opcode << 4) | ((message >> 8) & 0xf), message & 0xff]))
+
+    @staticmethod
+    def encode(opcodes, messages, pad=None):
+        '''
+        Encode arrays of opcodes and messages into a single byte string
+        `pad` is an optional array of NOP bytes to insert after each frame
+        '''
+        opcodes, messages = np.broadcast_arrays(np.asarray(opcodes, dtype=np.uint16).ravel(),
+                                                np.asarray(messages, dtype=np.uint16).ravel())
+        header = ((opcodes << 4) | ((messages >> 8) & 0xf)).astype(np.uint8)
+        word = (messages & 0xff).astype(np.uint8)
+        if pad is None:
+            return np.stack([header, word], axis=-1).tobytes()
+        pad = np.broadcast_to(np.asarray(pad, dtype=np.int64), opcodes.shape)
+        offsets = np.zeros(len(opcodes), dtype=np.int64)
+        offsets[1:] = np.cumsum(2 + pad)[:-1]
+        data = np.zeros(int(np.sum(2 + pad)), dtype=np.uint8)
+        data[offsets] = header
+        data[offsets+1] = word
+        return data.tobytes()
+
+    @staticmethod
+    def decode(read_bytes):
+        '''
+        Decode a byte string of complete 2-byte responses
+        returns arrays of (opcodes, messages)
+        '''
+        data = np.frombuffer(bytes(read_bytes), dtype=np.uint8)
+        data = data[:len(data)//2*2].reshape(-1,2).astype(np.uint16)
+        return data[:,0] >> 4, ((data[:,0] & 0xf) << 8) | data[:,1]
+
+    @staticmethod
+    def response_lengths(opcodes):
+        '''
+        Returns array of response bytes for each opcode
+        '''
+        opcodes = np.asarray(opcodes)
+        return np.where(opcodes == FrameCodec.READ_BLOCK, 1, 2)
+
+    @staticmethod
+    def decode_responses(read_bytes, opcodes):
+        '''
+        Decode the concatenated responses to a sequence of read commands
+        (READ_BLOCK contributes one entry per value)
+        returns list of values (None for missing responses)
+          READ_ADDR - 12-bit message
+          READ_VAL, READ_CLK - message[7:0]
+          READ_BLOCK - raw byte
+        '''
+        opcodes = np.asarray(opcodes)
+        lengths = FrameCodec.response_lengths(opcodes)
+        ends = np.cumsum(lengths)
+        offsets = ends - lengths
+        data = np.zeros(int(ends[-1]) + 1 if len(ends) else 1, dtype=np.uint16)
+        rx = np.frombuffer(bytes(read_bytes), dtype=np.uint8)[:len(data)-1]
+        data[:len(rx)] = rx
+        values = np.where(lengths == 1, data[offsets], data[offsets+1])
+        values = np.where(opcodes == FrameCodec.READ_ADDR, ((data[offsets] & 0xf) << 8) | data[offsets+1], values)
+        values = values.astype(object)
+        values[ends > len(rx)] = None
+        return values.tolist()
+
+    @staticmethod
+    def decode_message(read_bytes):
+        '''
+        Decode a single 2-byte response to its 12-bit message (None if incomplete)
+        '''
+        if len(read_bytes) != 2:
+            return None
+        read_bytes = bytearray(read_bytes)
+        return ((read_bytes[0] & 0xf) << 8) | read_bytes[1]
+
+# lookup tables of complete frames
+FrameCodec.SET_ADDR_FRAMES = [FrameCodec.frame(FrameCodec.SET_ADDR, addr) for addr in range(2**9)]
+FrameCodec.WRITE_VAL_FRAMES = [FrameCodec.frame(FrameCodec.WRITE_VAL, val) for val in range(2**8)]
+FrameCodec.SET_CLK_FRAMES = [FrameCodec.frame(FrameCodec.SET_CLK, val) for val in range(2**8)]
+FrameCodec.SET_DELAY_FRAMES = [FrameCodec.frame(FrameCodec.SET_DELAY, val) for val in range(2**8)]
+FrameCodec.READ_ADDR_FRAME = FrameCodec.frame(FrameCodec.READ_ADDR)
+FrameCodec.READ_VAL_FRAME = FrameCodec.frame(FrameCodec.READ_VAL)
+FrameCodec.READ_CLK_FRAME = FrameCodec.frame(FrameCodec.READ_CLK)
+
+class ShadowMemory :
+    '''
+    Expected state of the cryoSRAM memory
+    Stores a uint8 value and a mask of known bits for each address. Indexing
+    behaves like the original dict of addr : value (None if unknown)
+    '''
+
+    def __init__(self, n_addr, reg_val_map=None):
+        '''
+        `reg_val_map` should be a map of addr : val
+          missing values are initialized to None
+        '''
+        self.values = np.zeros(n_addr, dtype=np.uint8)
+        self.known = np.zeros(n_addr, dtype=np.uint8) # bits with a known value
+        if reg_val_map is None:
+            pass
+        elif isinstance(reg_val_map, dict):
+            for addr, value in reg_val_map.items():
+                if addr < n_addr:
+                    self[addr] = value
+        else:
+            raise ValueError('invalid type for initialization')
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, addr):
+        if self.known[addr] != 0xff:
+            return None
+        return int(self.values[addr])
+
+    def __setitem__(self, addr, value):
+        if value is None:
+            self.known[addr] = 0
+        else:
+            self.values[addr] = value
+            self.known[addr] = 0xff
+
+    def keys(self):
+        return range(len(self))
+
+    def items(self):
+        return [(addr, self[addr]) for addr in self.keys()]
+
+    def valid(self):
+        '''
+        Mask of addresses with a completely known value
+        '''
+        return self.known == 0xff
+
+    def bits(self):
+        '''
+        Returns (addr, bit) array of expected bits, -1 if unknown
+          bit 0 is the MSB (same order as format(<>,'08b'))
+        '''
+        bits = np.unpackbits(self.values[:,np.newaxis], axis=1).astype(np.int8)
+        bits[np.unpackbits(self.known[:,np.newaxis], axis=1) == 0] = -1
+        return bits
+
+    def get_block(self, addrs):
+        '''
+        Returns list of expected values at many addresses (None if unknown)
+        '''
+        values = self.values[addrs].astype(object)
+        values[self.known[addrs] != 0xff] = None
+        return values.tolist()
+
+    def write_block(self, addrs, values):
+        '''
+        Set expected values at many addresses at once
+        '''
+        self.values[addrs] = values
+        self.known[addrs] = 0xff
+
+    def invalidate(self, addrs=slice(None)):
+        '''
+        Mark addresses as unknown
+        '''
+        self.known[addrs] = 0
+
+    @staticmethod
+    def compare(expected, read):
+        '''
+        Bulk comparison of expected and read values (None for unknown)
+        returns mask of reads that differ from expected
+        '''
+        expected = np.array(expected, dtype=float)
+        read = np.array(read, dtype=float)
+        return ~((expected == read) | (np.isnan(expected) & np.isnan(read)))
+
+    @staticmethod
+    def bit_flips(expected, read):
+        '''
+        Bulk per-bit comparison of expected and read values
+        returns (read, bit) array of +1 (0 -> 1), -1 (1 -> 0) or 0
+        '''
+        expected = np.unpackbits(np.asarray(expected, dtype=np.uint8)[:,np.newaxis], axis=1).astype(np.int8)
+        read = np.unpackbits(np.asarray(read, dtype=np.uint8)[:,np.newaxis], axis=1).astype(np.int8)
+        return read - expected
+
 class CryoSRAM :
     '''
     Main class for communicating with cryoSRAM chip
@@ -157,16 +521,35 @@ class CryoSRAM :
     addr_range = [0,2**9]
     val_range = [0,2**8]
     rw_delay = 0.001 # [s] minimum time between commands
+    baudrate = 1e6 # [baud] fpga uart rate (8N1 -> 10 bits per byte)
+    baudrates = (12e6, 6e6, 4e6, 3e6, 2e6) # [baud] rates tried by `negotiate_baud`
+    baud_timeout = 0.5 # [s] fpga returns to the last confirmed rate if a new one is not confirmed
+    min_baud_divider = 8 # fpga clk ticks per uart bit
+    fpga_clk = 100e6 # [Hz] fpga internal clk
+    pad_margin = 1 # [bytes] extra padding after each batched command
+    max_batch_bytes = 4096 # batched bytes to queue before an automatic flush
+    max_read_records = 4096 # unbatched read records to keep before collecting them (see `begin_batch`)
+    max_block_len = 2**12-1 # values per block transfer
+    max_march_len = 128 # [bytes] march program stored by the fpga
+    max_march_elements = 8 # march elements distinguishable in fault records
+    max_march_ops = 2**7-1 # ops per march element
 
-    SET_ADDR = bitarray('0001')
-    WRITE_VAL = bitarray('0010')
-    READ_ADDR = bitarray('0011')
-    READ_VAL =  bitarray('0100')
-    SET_CLK =  bitarray('0101')
-    READ_CLK =  bitarray('0110')
-    SET_DELAY =  bitarray('0111')
+    SET_ADDR = FrameCodec.SET_ADDR
+    WRITE_VAL = FrameCodec.WRITE_VAL
+    READ_ADDR = FrameCodec.READ_ADDR
+    READ_VAL = FrameCodec.READ_VAL
+    SET_CLK = FrameCodec.SET_CLK
+    READ_CLK = FrameCodec.READ_CLK
+    SET_DELAY = FrameCodec.SET_DELAY
+    WRITE_BLOCK = FrameCodec.WRITE_BLOCK
+    READ_BLOCK = FrameCodec.READ_BLOCK
+    MARCH = FrameCodec.MARCH
+    SET_BAUD = FrameCodec.SET_BAUD
+    NOP = b'\x00' # unused message type, fpga returns to waiting
+    calibration_opcodes = (SET_ADDR, READ_ADDR, WRITE_VAL, READ_VAL, WRITE_BLOCK, READ_BLOCK)
 
-    def __init__(self, reg_val_map=None, io=None, log=None, clk_factor=25, test=False, delay_factor=0):
+    def __init__(self, reg_val_map=None, io=None, log=None, clk_factor=25, test=False, delay_factor=4, pipeline=True,
+                 block_transfers=True, engine='host', optimize=True, rw_delays=None, metrics=False):
         '''
         `log` should be a `CryoLogger` or `logging.getLogger(<name>)` object
         `reg_val_map` should be a map of addr : val
@@ -174,6 +557,18 @@ class CryoSRAM :
         `io` should be an io class with `read(<nbytes>)` and `write(<bytes>)`
           methods
         `test` can be used to test functionality without FPGA (overrides `io` with a `TestIO`)
+        `clk_factor` and `delay_factor` should match the fpga registers (the
+          defaults are the firmware reset values), they set the batch padding
+        `pipeline` runs the standard tests in batch mode (see `begin_batch`)
+        `block_transfers` uses the WRITE_BLOCK/READ_BLOCK messages for
+          sequential access (requires firmware version >= 32)
+        `engine` selects how march tests are run (see `run_march`)
+        `optimize` drops SET_ADDR frames when the fpga address is known to
+          match (see `set_addr`)
+        `rw_delays` is a dict of (opcode, clk_factor) : wait after unbatched
+          commands [s], or a file from `save_delays` (see `calibrate_delay`)
+        `metrics` records command counters and latencies in `self.metrics`
+          (see `metrics.Metrics`), summarized with each `test_summary`
         '''
         self.test = test
         self.io = io
@@ -185,24 +580,38 @@ class CryoSRAM :
 
         if self.test:
             self.io = TestIO()
+        self.metrics = Metrics(self._byte_time(), FrameCodec.names) if metrics else None
+        if isinstance(self.log, CryoLogger):
+            self.log.metrics = self.metrics
+            if self.log.binary:
+                self.log.dat_file.metrics = self.metrics
         self.io.read = self.log.capture_read(self.io.read)
         self.io.write = self.log.capture_write(self.io.write)
 
         self.clk_factor = clk_factor
         self.delay_factor = delay_factor
         self.curr_addr = 0;
-        self.memory = {}
-        if reg_val_map is None:
-            for addr in range(*CryoSRAM.addr_range):
-                self.memory[addr] = None
-        elif isinstance(reg_val_map, map):
-            for addr in range(*CryoSRAM.addr_range):
-                try:
-                    self.memory[addr] = reg_val_map[addr]
-                except IndexError:
-                    self.memory[addr] = None
-        else:
-            raise ValueException('invalid type for initialization')
+        self.fpga_addr = None # fpga address register (None if unknown)
+        self.memory = ShadowMemory(self.addr_range[-1], reg_val_map)
+
+        self.pipeline = pipeline
+        self.block_transfers = block_transfers
+        self.engine = engine
+        self.optimize = optimize
+        self.n_frames_saved = 0
+        self.n_frames_saved_reported = 0
+        self.batching = False
+        self.tx_buffer = bytearray()
+        self.pending = []
+        self.pending_last = {}
+        self.read_records = []
+        self.collecting = None # (faults, bitmaps) that read records are added to
+        self.pad_cache = {}
+        self.rw_delays = {}
+        if isinstance(rw_delays, str):
+            self.load_delays(rw_delays)
+        elif rw_delays is not None:
+            self.rw_delays.update(rw_delays)
 
     def __str__(self):
         '''
@@ -211,70 +620,307 @@ class CryoSRAM :
         return_str = 'CryoSRAM(io={io}, log={log}, clk_factor={clk_factor}, curr_addr={curr_addr})'.format(**vars(self))
         return return_str
 
+    def _byte_time(self):
+        '''
+        Time for one 8N1 byte on the wire
+        '''
+        return 10./self.baudrate
+
+    def _cycle_time(self, opcode):
+        '''
+        Duration of the SRAM read/write cycle started by a command
+        '''
+        clk_factor = self.clk_factor if self.clk_factor is not None else 255
+        if opcode == self.WRITE_VAL or opcode == self.WRITE_BLOCK:
+            return (4*clk_factor + 2)/self.fpga_clk
+        if opcode == self.READ_VAL or opcode == self.READ_BLOCK:
+            return (4*clk_factor + 2 + self.delay_factor)/self.fpga_clk
+        return 0
+
+    def _pad_length(self, opcode, n=1):
+        '''
+        Number of NOP bytes to send after a batched command so that the fpga
+        has returned to waiting before the next command arrives
+        `n` is the number of values in a READ_BLOCK
+        '''
+        byte_time = self._byte_time()
+        busy_time = self._cycle_time(opcode)
+        if opcode == self.READ_VAL or opcode == self.READ_ADDR or opcode == self.READ_CLK:
+            busy_time += 2*byte_time
+        elif opcode == self.READ_BLOCK:
+            busy_time = n*(busy_time + byte_time)
+        return int(math.ceil(busy_time/byte_time)) + self.pad_margin
+
+    def _padding(self, opcode):
+        '''
+        NOP bytes to follow a batched command (cached per fpga settings)
+        '''
+        cache_key = (opcode, self.clk_factor, self.delay_factor)
+        try:
+            return self.pad_cache[cache_key]
+        except KeyError:
+            self.pad_cache[cache_key] = self.NOP*self._pad_length(opcode)
+            return self.pad_cache[cache_key]
+
+    def _rw_delay(self, opcode):
+        '''
+        Wait after an unbatched command (calibrated for the current clk
+        factor, otherwise `rw_delay`)
+        '''
+        return self.rw_delays.get((opcode, self.clk_factor), self.rw_delay)
+
+    def _sleep(self, seconds):
+        '''
+        Wait between commands (counted in `metrics`)
+        '''
+        time.sleep(seconds)
+        if self.metrics is not None:
+            self.metrics.sleep(seconds)
+
+    def _transmit(self, frame, opcode, key=None):
+        '''
+        Send a command that expects no response
+        In batch mode the frame is queued, otherwise it is written followed
+        by `rw_delay` (see `calibrate_delay`)
+        `key` is the state modified by the command (any queued read of the
+        same state is no longer used to update it)
+        '''
+        if self.batching:
+            self.tx_buffer += frame + self._padding(opcode)
+            self.pending_last.pop(key, None)
+            if self.metrics is not None:
+                self.metrics.command(opcode)
+            if len(self.tx_buffer) > self.max_batch_bytes:
+                self.flush_batch()
+        else:
+            start = time.perf_counter()
+            self.io.write(frame)
+            self._sleep(self._rw_delay(opcode))
+            if self.metrics is not None:
+                self.metrics.command(opcode, tx_bytes=len(frame), seconds=time.perf_counter() - start)
+
+    def _request(self, frame, opcode, key, expected, stage=None):
+        '''
+        Send a command that expects a 2-byte response
+        `key` is the state updated by the response (`curr_addr`, `clk_factor`
+        or a memory address), `expected` is its value before the read
+        If `stage` is not None, a read record is stored in `read_records`
+        In batch mode the frame is queued and None is returned
+        '''
+        if self.batching:
+            self.tx_buffer += frame + self._padding(opcode)
+            self.pending_last[key] = len(self.pending)
+            self.pending += [(opcode, key, expected, stage)]
+            if self.metrics is not None:
+                self.metrics.command(opcode)
+            if len(self.tx_buffer) > self.max_batch_bytes:
+                self.flush_batch()
+            return None
+        start = time.perf_counter()
+        self.io.write(frame)
+        read_bytes = self.io.read(2)
+        self._sleep(self._rw_delay(opcode))
+        if self.metrics is not None:
+            self.metrics.command(opcode, len(frame), len(read_bytes), 2, time.perf_counter() - start)
+        if len(read_bytes) != 2:
+            self.log.warning('rx bytes {}, expected 2'.format(len(read_bytes)))
+            self.fpga_addr = None
+        value = self._decode_response(opcode, read_bytes)
+        self._update(key, value)
+        if stage is not None:
+            self.read_records += [(stage, key, expected, value)]
+            if len(self.read_records) >= self.max_read_records:
+                self._collect_read_records()
+        return value
+
+    def _decode_response(self, opcode, read_bytes):
+        '''
+        Convert a 2-byte fpga response to an integer (None if incomplete)
+        '''
+        message = FrameCodec.decode_message(read_bytes)
+        if message is None or opcode == self.READ_ADDR:
+            return message
+        return message & 0xff
+
+    def _update(self, key, value):
+        '''
+        Store a read back value in the tracked state
+        '''
+        if key == 'curr_addr':
+            self.curr_addr = self.fpga_addr = value
+        elif key == 'clk_factor':
+            self.clk_factor = value
+        else:
+            self.memory[key] = value
+
+    def begin_batch(self, faults=None, bitmaps=None):
+        '''
+        Start queueing commands rather than sending them one at a time
+        Queued frames are padded with NOP bytes to cover the fpga processing
+        time, so no `rw_delay` is needed between them. Read methods return
+        None while batching and the results are applied at `flush_batch`
+        Has no effect unless `pipeline` is set
+        If `faults` and `bitmaps` dicts are given, read records are added to
+        them (see `collect_records`) after each flush until `end_batch`,
+        rather than kept, so memory use does not grow with the test length
+        '''
+        if self.pipeline:
+            self.batching = True
+        self.collecting = (faults, bitmaps) if bitmaps is not None else None
+
+    def take_batch(self):
+        '''
+        Returns (and clears) the queued commands :
+          (tx bytes, rx bytes expected, pending reads, index of last pending
+          read of each key)
+        '''
+        tx_buffer, pending, pending_last = bytes(self.tx_buffer), self.pending, self.pending_last
+        self.tx_buffer = bytearray()
+        self.pending = []
+        self.pending_last = {}
+        n_rx = int(np.sum(FrameCodec.response_lengths([entry[0] for entry in pending]))) if len(pending) else 0
+        return tx_buffer, n_rx, pending, pending_last
+
+    def apply_responses(self, read_bytes, n_rx, pending, pending_last, superseded=()):
+        '''
+        Decodes the responses to a batch from `take_batch`, updating the
+        tracked state and read records
+        Keys in `superseded` (modified since the batch was queued) are not
+        updated
+        Returns list of read values
+        '''
+        if len(read_bytes) != n_rx:
+            self.log.warning('rx bytes {}, expected {}'.format(len(read_bytes), n_rx))
+            self.fpga_addr = None
+        if not len(pending):
+            return []
+        values = FrameCodec.decode_responses(read_bytes, [entry[0] for entry in pending])
+        for idx, (opcode, key, expected, stage) in enumerate(pending):
+            value = values[idx]
+            if pending_last.get(key) == idx and key not in superseded:
+                self._update(key, value)
+            if stage is not None:
+                self.read_records += [(stage, key, expected, value)]
+        self._collect_read_records()
+        return values
+
+    def flush_batch(self):
+        '''
+        Send all queued commands with one write and read back all responses
+        Read back values update the tracked state unless a later queued
+        command modified the same state
+        '''
+        if not len(self.tx_buffer):
+            return
+        tx_buffer, n_rx, pending, pending_last = self.take_batch()
+        start = time.perf_counter()
+        self.io.write(tx_buffer)
+        read_bytes = self.io.read(n_rx) if n_rx else b''
+        self._sleep(self.rw_delay)
+        if self.metrics is not None:
+            self.metrics.command('batch', len(tx_buffer), len(read_bytes), n_rx, time.perf_counter() - start)
+        self.apply_responses(read_bytes, n_rx, pending, pending_last)
+
+    def end_batch(self):
+        '''
+        Flush any queued commands and stop batching
+        Returns (and clears) the read records collected since the last call:
+          (stage, addr, expected, read)
+        (none if they were added to the dicts given to `begin_batch`)
+        '''
+        self.flush_batch()
+        self.batching = False
+        self._collect_read_records()
+        self.collecting = None
+        read_records = self.read_records
+        self.read_records = []
+        return read_records
+
+    def _collect_read_records(self):
+        '''
+        Adds the stored read records to the dicts given to `begin_batch`
+        (if any) and clears them
+        '''
+        if self.collecting is None or not len(self.read_records):
+            return
+        read_records = self.read_records
+        self.read_records = []
+        self.collect_records(read_records, *self.collecting)
+
+    def collect_records(self, read_records, faults, bitmaps):
+        '''
+        Adds read records from `end_batch` to the faults and bitmaps dicts
+        Each stage is verified with a single bulk comparison
+        '''
+        if not len(read_records):
+            return
+        stages, addrs, expected, reads = [np.array(column, dtype=object) for column in zip(*read_records)]
+        for stage in bitmaps.keys():
+            stage_mask = stages == stage
+            if not np.any(stage_mask):
+                continue
+            stage_addrs, stage_expected, stage_reads = addrs[stage_mask], expected[stage_mask], reads[stage_mask]
+            fault_mask = ShadowMemory.compare(stage_expected, stage_reads)
+            bitmaps[stage].add(stage_addrs, stage_reads, stage_expected)
+            faults[stage] += list(zip(stage_addrs[fault_mask].tolist(), stage_expected[fault_mask].tolist(),
+                                      stage_reads[fault_mask].tolist()))
+
+    def _check_addr(self, addr):
+        '''
+        Raises a ValueError if `addr` is not a valid SRAM address
+        '''
+        if not self.addr_range[0] <= addr < self.addr_range[-1]:
+            raise ValueError('address {} out of range [{}, {})'.format(addr, *self.addr_range))
+
     def set_addr(self, addr):
         '''
         Set address
+        If `optimize`, the frame is only sent if the fpga address register
+        is not already known to hold `addr` (saved frames are counted in
+        `n_frames_saved`)
         '''
-        binary_word = format(addr,'09b')
-        header = self.SET_ADDR + bitarray('0'*3) + bitarray(binary_word[0])
-        word = bitarray(binary_word[1:])
-        #self.log.debug('TX - {} {}'.format(header, word))
-        self.io.write(header.tobytes() + word.tobytes())
-        time.sleep(self.rw_delay)
+        self._check_addr(addr)
+        if self.optimize and addr == self.fpga_addr:
+            self.n_frames_saved += 1
+        else:
+            self._transmit(FrameCodec.SET_ADDR_FRAMES[addr], self.SET_ADDR, 'curr_addr')
+            self.fpga_addr = addr
         self.curr_addr = addr
 
+    def _sync_addr(self):
+        '''
+        Resend the current address if the fpga address register is unknown
+        (e.g. after a failed read)
+        '''
+        if self.optimize and self.fpga_addr != self.curr_addr:
+            self.set_addr(self.curr_addr)
+
     def write_value(self, val):
         '''
         Write value to current address
         '''
-        header = self.WRITE_VAL + bitarray('0'*4)
-        binary_word = format(val,'08b')
-        word = bitarray(binary_word)
-        #self.log.debug('TX - {} {}'.format(header, word))
-        self.io.write(header.tobytes() + word.tobytes())
-        time.sleep(self.rw_delay)
+        self._sync_addr()
+        self._transmit(FrameCodec.WRITE_VAL_FRAMES[val], self.WRITE_VAL, self.curr_addr)
         self.memory[self.curr_addr] = val
 
-    def read_addr(self):
+    def read_addr(self, stage=None):
         '''
         Read current address from fpga
         '''
-        tx_header, tx_word = self.READ_ADDR + bitarray('0'*4), bitarray('0'*8)
-        rx_header, rx_word = bitarray(''), bitarray('')
-        #self.log.debug('TX - {} {}'.format(tx_header, tx_word))
-        self.io.write(tx_header.tobytes() + tx_word.tobytes())
-        read_bytes = self.io.read(2)
-        time.sleep(self.rw_delay)
-        if len(read_bytes) != 2:
-            self.log.warning('rx bytes {}, expected 2'.format(len(read_bytes)))
-            self.curr_addr = None
-            return None
-        rx_header.frombytes(read_bytes[0])
-        rx_word.frombytes(read_bytes[1])
-        #self.log.debug('RX - {} {}'.format(rx_header, rx_word))
-        read = rx_header + rx_word
-        self.curr_addr = int(read[-10:].to01(),2)
-        return self.curr_addr
+        return self._request(FrameCodec.READ_ADDR_FRAME, self.READ_ADDR,
+                             'curr_addr', self.curr_addr, stage)
 
-    def read_value(self):
+    def read_value(self, stage=None, expected=None):
         '''
         Read value from current address
+        If `stage` is given, the read is recorded for verification (see
+        `end_batch`) against `expected` (defaults to the tracked memory value)
         '''
-        tx_header, tx_word = self.READ_VAL + bitarray('0'*4), bitarray('0'*8)
-        rx_header, rx_word = bitarray(''), bitarray('')
-        #self.log.debug('TX - {} {}'.format(tx_header, tx_word))
-        self.io.write(tx_header.tobytes() + tx_word.tobytes())
-        read_bytes = self.io.read(2)
-        time.sleep(self.rw_delay)
-        if len(read_bytes) != 2:
-            self.log.warning('rx bytes {}, expected 2'.format(len(read_bytes)))
-            self.memory[self.curr_addr] = None
-            return None
-        rx_header.frombytes(read_bytes[0])
-        rx_word.frombytes(read_bytes[1])
-        #self.log.debug('RX - {} {}'.format(rx_header, rx_word))
-        self.memory[self.curr_addr] = int(rx_word.to01(),2)
-        return self.memory[self.curr_addr]
+        self._sync_addr()
+        if expected is None:
+            expected = self.memory[self.curr_addr]
+        return self._request(FrameCodec.READ_VAL_FRAME, self.READ_VAL,
+                             self.curr_addr, expected, stage)
 
     def set_clk(self, clk_factor):
         '''
@@ -288,52 +934,371 @@ class CryoSRAM :
         ...
         clk_factor = 255 : 0.098 MHz
         '''
-        header = self.SET_CLK + bitarray('0'*4)
-        word = bitarray(format(clk_factor,'08b'))
-        #self.log.debug('TX - {} {}'.format(header, word))
-        self.io.write(header.tobytes() + word.tobytes())
-        time.sleep(self.rw_delay)
+        self._transmit(FrameCodec.SET_CLK_FRAMES[clk_factor], self.SET_CLK, 'clk_factor')
         self.clk_factor = clk_factor
 
     def read_clk(self):
         '''
         Read current clk from fpga
         '''
-        tx_header, tx_word = self.READ_CLK + bitarray('0'*4), bitarray('0'*8)
-        rx_header, rx_word = bitarray(''), bitarray('')
-        #self.log.debug('TX - {} {}'.format(tx_header, tx_word))
-        self.io.write(tx_header.tobytes() + tx_word.tobytes())
-        read_bytes = self.io.read(2)
-        time.sleep(self.rw_delay)
-        if len(read_bytes) != 2:
-            self.log.warning('rx bytes {}, expected 2'.format(len(read_bytes)))
-            self.clk_factor = None
-            return None
-        rx_header.frombytes(read_bytes[0])
-        rx_word.frombytes(read_bytes[1])
-        #self.log.debug('RX - {} {}'.format(rx_header, rx_word))
-        self.clk_factor = int(rx_word.to01(),2)
-        return self.clk_factor
+        return self._request(FrameCodec.READ_CLK_FRAME, self.READ_CLK,
+                             'clk_factor', self.clk_factor)
 
     def set_delay(self, delay_factor):
         '''
         Set delay for read in 100MHz clk ticks after CEN goes high
         '''
-        header = self.SET_DELAY + bitarray('0'*4)
-        word = bitarray(format(delay_factor,'08b'))
-        #self.log.debug('TX - {} {}'.format(header, word))
-        self.io.write(header.tobytes() + word.tobytes())
-        time.sleep(self.rw_delay)
+        self._transmit(FrameCodec.SET_DELAY_FRAMES[delay_factor], self.SET_DELAY)
         self.delay_factor = delay_factor
 
+    def _set_host_baud(self, baudrate):
+        '''
+        Change the host side of the uart (and the timings based on it)
+        '''
+        self.io.baudrate = baudrate
+        self.baudrate = baudrate
+        self.pad_cache = {}
+        if self.metrics is not None:
+            self.metrics.byte_time = self._byte_time()
+
+    def set_baud(self, baudrate, confirm=True):
+        '''
+        Switch the uart to `baudrate`
+        The fpga divides its clk by round(`fpga_clk`/`baudrate`) (at least
+        `min_baud_divider`), so e.g. 12 MBaud runs at 12.5 MBaud. Unless the
+        new rate is confirmed (by sending the same command again at the new
+        rate) within `baud_timeout`, the fpga returns to the last confirmed
+        rate. `io` needs a settable `baudrate` (as `Serial`)
+        Requires firmware version >= 34
+        '''
+        divider = int(round(self.fpga_clk/baudrate))
+        if divider < self.min_baud_divider:
+            raise ValueError('baud rate {:g} above fpga limit {:g}'.format(
+                baudrate, self.fpga_clk/self.min_baud_divider))
+        frame = FrameCodec.frame(self.SET_BAUD, divider)
+        if self.batching:
+            self.flush_batch()
+        self.io.write(frame)
+        if hasattr(self.io, 'flush'):
+            self.io.flush()
+        self._sleep(self.rw_delay + len(frame)*self._byte_time())
+        self._set_host_baud(baudrate)
+        if self.metrics is not None:
+            self.metrics.command(self.SET_BAUD, tx_bytes=len(frame))
+        if confirm:
+            self.io.write(frame)
+            self._sleep(self.rw_delay)
+
+    def _link_errors(self, n=None):
+        '''
+        Sets and reads back `n` addresses in one batch (as `serial_test`)
+        Returns the number of addresses read back wrong or not at all
+        '''
+        n_addr = self.addr_range[-1]
+        n = n_addr if n is None else n
+        self.fpga_addr = None
+        self.begin_batch()
+        for i in range(n):
+            self.set_addr((self.addr_range[0] + i) % n_addr)
+            self.read_addr(stage='baud')
+        records = self.end_batch()
+        return sum([read != expected for stage, key, expected, read in records])
+
+    def negotiate_baud(self, baudrates=None, n=None):
+        '''
+        Switches to the fastest of `baudrates` (defaults to `baudrates`)
+        above the current rate at which `n` addresses (default all) can be
+        set and read back without errors
+        Each rate is only confirmed to the fpga once its loopback passes. On
+        errors the host waits for the fpga to return to the previous rate
+        (`baud_timeout`) and tries the next one
+        Returns the rate in use
+        '''
+        baudrates = self.baudrates if baudrates is None else baudrates
+        base = self.baudrate
+        for baudrate in sorted(baudrates, reverse=True):
+            if baudrate <= base:
+                break
+            self.set_baud(baudrate, confirm=False)
+            errors = self._link_errors(n)
+            if not errors:
+                self.io.write(FrameCodec.frame(self.SET_BAUD, int(round(self.fpga_clk/baudrate))))
+                # check the confirmation arrived (the fpga would have reverted)
+                self._sleep(self.baud_timeout + self.rw_delay)
+                errors = self._link_errors(n)
+                if not errors:
+                    self.log.info('Baud rate {:g}'.format(baudrate))
+                    return baudrate
+            self.log.warning('Baud rate {:g} failed ({} errors), falling back'.format(baudrate, errors))
+            self._sleep(self.baud_timeout + self.rw_delay)
+            self._set_host_baud(base)
+            self._resync()
+        self.log.info('Baud rate {:g}'.format(base))
+        return base
+
+    def write_block(self, start, values):
+        '''
+        Write sequential values starting at address `start`
+        Uses a single SET_ADDR and WRITE_BLOCK message per block, the fpga
+        increments its address after each value. If the write cycle is longer
+        than a UART byte, one value is sent per WRITE_BLOCK so none are lost
+        Falls back to SET_ADDR + WRITE_VAL for each address if
+        `block_transfers` is not set
+        '''
+        self._check_addr(start)
+        values = bytes(bytearray(values))
+        n_addr = self.addr_range[-1]
+        addrs = (start + np.arange(len(values))) % n_addr
+        if not self.block_transfers:
+            for addr, value in zip(addrs.tolist(), bytearray(values)):
+                self.set_addr(addr)
+                self.write_value(value)
+            return
+        self.set_addr(start)
+        self._write_block(start, values)
+
+    def _write_block(self, start, values):
+        '''
+        WRITE_BLOCK messages of `write_block`, from the current fpga address
+        (`start`)
+        '''
+        n_addr = self.addr_range[-1]
+        addrs = (start + np.arange(len(values))) % n_addr
+        block_len = self.max_block_len
+        if self._cycle_time(self.WRITE_BLOCK) >= self._byte_time():
+            block_len = 1
+        for offset in range(0, len(values), block_len):
+            block = values[offset:offset+block_len]
+            self._transmit(FrameCodec.frame(self.WRITE_BLOCK, len(block)) + block, self.WRITE_BLOCK)
+        if self.batching:
+            for addr in addrs.tolist():
+                self.pending_last.pop(addr, None)
+        self.memory.write_block(addrs, np.frombuffer(values, dtype=np.uint8))
+        self.curr_addr = self.fpga_addr = (start + len(values)) % n_addr
+
+    def read_block(self, start, n, stage=None, expected=None):
+        '''
+        Read `n` sequential values starting at address `start`
+        Uses a single SET_ADDR and READ_BLOCK message per block, the fpga
+        returns one byte per value and increments its address after each
+        If `stage` is given, each read is recorded for verification (see
+        `end_batch`) against `expected` (a value for all addresses, defaults
+        to the tracked memory values)
+        Returns list of values (None in batch mode)
+        Falls back to SET_ADDR + READ_VAL for each address if
+        `block_transfers` is not set
+        '''
+        self._check_addr(start)
+        n_addr = self.addr_range[-1]
+        addrs = ((start + np.arange(n)) % n_addr).tolist()
+        if not self.block_transfers:
+            read = []
+            for addr in addrs:
+                self.set_addr(addr)
+                read += [self.read_value(stage=stage, expected=expected)]
+            return None if self.batching else read
+        self.set_addr(start)
+        return self._read_block(start, n, stage, expected)
+
+    def _read_block(self, start, n, stage=None, expected=None):
+        '''
+        READ_BLOCK messages of `read_block`, from the current fpga address
+        (`start`)
+        '''
+        n_addr = self.addr_range[-1]
+        addrs = ((start + np.arange(n)) % n_addr).tolist()
+        expected = self.memory.get_block(addrs) if expected is None else [expected]*n
+        read = []
+        for offset in range(0, n, self.max_block_len):
+            block_addrs = addrs[offset:offset+self.max_block_len]
+            frame = FrameCodec.frame(self.READ_BLOCK, len(block_addrs))
+            if self.batching:
+                self.tx_buffer += frame + self.NOP*self._pad_length(self.READ_BLOCK, len(block_addrs))
+                for addr, value in zip(block_addrs, expected[offset:offset+len(block_addrs)]):
+                    self.pending_last[addr] = len(self.pending)
+                    self.pending += [(self.READ_BLOCK, addr, value, stage)]
+                if self.metrics is not None:
+                    self.metrics.command(self.READ_BLOCK)
+                if len(self.tx_buffer) > self.max_batch_bytes:
+                    self.flush_batch()
+                continue
+            sent = time.perf_counter()
+            self.io.write(frame)
+            read_bytes = self.io.read(len(block_addrs))
+            self._sleep(self._rw_delay(self.READ_BLOCK))
+            if self.metrics is not None:
+                self.metrics.command(self.READ_BLOCK, len(frame), len(read_bytes), len(block_addrs),
+                                     time.perf_counter() - sent)
+            if len(read_bytes) != len(block_addrs):
+                self.log.warning('rx bytes {}, expected {}'.format(len(read_bytes), len(block_addrs)))
+                self.fpga_addr = None
+            read += list(bytearray(read_bytes)) + [None]*(len(block_addrs) - len(read_bytes))
+        self.curr_addr = (start + n) % n_addr
+        if self.fpga_addr is not None or self.batching:
+            self.fpga_addr = self.curr_addr
+        if self.batching:
+            return None
+        for addr, value in zip(addrs, read):
+            self.memory[addr] = value
+        if stage is not None:
+            self.read_records += list(zip([stage]*n, addrs, expected, read))
+            if len(self.read_records) >= self.max_read_records:
+                self._collect_read_records()
+        return read
+
+    def encode_march(self, march):
+        '''
+        Returns the fpga program for a march (see `run_march`)
+          element header - {direction (1 == descending), n_ops[6:0]}
+          each op - {0000000, read (1) / write (0)}, {value}
+        Raises ValueError if the march does not fit in the fpga
+        '''
+        if len(march) > self.max_march_elements:
+            raise ValueError('march has {} elements, max {}'.format(len(march), self.max_march_elements))
+        program = bytearray()
+        for direction, ops in march:
+            if len(ops) > self.max_march_ops:
+                raise ValueError('march element has {} ops, max {}'.format(len(ops), self.max_march_ops))
+            program.append((0x80 if direction < 0 else 0x00) | len(ops))
+            for op in ops:
+                program += bytearray([0x1 if op[0] == 'r' else 0x0, op[1]])
+        if len(program) > self.max_march_len:
+            raise ValueError('march program is {} bytes, max {}'.format(len(program), self.max_march_len))
+        return bytes(program)
+
+    def run_march(self, march, stages=None, engine=None):
+        '''
+        Runs a march test over all addresses
+        `march` is a list of elements (direction, ops) :
+          direction - 1 (ascending addresses) or -1 (descending)
+          ops - applied to each address in turn, ('w', value) or
+            ('r', expected, stage)
+        `stages` orders the returned dicts (defaults to the read stages in
+          order of appearance)
+        `engine` (defaults to `self.engine`) is one of :
+          'host' - commands are sent for each address
+          'fpga' - the march is uploaded and run by the fpga, which only
+            reports failed reads (requires firmware version >= 33 and the
+            full address range)
+        returns dicts of stage : faults and stage : bitmaps (`BitCounts`)
+        fault lists are tuples of :
+          (addr, expected, read)
+        '''
+        if stages is None:
+            stages = []
+            for direction, ops in march:
+                stages += [op[2] for op in ops if op[0] == 'r' and op[2] not in stages]
+        faults = dict([(stage, []) for stage in stages])
+        bitmaps = dict([(stage, BitCounts(self.addr_range[-1])) for stage in stages])
+        engine = self.engine if engine is None else engine
+        if engine == 'fpga' and list(self.addr_range) != [0, 2**9]:
+            self.log.warning('fpga march engine requires the full address range, running on host')
+            engine = 'host'
+        for i, (direction, ops) in enumerate(march):
+            self.log.info('March element {}/{}: {} ({})'.format(i+1, len(march), 'down' if direction < 0 else 'up',
+                ','.join(['{}{}'.format(op[0], op[1]) for op in ops])))
+        if engine == 'fpga':
+            self._run_march_fpga(march, faults, bitmaps)
+        elif engine == 'host':
+            self._run_march_host(march, faults, bitmaps)
+        else:
+            raise ValueError('unknown march engine {}'.format(engine))
+        return faults, bitmaps
+
+    def _run_march_host(self, march, faults, bitmaps):
+        '''
+        Runs a march with a batch of commands for each address
+        Single-op ascending elements use block transfers
+        If `optimize`, the last op at each address of an ascending element
+        is sent as a block transfer of one value, which moves the fpga on to
+        the next address without a SET_ADDR
+        '''
+        advance = self.optimize and self.block_transfers
+        self.begin_batch(faults, bitmaps)
+        for direction, ops in march:
+            addrs = list(range(*self.addr_range))
+            if direction < 0:
+                addrs.reverse()
+            if len(ops) == 1 and direction > 0 and ops[0][0] == 'w':
+                self.write_block(addrs[0], [ops[0][1]]*len(addrs))
+                continue
+            if len(ops) == 1 and direction > 0 and ops[0][0] == 'r':
+                self.read_block(addrs[0], len(addrs), stage=ops[0][2], expected=ops[0][1])
+                continue
+            for addr in addrs:
+                self.set_addr(addr)
+                for op in ops[:-1] if advance and direction > 0 else ops:
+                    if op[0] == 'w':
+                        self.write_value(op[1])
+                    else:
+                        self.read_value(stage=op[2], expected=op[1])
+                if advance and direction > 0:
+                    # the fpga is already at addr, so no SET_ADDR is needed
+                    self._sync_addr()
+                    if ops[-1][0] == 'w':
+                        self._write_block(addr, bytes([ops[-1][1]]))
+                    else:
+                        self._read_block(addr, 1, stage=ops[-1][2], expected=ops[-1][1])
+        self.end_batch()
+
+    def _run_march_fpga(self, march, faults, bitmaps):
+        '''
+        Uploads a march to the fpga and collects the fault records
+          {MARCH, element[2:0], addr[8]}, {addr[7:0]}, {0, op[6:0]}, {read}
+        ending with
+          {MARCH, 0000}, {n_faults[15:8]}, {1000_0000}, {n_faults[7:0]}
+        Bitmaps and the tracked memory are rebuilt from the march and faults
+        '''
+        program = self.encode_march(march)
+        if self.batching:
+            self.flush_batch()
+        start = time.perf_counter()
+        self.io.write(FrameCodec.frame(self.MARCH, len(program)) + program)
+        records = bytearray()
+        n_faults = None
+        while True:
+            record = bytearray(self.io.read(4))
+            if len(record) != 4:
+                self.log.warning('march incomplete: rx bytes {}, expected 4'.format(len(record)))
+                self.fpga_addr = None
+                break
+            if record[2] & 0x80:
+                n_faults = (record[1] << 8) | record[3]
+                break
+            records += record
+        self._sleep(self.rw_delay)
+        if self.metrics is not None:
+            rx_bytes = len(records) + len(record)
+            self.metrics.command(self.MARCH, 2 + len(program), rx_bytes, len(records) + 4, time.perf_counter() - start)
+        records = np.frombuffer(bytes(records), dtype=np.uint8).reshape(-1,4)
+        if n_faults is not None and n_faults != min(len(records), 0xffff):
+            self.log.warning('march reported {} faults, received {}'.format(n_faults, len(records)))
+        values, invalid = march_results(march, records, self.addr_range[-1], faults, bitmaps)
+        for record in invalid:
+            self.log.warning('invalid march fault record {}'.format(record))
+
+        # final state is set by the last op of the last element
+        if values is None:
+            return
+        self.memory.write_block(np.arange(self.addr_range[-1]), values)
+        self.curr_addr = march_end_addr(march, self.addr_range[-1])
+        if n_faults is not None:
+            self.fpga_addr = self.curr_addr
+
     def test_summary(self, faults):
         '''
-        Prints a basic summary of faults
+        Prints a basic summary of faults (lists or counts of each stage)
         '''
         self.log.info('Summary:')
         self.log.info('stage\tfaults')
         for key in sorted(faults.keys()):
-            self.log.info('{}\t{}'.format(key,len(faults[key])))
+            n_faults = faults[key] if isinstance(faults[key], int) else len(faults[key])
+            self.log.info('{}\t{}'.format(key,n_faults))
+        if self.optimize:
+            self.log.info('SET_ADDR frames saved: {}'.format(self.n_frames_saved - self.n_frames_saved_reported))
+            self.n_frames_saved_reported = self.n_frames_saved
+        if self.metrics is not None:
+            self.metrics.log_summary(self.log)
 
     def serial_test(self):
         '''
@@ -345,16 +1310,277 @@ class CryoSRAM :
             'serial': []
         }
         self.log.info('Set addr and read back')
+        self.begin_batch()
         for addr in range(*self.addr_range):
             self.set_addr(addr)
-            self.read_addr()
-            if self.curr_addr != addr:
-                faults['serial'] += [(addr, addr, self.curr_addr)]
+            self.read_addr(stage='serial')
+        for stage, key, expected, read in self.end_batch():
+            if read != expected:
+                faults[stage] += [(expected, expected, read)]
 
         self.test_summary(faults)
         self.log.info(' ~ End serial test ~')
         return faults, None
 
+    def _calibration_trial(self, opcode, addr, value):
+        '''
+        Sends one command of type `opcode`, then checks its result and that
+        the next command was received (by setting and reading back another
+        address)
+        Returns True if all read back values are correct
+        '''
+        probe = (addr + 1) % self.addr_range[-1]
+        if opcode == self.READ_VAL or opcode == self.READ_BLOCK:
+            self.set_addr(addr)
+            self.write_value(value)
+        if opcode != self.SET_ADDR:
+            self.set_addr(addr)
+        ok = True
+        if opcode == self.SET_ADDR:
+            self.set_addr(addr)
+        elif opcode == self.WRITE_VAL:
+            self.write_value(value)
+        elif opcode == self.READ_ADDR:
+            ok = self.read_addr() == addr
+        elif opcode == self.READ_VAL:
+            ok = self.read_value() == value
+        elif opcode == self.WRITE_BLOCK:
+            self.write_block(addr, [value])
+        elif opcode == self.READ_BLOCK:
+            ok = self.read_block(addr, 1) == [value]
+        self.set_addr(probe)
+        ok = self.read_addr() == probe and ok
+        if opcode == self.WRITE_VAL or opcode == self.WRITE_BLOCK:
+            self.set_addr(addr)
+            ok = self.read_value() == value and ok
+        return ok
+
+    def _calibration_errors(self, opcode, n, stop=True):
+        '''
+        Runs `n` calibration trials at random addresses and values
+        Returns the number that failed (at most 1 if `stop`)
+        '''
+        errors = 0
+        for i in range(n):
+            if not self._calibration_trial(opcode, randint(self.addr_range[0], self.addr_range[-1]-1),
+                                           randint(self.val_range[0], self.val_range[-1]-1)):
+                errors += 1
+                self._resync()
+                if stop:
+                    break
+        return errors
+
+    def _resync(self, max_tries=12):
+        '''
+        Returns the fpga to waiting after lost bytes (by completing any
+        partial message or block) and discards stray response bytes
+        A lost byte can turn the next into a long command (e.g. a READ_BLOCK),
+        so the wait is doubled until an address is read back correctly
+        Raises RuntimeError after `max_tries`
+        '''
+        wait = self.rw_delay
+        for i in range(max_tries):
+            self._sleep(wait)
+            self.io.write(self.NOP*(self.max_block_len+2))
+            self._sleep(wait + (self.max_block_len+2)*self._byte_time())
+            if hasattr(self.io, 'reset_input_buffer'):
+                self.io.reset_input_buffer()
+            self.fpga_addr = None
+            self.io.write(FrameCodec.SET_ADDR_FRAMES[self.addr_range[0]])
+            self._sleep(self.rw_delay)
+            if self.read_addr() == self.addr_range[0]:
+                return
+            wait *= 2
+        raise RuntimeError('no response from fpga after {} tries'.format(max_tries))
+
+    def _command_time(self, opcode, n):
+        '''
+        Time to send `n` unbatched commands of type `opcode`
+        '''
+        start = time.time()
+        for i in range(n):
+            if opcode == self.SET_ADDR:
+                self.set_addr(i % self.addr_range[-1])
+            elif opcode == self.WRITE_VAL:
+                self.write_value(i % self.val_range[-1])
+            elif opcode == self.READ_ADDR:
+                self.read_addr()
+            elif opcode == self.READ_VAL:
+                self.read_value()
+            elif opcode == self.WRITE_BLOCK:
+                self.write_block(self.curr_addr, [i % self.val_range[-1]])
+            elif opcode == self.READ_BLOCK:
+                self.read_block(self.curr_addr, 1)
+        return time.time() - start
+
+    def calibrate_delay(self, clk_factors=None, opcodes=None, n=64, n_check=512, resolution=1e-6, margin=1.5,
+                        filename=None):
+        '''
+        Finds the shortest safe wait after each type of unbatched command
+        For each clk factor (defaults to the current one) and command type
+        in `opcodes` (defaults to `calibration_opcodes`), the wait is binary
+        searched between the SRAM cycle time and `rw_delay` to `resolution`
+        [s], requiring `n` commands in a row to be read back correctly (see
+        `_calibration_trial`). The wait found times `margin` is checked with
+        `n_check` more commands (and doubled until none fail) and stored in
+        `rw_delays`
+        Overwrites the SRAM contents. The delays are saved to `filename` if
+        given (see `save_delays`)
+        returns dict of (opcode, clk_factor) : (wait [s], error rate,
+          speedup of `n` commands over `rw_delay`)
+        '''
+        clk_factors = [self.clk_factor] if clk_factors is None else clk_factors
+        opcodes = self.calibration_opcodes if opcodes is None else opcodes
+        clk_factor, optimize = self.clk_factor, self.optimize
+        if self.batching:
+            self.flush_batch()
+        batching, self.batching = self.batching, False
+        self.optimize = False
+        self.log.info(' ~ Start delay calibration ~')
+        results = {}
+        try:
+            for clk in clk_factors:
+                self.set_clk(clk)
+                for opcode in opcodes:
+                    key = (opcode, clk)
+                    self.rw_delays.pop(key, None)
+                    if self._calibration_errors(opcode, n):
+                        self.log.warning('opcode {:x} clk_factor {}: errors at rw_delay, not calibrated'.format(
+                            opcode, clk))
+                        continue
+                    safe_time = self._command_time(opcode, n)
+
+                    low, high = self._cycle_time(opcode), self.rw_delay
+                    while high - low > resolution:
+                        self.rw_delays[key] = (low + high)/2
+                        if self._calibration_errors(opcode, n):
+                            low = self.rw_delays[key]
+                        else:
+                            high = self.rw_delays[key]
+
+                    delay = min(high*margin, self.rw_delay)
+                    while True:
+                        self.rw_delays[key] = delay
+                        errors = self._calibration_errors(opcode, n_check, stop=False)
+                        if not errors or delay >= self.rw_delay:
+                            break
+                        self.log.warning('opcode {:x} clk_factor {}: {} errors at {:.2e}s'.format(
+                            opcode, clk, errors, delay))
+                        delay = min(2*delay + resolution, self.rw_delay)
+                    if errors:
+                        self.rw_delays.pop(key)
+                    results[key] = (delay, float(errors)/n_check, safe_time/self._command_time(opcode, n))
+        finally:
+            self.optimize = optimize
+            self.batching = batching
+            self.memory = ShadowMemory(self.addr_range[-1])
+            if clk_factor is not None:
+                self.set_clk(clk_factor)
+
+        self.log.info('Summary:')
+        self.log.info('opcode\tclk\twait [s]\terror rate\tspeedup')
+        for (opcode, clk), (delay, error_rate, speedup) in sorted(results.items(), key=lambda item: item[0][::-1]):
+            self.log.info('{:x}\t{}\t{:.2e}\t{:.2e}\t{:.1f}x'.format(opcode, clk, delay, error_rate, speedup))
+        if filename is not None:
+            self.save_delays(filename)
+        self.log.info(' ~ End delay calibration ~')
+        return results
+
+    def save_delays(self, filename):
+        '''
+        Write the calibrated waits (`rw_delays`) to a json file
+        '''
+        with open(filename, 'w') as f:
+            json.dump([{'opcode': opcode, 'clk_factor': clk, 'delay': delay}
+                       for (opcode, clk), delay in sorted(self.rw_delays.items())], f, indent=1)
+
+    def load_delays(self, filename):
+        '''
+        Read calibrated waits from a file written by `save_delays`
+        '''
+        with open(filename) as f:
+            for entry in json.load(f):
+                self.rw_delays[(entry['opcode'], entry['clk_factor'])] = entry['delay']
+        self.log.info('Loaded {} command delays from {}'.format(len(self.rw_delays), filename))
+
+    def _check_blocks(self, starts, n, patterns):
+        '''
+        Writes and reads back each pattern in the `n`-address blocks starting
+        at `starts` (consecutive blocks are sent as one block transfer)
+        returns mask of the blocks with any failed read
+        '''
+        starts = np.asarray(starts)
+        runs = np.split(starts, np.flatnonzero(np.diff(starts) != n) + 1) if len(starts) else []
+        self.begin_batch()
+        for pattern in patterns:
+            for run in runs:
+                self.write_block(int(run[0]), [pattern]*(len(run)*n))
+                self.read_block(int(run[0]), len(run)*n, stage='check', expected=pattern)
+        records = self.end_batch()
+        failed = np.zeros(self.addr_range[-1], dtype=bool)
+        for stage, addr, expected, read in records:
+            if read != expected:
+                failed[addr] = True
+        return failed[starts[:,np.newaxis] + np.arange(n)].any(axis=1) if len(starts) else np.zeros(0, dtype=bool)
+
+    def bisect_map(self, setting='clk_factor', values=None, block=1, patterns=(0x00, 0xff, 0x55, 0xaa)):
+        '''
+        Finds the most aggressive passing `setting` ('clk_factor' or
+        'delay_factor') of each block of `block` addresses
+        `values` (defaults to 1-255 for the clk factor, 0-255 for the delay)
+        are ordered from most aggressive to most relaxed, and a block is
+        assumed to pass at every value after one where it passes
+        Each block first is checked at the most relaxed value, then its value
+        is binary searched. Each step groups the unresolved blocks by the
+        value they test, and each group writes and reads back `patterns`
+        (see `_check_blocks`), so each block is checked about log2(len(values))
+        times. Resolved blocks are not checked again
+        Overwrites the SRAM contents
+        returns array of the lowest passing value of each address (-1 if it
+        fails at every value, or is not in a full block)
+        '''
+        if setting == 'clk_factor':
+            values, setter = list(range(1, 256) if values is None else values), self.set_clk
+        elif setting == 'delay_factor':
+            values, setter = list(range(0, 256) if values is None else values), self.set_delay
+        else:
+            raise ValueError('unknown setting {}'.format(setting))
+        initial = getattr(self, setting)
+        n_addr = self.addr_range[-1]
+        starts = np.arange(self.addr_range[0], n_addr, block)
+        starts = starts[starts + block <= n_addr]
+        low = np.full(len(starts), -1) # index of a known failing value (-1 before the first)
+        high = np.full(len(starts), len(values)-1) # index of a known passing value
+        self.log.info(' ~ Start {} bisection ({} blocks of {}) ~'.format(setting, len(starts), block))
+        try:
+            setter(values[-1])
+            failed = self._check_blocks(starts, block, patterns)
+            high[failed] = -1
+            low[failed] = len(values)-1
+            n_checks = 1
+            while True:
+                unresolved = np.flatnonzero(high - low > 1)
+                if not len(unresolved):
+                    break
+                mids = (low[unresolved] + high[unresolved])//2
+                for mid in np.unique(mids).tolist():
+                    idxs = unresolved[mids == mid]
+                    setter(values[mid])
+                    failed = self._check_blocks(starts[idxs], block, patterns)
+                    low[idxs[failed]] = mid
+                    high[idxs[~failed]] = mid
+                    n_checks += 1
+        finally:
+            self.memory = ShadowMemory(n_addr)
+            if initial is not None:
+                setter(initial)
+        result = np.full(n_addr, -1)
+        passing = high >= 0
+        result[(starts[passing,np.newaxis] + np.arange(block)).ravel()] = np.repeat(np.array(values)[high[passing]], block)
+        self.log.info('{} {} settings checked, {} blocks never pass'.format(n_checks, setting, int(np.sum(~passing))))
+        self.log.info(' ~ End {} bisection ~'.format(setting))
+        return result
+
     def mats_test(self):
         '''
         Runs basic MATS++ test :
@@ -371,53 +1597,37 @@ class CryoSRAM :
         '''
         self.log.info(' ~ Start MATS++ test ~')
         stages = ['-> 0', '0 -> 1', '1 -> 0']
-        faults = dict([(stage, []) for stage in stages])
-        bitmaps = dict([(stage, []) for stage in stages])
-        # First -> 0
-        self.log.info('Set -> 0')
-        w = 0
-        for addr in range(*self.addr_range):
-            self.set_addr(addr)
-            self.write_value(w)
-
-        # Now 0 -> 1
-        w = 255
-        self.log.info('Verify 0 and set 0 -> 1')
-        for addr in range(*self.addr_range):
-            self.set_addr(addr)
-            expected = self.memory[addr]
-            self.read_value()
-            bitmaps[stages[0]] += [(addr, self.memory[addr])]
-            if self.memory[addr] != expected:
-                faults[stages[0]] += [(addr, expected, self.memory[addr])]
-            self.write_value(w)
-
-        # Now 1 -> 0
-        w = 0
-        self.log.info('Verify 1 and set 1 -> 0')
-        for addr in range(*self.addr_range):
-            self.set_addr(addr)
-            expected = self.memory[addr]
-            self.read_value()
-            bitmaps[stages[1]] += [(addr, self.memory[addr])]
-            if self.memory[addr] != expected:
-                faults[stages[1]] += [(addr, expected, self.memory[addr])]
-            self.write_value(w)
-
-        # Final readback
-        self.log.info('Verify 0')
-        for addr in range(*self.addr_range):
-            self.set_addr(addr)
-            expected = self.memory[addr]
-            self.read_value()
-            bitmaps[stages[2]] += [(addr, self.memory[addr])]
-            if self.memory[addr] != expected:
-                faults[stages[2]] += [(addr, expected, self.memory[addr])]
+        march = [
+            (1, [('w', 0)]),
+            (1, [('r', 0, stages[0]), ('w', 255)]),
+            (1, [('r', 255, stages[1]), ('w', 0)]),
+            (1, [('r', 0, stages[2])])
+        ]
+        faults, bitmaps = self.run_march(march, stages)
 
         self.test_summary(faults)
         self.log.info(' ~ End MATS++ test ~')
         return faults, bitmaps
 
+    def march_test(self, algorithm='March C-', background=0x00, engine=None):
+        '''
+        Runs a march test from notation, e.g. '⇕(w0); ⇑(r0,w1); ⇓(r1,w0)', or
+        the name of a standard algorithm (see `march.march_algorithms`)
+        `background` is the value written for 0 (1 writes its inverse)
+        returns a dict :
+          'M<element>.<op> r<0/1>' - faults of each read in the march
+        fault lists are tuples of :
+          (addr, expected, read)
+        '''
+        march = parse_march(algorithm, background)
+        self.log.info(' ~ Start march test ~')
+        self.log.info('{}: {}'.format(algorithm if algorithm in march_algorithms else 'March', format_march(march)))
+        faults, bitmaps = self.run_march(march, engine=engine)
+
+        self.test_summary(faults)
+        self.log.info(' ~ End march test ~')
+        return faults, bitmaps
+
     def pattern_test(self, test_values=[85,1,2,4,8,16,32,64,128,170]):
         '''
         Executes a pattern test:
@@ -431,25 +1641,19 @@ class CryoSRAM :
         self.log.info(' ~ Start pattern test ~')
         stages = ['pattern']
         faults = dict([(stage, []) for stage in stages])
-        bitmaps = dict([(stage, []) for stage in stages])
+        bitmaps = dict([(stage, BitCounts(self.addr_range[-1])) for stage in stages])
 
         doubled_pattern = test_values + list(reversed(test_values))
         self.log.info('Write pattern:')
         for value in doubled_pattern:
             self.log.info(format(value,'08b'))
-        for addr in range(*self.addr_range):
-            w = doubled_pattern[addr%(len(doubled_pattern))]
-            self.set_addr(addr)
-            self.write_value(w)
+        self.begin_batch(faults, bitmaps)
+        self.write_block(self.addr_range[0], [doubled_pattern[addr%(len(doubled_pattern))]
+                                              for addr in range(*self.addr_range)])
 
         self.log.info('Verify')
-        for addr in range(*self.addr_range):
-            self.set_addr(addr)
-            expected = self.memory[addr]
-            self.read_value()
-            bitmaps[stages[0]] += [(addr, self.memory[addr])]
-            if self.memory[addr] != expected:
-                faults[stages[0]] += [(addr, expected, self.memory[addr])]
+        self.read_block(self.addr_range[0], len(range(*self.addr_range)), stage=stages[0])
+        self.end_batch()
 
         self.test_summary(faults)
         self.log.info(' ~ End pattern test ~')
@@ -469,46 +1673,15 @@ class CryoSRAM :
         '''
         self.log.info(' ~ Start single bit test ~')
         self.log.info('Values: {}'.format([format(value,'08b') for value in test_values]))
-        stages = ['-> 0']
-        faults = dict([(stage,[]) for stage in stages])
-        bitmaps = dict([(stage,[]) for stage in stages])
-        for value in test_values + [0]:
-            faults[format(value,'08b')] = []
-            bitmaps[format(value,'08b')] = []
-
-        self.log.info('Set -> 0')
-        w = 0
-        for addr in range(*self.addr_range):
-            self.set_addr(addr)
-            self.write_value(w)
-
-        self.log.info('Perform single bit write and verification')
-        for addr in range(*self.addr_range):
-            self.set_addr(addr)
-
-            # check initial value
-            expected = self.memory[addr]
-            self.read_value()
-            bitmaps[stages[0]] += [(addr, self.memory[addr])]
-            if self.memory[addr] != expected:
-                faults[stages[0]] += [(addr, expected, self.memory[addr])]
-
-            # write test values
-            for w in test_values:
-                self.write_value(w)
-                expected = self.memory[addr]
-                self.read_value()
-                bitmaps[format(w,'08b')] += [(addr, self.memory[addr])]
-                if self.memory[addr] != expected:
-                    faults[format(w,'08b')] += [(addr, expected, self.memory[addr])]
-            # check final value
-            w = 0
-            self.write_value(w)
-            expected = self.memory[addr]
-            self.read_value()
-            bitmaps[format(w,'08b')] += [(addr, self.memory[addr])]
-            if self.memory[addr] != expected:
-                faults[format(w,'08b')] += [(addr, expected, self.memory[addr])]
+        stages = ['-> 0'] + [format(value,'08b') for value in test_values + [0]]
+        ops = [('r', 0, stages[0])]
+        for w in test_values + [0]:
+            ops += [('w', w), ('r', w, format(w,'08b'))]
+        march = [
+            (1, [('w', 0)]),
+            (1, ops)
+        ]
+        faults, bitmaps = self.run_march(march, stages)
 
         self.test_summary(faults)
         self.log.info(' ~ End single bit test ~')
@@ -527,28 +1700,21 @@ class CryoSRAM :
         self.log.info(' ~ Start random test ~')
         stages = ['rand_static', 'rand_dynamic']
         faults = dict([(stage,[]) for stage in stages])
-        bitmaps = dict([(stage,[]) for stage in stages])
+        bitmaps = dict([(stage, BitCounts(self.addr_range[-1])) for stage in stages])
 
         # First read back the current state
         self.log.info('Store current state')
-        for addr in range(*self.addr_range):
-            self.set_addr(addr)
-            self.read_value()
+        self.begin_batch()
+        self.read_block(self.addr_range[0], len(range(*self.addr_range)))
+        self.end_batch()
 
         # Issue N 'static' read/writes
+        self.begin_batch(faults, bitmaps)
         for i in range(int(n_static)):
             self.log.info('Static RW {}/{}'.format(i+1,n_static))
-            for addr in range(*self.addr_range):
-                self.set_addr(addr)
-                w = randint(self.val_range[0], self.val_range[-1]-1)
-                self.write_value(w)
-            for addr in range(*self.addr_range):
-                self.set_addr(addr)
-                expected = self.memory[addr]
-                self.read_value()
-                bitmaps[stages[0]] += [(addr, self.memory[addr])]
-                if self.memory[addr] != expected:
-                    faults[stages[0]] += [(addr, expected, self.memory[addr])]
+            self.write_block(self.addr_range[0], [randint(self.val_range[0], self.val_range[-1]-1)
+                                                  for addr in range(*self.addr_range)])
+            self.read_block(self.addr_range[0], len(range(*self.addr_range)), stage=stages[0])
 
         # Issue N 'dynamic' read/writes
         for i in range(int(n_dynamic)):
@@ -561,38 +1727,84 @@ class CryoSRAM :
                 w = randint(self.val_range[0], self.val_range[-1]-1)
                 self.write_value(w)
             else:
-                expected = self.memory[addr]
-                self.read_value()
-                bitmaps[stages[1]] += [(addr, self.memory[addr])]
-                if self.memory[addr] != expected:
-                    faults[stages[1]] += [(addr, expected, self.memory[addr])]
+                self.read_value(stage=stages[1])
+        self.end_batch()
         self.test_summary(faults)
         self.log.info(' ~ End random test ~')
         return faults, bitmaps
 
-class TestIO:
-    '''
-    A dummy class for testing IO
-    '''
-
-    def __init__(self):
-        self.queued_bytes = []
-
-    def write(self, write_bytes):
+    def rand_stream(self, n_static=2, n_dynamic=2.5e3, seed=None, chunk=4096):
         '''
-        Mock write message
+        Streaming version of `rand_test` for long (soak) runs
+        Ops are drawn in blocks of `chunk` from a numpy Generator seeded with
+        `seed` (a random seed is drawn and logged if None), so the same seed
+        and arguments repeat the same ops. Each block is sent in one batch
+        and its reads verified, then only the faults are kept
+        Generator of fault records :
+          (stage, addr, expected, read)
+        with stages 'rand_static' and 'rand_dynamic'. Memory use does not
+        grow with `n_dynamic`
         '''
-        print(write_bytes)
+        if seed is None:
+            seed = np.random.SeedSequence().entropy
+        self.log.info(' ~ Start random stream (seed {}) ~'.format(seed))
+        rng = np.random.default_rng(seed)
+        stages = ['rand_static', 'rand_dynamic']
+        n_faults = dict([(stage, 0) for stage in stages])
+        n_addr = len(range(*self.addr_range))
+        n_val = len(range(*self.val_range))
+
+        # First read back the current state
+        self.log.info('Store current state')
+        self.begin_batch()
+        self.read_block(self.addr_range[0], n_addr)
+        self.end_batch()
 
-    def read(self, n_bytes):
+        # Issue N 'static' read/writes
+        for i in range(int(n_static)):
+            self.log.info('Static RW {}/{}'.format(i+1,n_static))
+            values = self.val_range[0] + rng.integers(0, n_val, n_addr)
+            self.begin_batch()
+            self.write_block(self.addr_range[0], values.tolist())
+            self.read_block(self.addr_range[0], n_addr, stage=stages[0])
+            for record in self._stream_faults(self.end_batch()):
+                n_faults[record[0]] += 1
+                yield record
+
+        # Issue N 'dynamic' read/writes, one draw per op of {value, write, addr}
+        n_dynamic = int(n_dynamic)
+        for start in range(0, n_dynamic, chunk):
+            self.log.info('Dynamic RW {}/{}'.format(start,n_dynamic))
+            ops = rng.integers(0, n_addr*2*n_val, min(chunk, n_dynamic - start))
+            addrs = (self.addr_range[0] + ops % n_addr).tolist()
+            writes = ((ops // n_addr) % 2).astype(bool).tolist()
+            values = (self.val_range[0] + ops // (2*n_addr)).tolist()
+            self.begin_batch()
+            for addr, write, value in zip(addrs, writes, values):
+                self.set_addr(addr)
+                if write:
+                    self.write_value(value)
+                else:
+                    self.read_value(stage=stages[1])
+            for record in self._stream_faults(self.end_batch()):
+                n_faults[record[0]] += 1
+                yield record
+        self.test_summary(n_faults)
+        self.log.info(' ~ End random stream ~')
+
+    @staticmethod
+    def _stream_faults(read_records):
         '''
-        Mock read message
+        Returns the records from `end_batch` whose read differs from expected
         '''
-        read_bytes = 0
-        return_bytes = b''
-        for byte_idx in range(n_bytes):
-            if len(self.queued_bytes):
-                print(self.queued_bytes[0])
-                return_bytes += self.queued_bytes[0]
-                del self.queued_bytes
-        return return_bytes
+        if not len(read_records):
+            return []
+        stages, addrs, expected, reads = zip(*read_records)
+        fault_mask = ShadowMemory.compare(expected, reads)
+        return [read_records[i] for i in np.flatnonzero(fault_mask).tolist()]
+
+class TestIO(SimFPGA) :
+    '''
+    A simulated FPGA for testing without hardware (see `sram_sim.SimFPGA`)
+    '''
+    __test__ = False # not a pytest test class
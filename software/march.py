@@ -0,0 +1,175 @@
+'''
+March test notation
+  element = <direction>(<op>,<op>,...)
+  march = <element>; <element>; ...
+where direction is one of
+  ⇑ (also ↑, ^, up) - ascending addresses
+  ⇓ (also ↓, v, down) - descending addresses
+  ⇕ (also ↕, any) - either (run ascending)
+and each op is w0, w1, r0 or r1 (0 is the data background, 1 its inverse),
+or a write or read of a two-digit hex value (e.g. w5a, as `format_march`)
+e.g.
+  parse_march('⇕(w0); ⇑(r0,w1); ⇓(r1,w0)')
+'''
+import re
+import numpy as np
+
+directions = {
+    '⇑' : 1, '↑' : 1, '^' : 1, 'up' : 1,
+    '⇓' : -1, '↓' : -1, 'v' : -1, 'down' : -1,
+    '⇕' : 0, '↕' : 0, 'any' : 0,
+}
+
+element_re = re.compile(r'^\s*(\S+?)\s*\(([^()]*)\)\s*$')
+op_re = re.compile(r'^\s*([rwRW])\s*([01]|[0-9a-fA-F]{2})\s*$')
+
+march_algorithms = {
+    'MATS' : '⇕(w0); ⇕(r0,w1); ⇕(r1)',
+    'MATS+' : '⇕(w0); ⇑(r0,w1); ⇓(r1,w0)',
+    'MATS++' : '⇕(w0); ⇑(r0,w1); ⇓(r1,w0,r0)',
+    'March X' : '⇕(w0); ⇑(r0,w1); ⇓(r1,w0); ⇕(r0)',
+    'March Y' : '⇕(w0); ⇑(r0,w1,r1); ⇓(r1,w0,r0); ⇕(r0)',
+    'March C-' : '⇕(w0); ⇑(r0,w1); ⇑(r1,w0); ⇓(r0,w1); ⇓(r1,w0); ⇕(r0)',
+    'March A' : '⇕(w0); ⇑(r0,w1,w0,w1); ⇑(r1,w0,w1); ⇓(r1,w0,w1,w0); ⇓(r0,w1,w0)',
+    'March B' : '⇕(w0); ⇑(r0,w1,r1,w0,r0,w1); ⇑(r1,w0,w1); ⇓(r1,w0,w1,w0); ⇓(r0,w1,w0)',
+    'March LR' : '⇕(w0); ⇓(r0,w1); ⇑(r1,w0,r0,w1); ⇑(r1,w0); ⇑(r0,w1,r1,w0); ⇑(r0)',
+    'March SS' : '⇕(w0); ⇑(r0,r0,w0,r0,w1); ⇑(r1,r1,w1,r1,w0); ⇓(r0,r0,w0,r0,w1); ⇓(r1,r1,w1,r1,w0); ⇕(r0)',
+}
+
+def parse_march(notation, background=0x00):
+    '''
+    Compiles march notation (or the name of one of `march_algorithms`) to a
+    list of elements for `CryoSRAM.run_march`
+    `background` is the value written for 0 (1 writes its inverse)
+    Each read is its own stage, named 'M<element>.<op> r<0/1>' (or
+    'M<element>.<op> r<value>' for hex values, as `decode_march`)
+    Raises ValueError if the notation cannot be parsed
+    '''
+    notation = march_algorithms.get(notation, notation)
+    values = [background & 0xff, ~background & 0xff]
+    march = []
+    for element_idx, element in enumerate(notation.strip().rstrip(';').split(';')):
+        match = element_re.match(element)
+        if match is None or match.group(1).lower() not in directions:
+            raise ValueError('cannot parse march element {!r}'.format(element.strip()))
+        direction = directions[match.group(1).lower()]
+        ops = []
+        for op_idx, op in enumerate(match.group(2).split(',')):
+            op_match = op_re.match(op)
+            if op_match is None:
+                raise ValueError('cannot parse march op {!r} in {!r}'.format(op.strip(), element.strip()))
+            kind, value = op_match.group(1).lower(), op_match.group(2)
+            if len(value) == 2:
+                value, label = int(value, 16), '{:02x}'.format(int(value, 16))
+            else:
+                value, label = values[int(value)], value
+            if kind == 'w':
+                ops += [('w', value)]
+            else:
+                ops += [('r', value, 'M{}.{} r{}'.format(element_idx, op_idx, label))]
+        march += [(direction if direction else 1, ops)]
+    return march
+
+def format_march(march):
+    '''
+    Returns the notation of a list of march elements (values shown in hex,
+    which `parse_march` reads back)
+    '''
+    return '; '.join(['{}({})'.format('⇓' if direction < 0 else '⇑',
+                                      ','.join(['{}{:02x}'.format(op[0], op[1]) for op in ops]))
+                      for direction, ops in march])
+
+def decode_march(program):
+    '''
+    Returns the list of march elements of an fpga march program (the
+    inverse of `CryoSRAM.encode_march`)
+    Each read is its own stage, named 'M<element>.<op> r<value>'
+    Raises ValueError if the program is truncated
+    '''
+    program = bytes(program)
+    march = []
+    idx = 0
+    while idx < len(program):
+        direction = -1 if program[idx] & 0x80 else 1
+        n_ops = program[idx] & 0x7f
+        if idx + 1 + 2*n_ops > len(program):
+            raise ValueError('march program truncated in element {}'.format(len(march)))
+        ops = []
+        for op_idx in range(n_ops):
+            kind, value = program[idx+1+2*op_idx], program[idx+2+2*op_idx]
+            if kind & 0x1:
+                ops += [('r', value, 'M{}.{} r{:02x}'.format(len(march), op_idx, value))]
+            else:
+                ops += [('w', value)]
+        march += [(direction, ops)]
+        idx += 1 + 2*n_ops
+    return march
+
+def march_end_addr(march, n_addr):
+    '''
+    Returns the address register after a march over `n_addr` addresses
+    '''
+    last = [direction for direction, ops in march if len(ops)]
+    if not len(last):
+        return None
+    return 0 if last[-1] < 0 else n_addr-1
+
+def march_results(march, records, n_addr, faults, bitmaps):
+    '''
+    Adds the fault records of a march run by the fpga to the `faults` and
+    `bitmaps` dicts of stage : list and stage : `BitCounts` (stages not in
+    the dicts are skipped)
+    `records` is an array of shape (n, 4) of
+      {MARCH, element[2:0], addr[8]}, {addr[7:0]}, {0, op[6:0]}, {read}
+    Bitmaps count every read, the expected value unless reported
+    returns the values in memory after the march (None if it has no ops)
+    and a list of the invalid records
+    '''
+    records = np.asarray(records, dtype=np.uint8).reshape(-1,4)
+    elements = ((records[:,0] >> 1) & 0x7).tolist()
+    addrs = (((records[:,0] & 0x1).astype(int) << 8) | records[:,1]).tolist()
+    op_idxs = records[:,2].tolist()
+    reads = records[:,3].tolist()
+
+    # faults in order of execution
+    fault_reads = {}
+    invalid = []
+    for element, addr, op_idx, read in zip(elements, addrs, op_idxs, reads):
+        if element >= len(march) or op_idx >= len(march[element][1]):
+            invalid += [(element, addr, op_idx, read)]
+            continue
+        op = march[element][1][op_idx]
+        fault_reads.setdefault((element, op_idx), []).append((addr, read))
+        if op[2] in faults:
+            faults[op[2]] += [(addr, op[1], read)]
+
+    # bitmaps of every read (expected value unless reported)
+    for element, (direction, ops) in enumerate(march):
+        element_addrs = np.arange(n_addr)[::-1] if direction < 0 else np.arange(n_addr)
+        read_ops = [(op_idx, op) for op_idx, op in enumerate(ops) if op[0] == 'r']
+        if not len(read_ops):
+            continue
+        values = np.zeros((n_addr, len(read_ops)), dtype=int)
+        for col, (op_idx, op) in enumerate(read_ops):
+            values[:,col] = op[1]
+            for addr, read in fault_reads.get((element, op_idx), []):
+                values[n_addr-1-addr if direction < 0 else addr, col] = read
+        read_stages = [op[2] for op_idx, op in read_ops]
+        for stage in set(read_stages):
+            if stage not in bitmaps:
+                continue
+            cols = np.array([read_stage == stage for read_stage in read_stages])
+            expected = [op[1] for op_idx, op in read_ops if op[2] == stage]
+            bitmaps[stage].add(np.repeat(element_addrs, np.sum(cols)), values[:,cols].ravel(),
+                               np.tile(expected, n_addr))
+
+    # final state is set by the last op of the last element
+    last = [element for element, (direction, ops) in enumerate(march) if len(ops)]
+    if not len(last):
+        return None, invalid
+    direction, ops = march[last[-1]]
+    values = np.full(n_addr, ops[-1][1], dtype=np.uint8)
+    if ops[-1][0] == 'r':
+        for addr, read in fault_reads.get((last[-1], len(ops)-1), []):
+            values[addr] = read
+    return values, invalid
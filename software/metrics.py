@@ -0,0 +1,174 @@
+'''
+Performance counters of the `CryoSRAM` command path and `CryoLogger`
+Enable with `CryoSRAM(..., metrics=True)`, then e.g.:
+  c.metrics.summary() # dict of counters
+  c.metrics.save('data/metrics.json')
+  c.metrics.reset()
+When disabled (the default) `CryoSRAM.metrics` is None and nothing is
+recorded
+'''
+import json
+import math
+import time
+
+class Metrics :
+    '''
+    Counters and latency histograms of each command type, time spent
+    sleeping and logger flushes
+    Command latency is measured from the write until the command's wait
+    (`rw_delay`) ends. Batched commands are counted when they are queued and
+    the whole batch is timed when it is flushed (as 'batch')
+    Latencies are histogrammed in `bins_per_decade` logarithmic bins from
+    `hist_min` to `hist_max`
+    '''
+    hist_min = 1e-6 # [s]
+    hist_max = 10. # [s]
+    bins_per_decade = 4
+
+    def __init__(self, byte_time, names=None):
+        '''
+        `byte_time` [s] is the time to send one byte on the uart
+        `names` maps command keys (opcodes) to names in the summary
+        '''
+        self.byte_time = byte_time
+        self.names = {} if names is None else names
+        self.n_bins = int(round(math.log10(self.hist_max/self.hist_min)*self.bins_per_decade)) + 1
+        self.reset()
+
+    def reset(self):
+        '''
+        Clears all counters
+        '''
+        self.start = time.perf_counter()
+        self.commands = {} # key : [count, tx bytes, rx bytes, short reads, missing bytes, n timed, total time, max time, histogram]
+        self.n_sleeps = 0
+        self.sleep_time = 0.
+        self.n_flushes = 0
+        self.flush_time = 0.
+        self.max_flush_time = 0.
+        self.flush_records = 0
+
+    def bin_edges(self):
+        '''
+        Returns the upper edge of each latency bin [s] (the last bin also
+        holds all longer latencies)
+        '''
+        return [self.hist_min*10**((i+1)/self.bins_per_decade) for i in range(self.n_bins)]
+
+    def _bin(self, seconds):
+        if seconds <= self.hist_min:
+            return 0
+        return min(int(math.log10(seconds/self.hist_min)*self.bins_per_decade), self.n_bins-1)
+
+    def command(self, key, tx_bytes=0, rx_bytes=0, rx_expected=0, seconds=None):
+        '''
+        Records one command (or batch) of type `key`
+        A response shorter than `rx_expected` is counted as a short read
+        '''
+        entry = self.commands.get(key)
+        if entry is None:
+            entry = self.commands[key] = [0, 0, 0, 0, 0, 0, 0., 0., [0]*self.n_bins]
+        entry[0] += 1
+        entry[1] += tx_bytes
+        entry[2] += rx_bytes
+        if rx_bytes < rx_expected:
+            entry[3] += 1
+            entry[4] += rx_expected - rx_bytes
+        if seconds is not None:
+            entry[5] += 1
+            entry[6] += seconds
+            entry[7] = max(entry[7], seconds)
+            entry[8][self._bin(seconds)] += 1
+
+    def sleep(self, seconds):
+        '''
+        Records a wait between commands
+        '''
+        self.n_sleeps += 1
+        self.sleep_time += seconds
+
+    def flush(self, seconds, n_records):
+        '''
+        Records a logger flush of `n_records` messages (or capture records)
+        '''
+        self.n_flushes += 1
+        self.flush_time += seconds
+        self.max_flush_time = max(self.max_flush_time, seconds)
+        self.flush_records += n_records
+
+    def percentile(self, hist, q):
+        '''
+        Returns the upper edge of the bin holding the `q`th percentile of a
+        latency histogram (None if empty)
+        '''
+        total = sum(hist)
+        if not total:
+            return None
+        count = 0
+        for edge, n in zip(self.bin_edges(), hist):
+            count += n
+            if count >= q/100.*total:
+                return edge
+        return self.hist_max
+
+    def summary(self):
+        '''
+        Returns a dict of all counters (json serializable)
+        '''
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        commands = {}
+        for key, (count, tx_bytes, rx_bytes, short_reads, missing_bytes, n_timed, total_time, max_time, hist) \
+                in self.commands.items():
+            commands[self.names.get(key, str(key))] = dict(
+                count=count, tx_bytes=tx_bytes, rx_bytes=rx_bytes, short_reads=short_reads,
+                missing_bytes=missing_bytes, timed=n_timed,
+                mean_latency=total_time/n_timed if n_timed else None, max_latency=max_time if n_timed else None,
+                p50_latency=self.percentile(hist, 50), p99_latency=self.percentile(hist, 99), histogram=hist)
+        frames = sum([entry[0] for key, entry in self.commands.items() if key != 'batch'])
+        tx_bytes = sum([entry[1] for entry in self.commands.values()])
+        rx_bytes = sum([entry[2] for entry in self.commands.values()])
+        return dict(
+            elapsed=elapsed,
+            frames=frames,
+            frames_per_s=frames/elapsed,
+            tx_bytes=tx_bytes,
+            rx_bytes=rx_bytes,
+            tx_utilization=tx_bytes*self.byte_time/elapsed,
+            rx_utilization=rx_bytes*self.byte_time/elapsed,
+            short_reads=sum([entry[3] for entry in self.commands.values()]),
+            sleeps=self.n_sleeps,
+            sleep_time=self.sleep_time,
+            sleep_fraction=self.sleep_time/elapsed,
+            log_flushes=self.n_flushes,
+            log_flush_time=self.flush_time,
+            log_max_flush_time=self.max_flush_time,
+            log_flush_records=self.flush_records,
+            latency_bins=self.bin_edges(),
+            commands=commands
+            )
+
+    def save(self, filename):
+        '''
+        Writes the summary to a json file
+        '''
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent=1)
+
+    def log_summary(self, log):
+        '''
+        Prints the summary with `log.info`
+        '''
+        summary = self.summary()
+        log.info('Metrics ({:.1f}s): {} frames ({:.0f}/s), uart tx {:.1%} rx {:.1%}, asleep {:.1%}, short reads {}'.format(
+            summary['elapsed'], summary['frames'], summary['frames_per_s'], summary['tx_utilization'],
+            summary['rx_utilization'], summary['sleep_fraction'], summary['short_reads']))
+        if summary['log_flushes']:
+            log.info('Log flushes: {} ({} records) in {:.3f}s, max {:.3g}s'.format(
+                summary['log_flushes'], summary['log_flush_records'], summary['log_flush_time'],
+                summary['log_max_flush_time']))
+        log.info('command\tcount\ttx bytes\trx bytes\tshort\tmean [s]\tp99 [s]')
+        for name, entry in sorted(summary['commands'].items()):
+            log.info('{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(
+                name, entry['count'], entry['tx_bytes'], entry['rx_bytes'], entry['short_reads'],
+                '-' if entry['mean_latency'] is None else '{:.3g}'.format(entry['mean_latency']),
+                '-' if entry['p99_latency'] is None else '{:.3g}'.format(entry['p99_latency'])))
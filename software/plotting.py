@@ -1,121 +1,224 @@
+import os
+import json
+import pickle
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
 import numpy as np
+from bitcounts import BitCounts
 #plt.ion()
 
+hist_shape = (64, 64) # (address[8:6] x bit index, address[5:0])
+
+def fault_arrays(fault_list):
+    '''
+    Converts a fault_list formatted (addr, expected, actual) to numpy arrays
+    of addrs, expected and actual values
+    Entries with an unknown value (None) are dropped
+    '''
+    if not len(fault_list):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint8)
+    faults = np.array(fault_list)
+    if faults.dtype == object:
+        faults = faults[np.all(faults != None, axis=1)]
+    faults = faults.astype(int).reshape(-1,3)
+    return faults[:,0], faults[:,1].astype(np.uint8), faults[:,2].astype(np.uint8)
+
+def bitmap_arrays(bit_map):
+    '''
+    Converts a bit_map of (addr, byte) pairs to numpy arrays of addrs and
+    bytes (unknown bytes are dropped)
+    '''
+    if not len(bit_map):
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=np.uint8)
+    bit_map = np.array(bit_map)
+    if bit_map.dtype == object:
+        bit_map = bit_map[bit_map[:,1] != None]
+    bit_map = bit_map.astype(int).reshape(-1,2)
+    return bit_map[:,0], bit_map[:,1].astype(np.uint8)
+
+def bit_error_array(fault_list):
+    '''
+    Expects a standard fault_list formatted (addr, expected, actual)
+    returns addrs and an array of bit error types (+1 read 1, expected 0;
+      -1 read 0, expected 1; 0 no error) indexed by [fault, bit index]
+    bit index 0 is the most significant bit
+    '''
+    addrs, expected, actual = fault_arrays(fault_list)
+    flipped = np.unpackbits((expected ^ actual)[:,np.newaxis], axis=1).astype(np.int8)
+    return addrs, flipped*(2*np.unpackbits(actual[:,np.newaxis], axis=1).astype(np.int8) - 1)
+
+def histogram_bits(addrs, weights):
+    '''
+    Fills a 2D histogram binned as in the bit maps, x = address[8:6] (split
+    into 8 bit indices) and y = address[5:0]
+    `weights` is indexed by [entry, bit index]
+    '''
+    x = ((addrs[:,np.newaxis] >> 6)*8 + np.arange(8)).ravel()
+    y = np.repeat(addrs & 0x3f, 8)
+    return np.bincount(x*hist_shape[1] + y, weights=np.asarray(weights).ravel(),
+                       minlength=hist_shape[0]*hist_shape[1]).reshape(hist_shape)
+
+def bit_error_histograms(fault_list):
+    '''
+    Expects a standard fault_list formatted (addr, expected, actual) or the
+    `BitCounts` of a stage
+    returns 2D histograms (see `histogram_bits`) of bit error counts and net
+    bit error type
+    '''
+    if isinstance(fault_list, BitCounts):
+        addrs = np.arange(fault_list.n_addr)
+        return (histogram_bits(addrs, fault_list.errors_01 + fault_list.errors_10),
+                histogram_bits(addrs, fault_list.errors_01 - fault_list.errors_10))
+    addrs, errors = bit_error_array(fault_list)
+    return histogram_bits(addrs, errors != 0), histogram_bits(addrs, errors)
+
+def bit_map_histograms(bit_map):
+    '''
+    Expects the `BitCounts` of a stage (or a bit_map of (addr, byte) pairs)
+    returns 2D histograms (see `histogram_bits`) of net bit value (+1 for 1,
+    -1 for 0) and read counts
+    The counters are histogrammed directly, so the cost does not depend on
+    the number of reads
+    '''
+    if isinstance(bit_map, BitCounts):
+        addrs = np.arange(bit_map.n_addr)
+        return (histogram_bits(addrs, bit_map.ones - bit_map.zeros),
+                histogram_bits(addrs, bit_map.ones + bit_map.zeros))
+    addrs, values = bitmap_arrays(bit_map)
+    bits = np.unpackbits(values[:,np.newaxis], axis=1).astype(np.int8)
+    return histogram_bits(addrs, 2*bits - 1), histogram_bits(addrs, np.ones_like(bits))
+
+def count_bit_errors(fault_list):
+    '''
+    Number of bit errors in a fault_list formatted (addr, expected, actual)
+    '''
+    addrs, expected, actual = fault_arrays(fault_list)
+    return int(np.unpackbits(expected ^ actual).sum())
+
 def convert_to_bitmap(byte):
     '''
     Generates a list of (bit, bit_idx) pairs for a bit map
     '''
-    binary = format(byte,'08b')
-    values = []
-    for i,bit in enumerate(binary):
-        values += [(int(bit), i)]
-    return values
+    return list(zip(np.unpackbits(np.uint8(byte)).tolist(), range(8)))
 
 def find_bit_errors(expected_byte, actual_byte):
     '''
-    inputs should be convertable to 8-bit string via format(<>,'08b')
+    inputs should be 8-bit values
     return list of (error type, bit index)
     '''
-    expected_binary = format(expected_byte,'08b')
-    actual_binary = format(actual_byte,'08b')
-    errors = []
-    for i,bit in enumerate(actual_binary):
-        if bit != expected_binary[i]:
-            bit_idx = i
-            expected_bit = expected_binary[i]
-            error = int(bit) - int(expected_bit)
-            errors += [(error, bit_idx)]
-    return errors
+    addrs, errors = bit_error_array([(0, expected_byte, actual_byte)])
+    bit_idxs = np.flatnonzero(errors)
+    return list(zip(errors.ravel()[bit_idxs].tolist(), bit_idxs.tolist()))
 
 def collect_bit_errors(fault_list):
     '''
     fault_list should be formatted (addr, expected, actual)
     returns list of (addr, bit_idx, bit error type)
     '''
-    collected_bit_error_list = []
-    for addr, expected, actual in fault_list:
-        bit_error_list = find_bit_errors(expected, actual)
-        for error_type, bit_idx in bit_error_list:
-            collected_bit_error_list += [(addr, bit_idx, error_type)]
-    return collected_bit_error_list
+    addrs, errors = bit_error_array(fault_list)
+    fault_idxs, bit_idxs = np.nonzero(errors)
+    return list(zip(addrs[fault_idxs].tolist(), bit_idxs.tolist(), errors[fault_idxs, bit_idxs].tolist()))
 
-def plot_bit_map(bit_map, label='Bit map', show=True):
+def plot_histogram(hist, ax=None, **kwargs):
     '''
-    Visualizes the memory described by bit_map
-    Effectively this is a bit "intensity" plot
-    Bit_map should be a list of (addr, byte) pairs
-    '''
-    x = []
-    y = []
-    w = []
-    bins = [np.linspace(0,8,65),range(0,65)]
-    for addr, byte in bit_map:
-        for bit, bit_idx in convert_to_bitmap(byte):
-            x += [bit_idx/8. + int(addr/64)]
-            y += [addr%64]
-            w += [2*bit - 1]
-    plt.figure(label)
-    plt.subplot(2,1,1)
-    bmax = max(abs(np.histogram2d(x,y,bins,weights=w)[0]).max(),1)
-    plt1 = plt.hist2d(x,y,bins,weights=w,cmap='seismic',vmin=-bmax,vmax=bmax)
-    plt1_lines = plt.vlines(range(0,8),0,64,linestyles='dashed')
-    cb1 = plt.colorbar(ticks=[-bmax,0,bmax])
+    Draws a 2D histogram from `bit_map_histograms` or `bit_error_histograms`
+    with the address boundaries marked (on the current axes if `ax` is None)
+    The bins are drawn as one image, which is much faster to save than a
+    mesh of 4096 patches
+    '''
+    ax = plt.gca() if ax is None else ax
+    mesh = ax.imshow(hist.T, origin='lower', extent=(0,8,0,64), aspect='auto', interpolation='nearest', **kwargs)
+    ax.vlines(range(0,8),0,64,linestyles='dashed')
+    return mesh
+
+def draw_bit_map(fig, bit_map):
+    '''
+    Draws the plots of `plot_bit_map` on a matplotlib `Figure`
+    '''
+    values, counts = bit_map_histograms(bit_map)
+    ax1 = fig.add_subplot(2,1,1)
+    bmax = max(abs(values).max(),1)
+    plt1 = plot_histogram(values,ax=ax1,cmap='seismic',vmin=-bmax,vmax=bmax)
+    cb1 = fig.colorbar(plt1,ax=ax1,ticks=[-bmax,0,bmax])
     cb1.set_label('value')
     cb1.ax.set_yticklabels(['0','','1'])
-    plt.ylabel('address[5:0]')
+    ax1.set_ylabel('address[5:0]')
 
-    plt.subplot(2,1,2)
-    plt2 = plt.hist2d(x,y,bins,cmap='Greys')
-    plt2_lines = plt.vlines(range(0,8),0,64,linestyles='dashed')
-    cb2 = plt.colorbar()
+    ax2 = fig.add_subplot(2,1,2)
+    plt2 = plot_histogram(counts,ax=ax2,cmap='Greys')
+    cb2 = fig.colorbar(plt2,ax=ax2)
     cb2.set_label('count')
-    plt.ylabel('address[5:0]')
-    
-    plt.xlabel('address[8:6]')
+    ax2.set_ylabel('address[5:0]')
+    ax2.set_xlabel('address[8:6]')
+
+def plot_bit_map(bit_map, label='Bit map', show=True):
+    '''
+    Visualizes the memory described by bit_map
+    Effectively this is a bit "intensity" plot
+    Bit_map should be a `BitCounts` (or a list of (addr, byte) pairs)
+    '''
+    draw_bit_map(plt.figure(label), bit_map)
     if show:
         plt.show()
 
-def plot_bit_error_map(fault_list, label='Bit error map', weight_by_error=False, show=True):
+def draw_bit_error_map(fig, fault_list, weight_by_error=False):
     '''
-    Expects a standard fault_list formatted (addr, expected, actual)
-    Generates 2D histograms of bit errors
-    Use `weight_by_error` to display net bit error (+1 for 1 and -1 for 0)
-
+    Draws the plots of `plot_bit_error_map` on a matplotlib `Figure`
     '''
-    bit_error_list = collect_bit_errors(fault_list)
-    x = []
-    y = []
-    w = []
-    bins = [np.linspace(0,8,65),range(0,65)]
-    for addr, bit_idx, bit_error in bit_error_list:
-        x += [bit_idx/8. + int(addr/64)]
-        y += [addr%64]
-        w += [bit_error]
-    plt.figure(label)
-    if weight_by_error:
-        ax1 = plt.subplot(2,1,1)
-    nmax = max(np.histogram2d(x,y,bins)[0].max(), 1)
-    plt1 = plt.hist2d(x,y,bins,cmap='Greys',vmin=0,vmax=nmax)
-    plt1_lines = plt.vlines(range(0,8),0,64,linestyles='dashed')
-    cb1 = plt.colorbar()
+    counts, net = bit_error_histograms(fault_list)
+    ax1 = fig.add_subplot(2,1,1) if weight_by_error else fig.add_subplot(1,1,1)
+    nmax = max(counts.max(), 1)
+    plt1 = plot_histogram(counts,ax=ax1,cmap='Greys',vmin=0,vmax=nmax)
+    cb1 = fig.colorbar(plt1,ax=ax1)
     cb1.set_label('errors')
-    plt.ylabel('address[5:0]')
-    
+    ax1.set_ylabel('address[5:0]')
+    if not weight_by_error:
+        ax1.set_xlabel('address[8:6]')
+
     if weight_by_error:
-        ax2 = plt.subplot(2,1,2)
-        wmax = max(abs(np.histogram2d(x,y,weights=w,bins=bins)[0]).max(), 1)
-        plt2 = plt.hist2d(x,y,bins,weights=w,cmap='seismic',vmin=-wmax,vmax=wmax)
-        plt2_lines = plt.vlines(range(0,8),0,64,linestyles='dashed')
-        cb2 = plt.colorbar(ticks=[-wmax,0,wmax])
+        ax2 = fig.add_subplot(2,1,2)
+        wmax = max(abs(net).max(), 1)
+        plt2 = plot_histogram(net,ax=ax2,cmap='seismic',vmin=-wmax,vmax=wmax)
+        cb2 = fig.colorbar(plt2,ax=ax2,ticks=[-wmax,0,wmax])
         cb2.set_label('net error type')
         cb2.ax.set_yticklabels(['0','','1'])
-        plt.ylabel('address[5:0]')
+        ax2.set_ylabel('address[5:0]')
+        ax2.set_xlabel('address[8:6]')
 
-    plt.xlabel('address[8:6]')
+def plot_bit_error_map(fault_list, label='Bit error map', weight_by_error=False, show=True):
+    '''
+    Expects a standard fault_list formatted (addr, expected, actual)
+    Generates 2D histograms of bit errors
+    Use `weight_by_error` to display net bit error (+1 for 1 and -1 for 0)
+
+    '''
+    draw_bit_error_map(plt.figure(label), fault_list, weight_by_error)
     if show:
         plt.show()
 
+def draw_test_scan(fig, faults, desc, xlabel=''):
+    '''
+    Draws the plot of `plot_test_scan` on a matplotlib `Figure`
+    '''
+    x = sorted(faults.keys())
+    bit_errors = []
+    byte_errors = []
+    for value in x:
+        test_results = faults[value]
+        bit_errors += [count_bit_errors(test_results[desc])]
+        byte_errors += [len(test_results[desc])]
+
+    ax = fig.add_subplot(1,1,1)
+    ax.plot(x, byte_errors, '.-', label='Byte errors')
+    ax.plot(x, bit_errors, '.-', label='Bit errors')
+    ax.legend()
+    ax.set_ylabel('Count')
+    ax.set_xlabel(xlabel)
+
 def plot_test_scan(faults, desc, label='Test scan', xlabel='', show=True):
     '''
     Generates a plot of bit/byte errors from a test scan
@@ -130,20 +233,103 @@ def plot_test_scan(faults, desc, label='Test scan', xlabel='', show=True):
       ...
     }
     '''
-    x = sorted(faults.keys())
-    bit_errors = []
-    byte_errors = []
-    for value in x:
-        test_results = faults[value]
-        bit_errors += [len(collect_bit_errors(test_results[desc]))]
-        byte_errors += [len(test_results[desc])]
+    draw_test_scan(plt.figure(label), faults, desc, xlabel)
+    if show:
+        plt.show()
 
-    plt.figure(label)
-    plt.plot(x, byte_errors, '.-', label='Byte errors')
-    plt.plot(x, bit_errors, '.-', label='Bit errors')
-    plt.legend()
-    plt.ylabel('Count')
-    plt.xlabel(xlabel)
+def draw_shmoo(fig, shmoo, rate='byte_error_rate'):
+    '''
+    Draws the plot of `plot_shmoo` on a matplotlib `Figure`
+    '''
+    ax = fig.add_subplot(1,1,1)
+    clk_factors, delay_factors = shmoo['clk_factors'], shmoo['delay_factors']
+    image = ax.imshow(np.ma.masked_invalid(shmoo[rate]).T, origin='lower', aspect='auto', interpolation='nearest',
+                      extent=(-0.5, len(clk_factors)-0.5, -0.5, len(delay_factors)-0.5))
+    fig.colorbar(image, ax=ax, label=rate.replace('_', ' '))
+    ax.contour(np.arange(len(clk_factors)), np.arange(len(delay_factors)), shmoo['passed'].T, levels=[0.5],
+               colors='r')
+    ax.set_xticks(np.arange(len(clk_factors)))
+    ax.set_xticklabels(clk_factors)
+    ax.set_yticks(np.arange(len(delay_factors)))
+    ax.set_yticklabels(delay_factors)
+    ax.set_xlabel('clk factor')
+    ax.set_ylabel('delay factor')
 
+def plot_shmoo(shmoo, rate='byte_error_rate', label='Shmoo', show=True):
+    '''
+    Generates a map of the error rate (`byte_error_rate` or `bit_error_rate`)
+    at each point of a shmoo from `run_shmoo`, with the pass/fail boundary
+    Untested points are left blank
+    '''
+    draw_shmoo(plt.figure(label), shmoo, rate)
     if show:
         plt.show()
+
+draw_functions = {
+    'bit_map' : draw_bit_map,
+    'bit_error_map' : draw_bit_error_map,
+    'test_scan' : draw_test_scan,
+    'shmoo' : draw_shmoo
+}
+
+def render_figure(kind, args, label):
+    '''
+    Returns a new `Figure` (not managed by pyplot) drawn by
+    `draw_functions[kind](fig, *args)` and titled `label`
+    '''
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    draw_functions[kind](fig, *args)
+    fig.suptitle(label, fontsize='small')
+    return fig
+
+def render_file(filename, figures):
+    '''
+    Saves a list of figures (kind, args, label) to `filename`, as pages of
+    one pdf if there are several
+    Returns `filename`
+    '''
+    if len(figures) == 1:
+        render_figure(*figures[0]).savefig(filename)
+        return filename
+    with PdfPages(filename) as pdf:
+        for figure in figures:
+            pdf.savefig(render_figure(*figure))
+    return filename
+
+def plot_hash(figures):
+    '''
+    Hash of the inputs of a list of figures (kind, args, label)
+    '''
+    return hashlib.sha1(pickle.dumps(figures, protocol=2)).hexdigest()
+
+def render_plots(jobs, cache_file=None, processes=None):
+    '''
+    Renders plot files headless (without pyplot)
+    `jobs` is a list of (filename, [(kind, args, label), ...]), see
+      `render_file`
+    Files are rendered in a pool of `processes` processes (defaults to the
+      number of cpus, 0 renders in this process)
+    If `cache_file` is given, it stores a hash of the inputs of each file and
+      files that exist with unchanged inputs are skipped
+    returns list of rendered filenames
+    '''
+    cache = {}
+    if cache_file is not None and os.path.exists(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+    hashes = dict([(filename, plot_hash(figures)) for filename, figures in jobs])
+    jobs = [(filename, figures) for filename, figures in jobs
+            if cache.get(filename) != hashes[filename] or not os.path.exists(filename)]
+
+    if processes == 0 or len(jobs) < 2:
+        rendered = [render_file(filename, figures) for filename, figures in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            rendered = list(executor.map(render_file, *zip(*jobs)))
+
+    if cache_file is not None:
+        cache.update([(filename, hashes[filename]) for filename in rendered])
+        with open(cache_file, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+    return rendered
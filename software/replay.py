@@ -0,0 +1,679 @@
+#!/usr/bin/env python
+'''
+Offline replay of `CryoLogger` captures (.csv.gz or binary .cap)
+Rebuilds the shadow memory and the faults of a run from the raw frames
+Run with e.g.:
+  r = Replay(segment_names=['mats_test']*3 + ['pattern_test']*3)
+  faults, bitmaps = r.replay('data/2021_01_01_00_00_00.cap')
+or:
+  ./replay.py <capture file> [<capture file> ...]
+'''
+import sys
+import time
+import gzip
+import numpy as np
+import capture
+from cryoCMOS import FrameCodec, ShadowMemory
+from march import decode_march, march_results, march_end_addr
+from bitcounts import BitCounts
+
+def iter_csv_calls(filename, chunk_bytes=1<<22):
+    '''
+    Generator of (directions, lengths, data) arrays of the read/write calls
+    in a .csv.gz capture, reading about `chunk_bytes` of text at a time
+    '''
+    with gzip.open(filename, 'rt') as f:
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if not len(lines):
+                return
+            rows = [line.split(', ', 2) for line in lines]
+            rows = [row for row in rows if len(row) == 3]
+            bits = [row[2].strip() for row in rows]
+            directions = np.array([row[1] == 'RX' for row in rows], dtype=np.uint8)
+            lengths = np.array([len(call_bits)//8 for call_bits in bits], dtype=np.int64)
+            data = np.packbits(np.frombuffer(''.join(bits).encode(), dtype=np.uint8) - ord('0'))
+            yield directions, lengths, data
+
+def iter_cap_calls(filename):
+    '''
+    Generator of (directions, lengths, data) arrays of the read/write calls
+    in a binary capture (one per chunk, see `capture.iter_capture`)
+    Consecutive records with the same time and direction are one call
+    '''
+    for records in capture.iter_capture(filename):
+        if not len(records):
+            continue
+        new_call = np.ones(len(records), dtype=bool)
+        new_call[1:] = ((records['time'][1:] != records['time'][:-1])
+                        | (records['direction'][1:] != records['direction'][:-1]))
+        call_idxs = np.cumsum(new_call) - 1
+        lengths = np.bincount(call_idxs, weights=records['n_bytes']).astype(np.int64)
+        valid = np.ones((len(records), 2), dtype=bool)
+        valid[:,1] = records['n_bytes'] == 2
+        yield records['direction'][new_call], lengths, records['data'].reshape(-1)[valid.reshape(-1)]
+
+def iter_calls(filename):
+    '''
+    Generator of call arrays of either capture format
+    '''
+    if filename.endswith('.csv.gz'):
+        return iter_csv_calls(filename)
+    return iter_cap_calls(filename)
+
+def optional(values):
+    '''
+    Returns a list of ints from an array, None where negative (unknown)
+    '''
+    values = np.asarray(values)
+    if not np.any(values < 0):
+        return values.tolist()
+    objects = values.astype(object)
+    objects[values < 0] = None
+    return objects.tolist()
+
+class Replay :
+    '''
+    Decodes the frames of a capture and rebuilds the faults the live tests
+    would have found, in the same structure as `run_test_suite`:
+      faults[test][clk_factor][stage] - list of (addr, expected, read)
+      bitmaps[test][clk_factor][stage] - `BitCounts` of the reads
+    Captures are read in chunks of calls and each chunk is decoded with numpy,
+    so memory use does not grow with the length of the capture. This decodes
+    about 6e5 frames/s (`./benchmark.py replay`), not millions: the frames
+    are found by scanning the whole TX stream, about 6.5 bytes per frame as
+    most of it is NOP padding, and each read then takes a few sorted passes
+    to find its expected value and stage
+
+    The responses of a write are the bytes read before the next write (as
+    sent by `CryoSRAM`, including batches). Captures of pipelined requests
+    (`AsyncCryoSRAM`) are not supported
+
+    The expected value of a read is the shadow memory, i.e. the last value
+    written to or read from the address (as `CryoSRAM` tracks it). Reads of
+    unknown values are not faults. Test names are not in the capture, so each
+    SET_CLK starts a new segment (test 'segment <n>', or `segment_names[n]`,
+    counting from 0 at the first SET_CLK; reads before it are in test
+    'setup'). Stages are not in the capture either: the k-th read of an
+    address in a segment (or the k-th read op of an fpga march) is in stage
+    `stage_names[test][k]` (see `test_stages`), or 'pass <k>' (the march's
+    own stage name, see `decode_march`) for tests without stage names
+    '''
+    TX = capture.TX
+    RX = capture.RX
+    two_byte_messages = (FrameCodec.SET_ADDR, FrameCodec.WRITE_VAL, FrameCodec.SET_CLK, FrameCodec.SET_DELAY,
+                         FrameCodec.WRITE_BLOCK, FrameCodec.READ_BLOCK, FrameCodec.MARCH, FrameCodec.SET_BAUD)
+    # stage of the k-th read of each address in the standard tests (with
+    # their default arguments), the last name repeats and None is a read the
+    # test does not verify (the read back before `rand_test`)
+    test_stages = {
+        'mats_test': ['-> 0', '0 -> 1', '1 -> 0'],
+        'pattern_test': ['pattern'],
+        'single_bit_test': ['-> 0'] + [format(value, '08b') for value in [1, 2, 4, 8, 16, 32, 64, 128, 0]],
+        'rand_test': [None, 'rand_static', 'rand_static', 'rand_dynamic'],
+    }
+
+    def __init__(self, n_addr=512, clk_factor=25, segment_names=None, bitmaps=True, stage_names=None):
+        '''
+        `clk_factor` is the clock before the first SET_CLK (the fpga default)
+        `segment_names` names the tests of each segment
+        `bitmaps` counts the bits of every read (set False to only collect
+        faults)
+        `stage_names` is a dict of test : stage names by read (defaults to
+        `test_stages`)
+        '''
+        self.n_addr = n_addr
+        self.clk_factor = clk_factor
+        self.delay_factor = None
+        self.segment_names = segment_names
+        self.stage_names = self.test_stages if stage_names is None else stage_names
+        self.keep_bitmaps = bitmaps
+        self.two_byte = np.zeros(16, dtype=bool)
+        self.two_byte[list(self.two_byte_messages)] = True
+
+        self.memory = ShadowMemory(n_addr)
+        self.addr = 0
+        self.segment = -1 # before the first SET_CLK
+        self.count_segment = -1
+        self.counts = np.zeros(n_addr, dtype=np.int64) # reads of each address in count_segment
+        self.carry = None # calls of the last (possibly incomplete) request
+        self.faults = {}
+        self.bitmaps = {}
+        self.stats = dict(frames=0, reads=0, writes=0, marches=0, missing_bytes=0, extra_bytes=0, stray_bytes=0)
+
+    def test_name(self, segment):
+        if segment < 0:
+            return 'setup'
+        if self.segment_names is not None and segment < len(self.segment_names):
+            return self.segment_names[segment]
+        return 'segment {}'.format(segment)
+
+    def stage_name(self, test, k, default):
+        '''
+        Returns the stage of the k-th read of `test` (None if it is not
+        collected), or `default` if the test has no stage names
+        '''
+        names = self.stage_names.get(test)
+        if not names:
+            return default
+        return names[min(k, len(names) - 1)]
+
+    def replay(self, filename, chunk_bytes=1<<22):
+        '''
+        Replays a capture file
+        Chunks of the capture are joined up to about `chunk_bytes` before
+        decoding, since each chunk has a fixed numpy cost (binary captures
+        have a chunk per logger flush)
+        returns faults and bitmaps (see class), replay stats are in `stats`
+        '''
+        start = time.time()
+        chunks, n_bytes = [], 0
+        for chunk in iter_calls(filename):
+            chunks += [chunk]
+            n_bytes += len(chunk[2])
+            if n_bytes >= chunk_bytes:
+                self.feed(*[np.concatenate(arrays) for arrays in zip(*chunks)])
+                chunks, n_bytes = [], 0
+        if len(chunks):
+            self.feed(*[np.concatenate(arrays) for arrays in zip(*chunks)])
+        self.feed([], [], [], final=True)
+        self.stats['seconds'] = time.time() - start
+        return self.faults, self.bitmaps
+
+    def feed(self, directions, lengths, data, final=False):
+        '''
+        Decodes a chunk of calls: arrays of the direction (TX/RX) and number
+        of bytes of each call and their concatenated bytes
+        The last request is held until the next chunk (or `final`), since
+        more of its responses may follow
+        '''
+        directions = np.asarray(directions, dtype=np.uint8)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        data = np.asarray(data, dtype=np.uint8)
+        if self.carry is not None:
+            directions, lengths, data = [np.concatenate(pair) for pair in zip(self.carry, (directions, lengths, data))]
+            self.carry = None
+        offsets = np.cumsum(lengths) - lengths
+
+        tx_calls = np.flatnonzero(directions == self.TX)
+        if not len(tx_calls):
+            self.stats['stray_bytes'] += len(data)
+            return
+        if tx_calls[0]:
+            # responses without a request
+            self.stats['stray_bytes'] += int(offsets[tx_calls[0]])
+        first, last = tx_calls[0], len(directions)
+        if not final:
+            last = tx_calls[-1]
+            self.carry = (directions[last:], lengths[last:], data[offsets[last]:])
+            tx_calls = tx_calls[:-1]
+            if not len(tx_calls):
+                return
+        directions, lengths = directions[first:last], lengths[first:last]
+        data = data[offsets[first]:offsets[last] if last < len(offsets) else len(data)]
+        self._decode(directions, lengths, data, len(tx_calls))
+
+    def _decode(self, directions, lengths, data, n_requests):
+        '''
+        Decodes complete requests (each a TX call followed by its RX calls)
+        '''
+        tx, rx, tx_requests, tx_end, rx_start, rx_end = self._split_calls(directions, lengths, data, n_requests)
+        tokens, opcodes, messages, payload_lens, payload_ends = self._frames(tx, tx_requests, tx_end)
+        token_requests = tx_requests[tokens]
+        response_offsets, marches = self._match_responses(tx, rx, tokens, opcodes, messages, payload_ends,
+                                                          token_requests, rx_start, rx_end, n_requests)
+        addr_before, clks, segments = self._registers(opcodes, messages, payload_lens, marches)
+        event_tokens, addrs, values, is_read = self._memory_events(tx, rx, tokens, opcodes, messages, payload_lens,
+                                                                   addr_before, response_offsets,
+                                                                   rx_end[token_requests])
+
+        # apply the events up to each march, then the march
+        piece_start = 0
+        for token, program, records in marches:
+            bound = np.searchsorted(event_tokens, token)
+            piece = event_tokens[piece_start:bound]
+            self._apply(addrs[piece_start:bound], values[piece_start:bound], is_read[piece_start:bound],
+                        token_requests[piece], segments[piece], clks[piece])
+            self._march(program, records, int(segments[token]), int(clks[token]))
+            piece_start = bound
+        piece = event_tokens[piece_start:]
+        self._apply(addrs[piece_start:], values[piece_start:], is_read[piece_start:],
+                    token_requests[piece], segments[piece], clks[piece])
+
+    def _split_calls(self, directions, lengths, data, n_requests):
+        '''
+        Splits the bytes of the calls into TX and RX bytes
+        returns the TX and RX bytes, the request of each TX byte and the end
+        of its call in the TX bytes, and the start and end of the responses
+        of each request in the RX bytes
+        '''
+        byte_tx = np.repeat(directions == self.TX, lengths)
+        tx, rx = data[byte_tx], data[~byte_tx]
+        call_requests = np.cumsum(directions == self.TX) - 1
+        is_tx = directions == self.TX
+        tx_requests = np.repeat(call_requests[is_tx], lengths[is_tx])
+        rx_requests = np.repeat(call_requests[~is_tx], lengths[~is_tx])
+        requests = np.arange(n_requests)
+        tx_end = np.searchsorted(tx_requests, requests, 'right')[tx_requests]
+        rx_start = np.searchsorted(rx_requests, requests, 'left')
+        rx_end = np.searchsorted(rx_requests, requests, 'right')
+        return tx, rx, tx_requests, tx_end, rx_start, rx_end
+
+    def _frames(self, tx, tx_requests, tx_end):
+        '''
+        Finds the frames in the TX bytes (see `_parse`)
+        returns arrays of the offset, opcode, message and payload length and
+        end (WRITE_BLOCK and MARCH) of each frame
+        '''
+        tokens, payload_ends = self._parse(tx, tx_requests, tx_end)
+        opcodes = (tx[tokens] >> 4).astype(np.int64)
+        two = self.two_byte[opcodes]
+        messages = np.zeros(len(tokens), dtype=np.int64)
+        messages[two] = ((tx[tokens[two]].astype(np.int64) & 0xf) << 8) | tx[tokens[two]+1]
+        has_payload = (opcodes == FrameCodec.WRITE_BLOCK) | (opcodes == FrameCodec.MARCH)
+        payload_lens = np.zeros(len(tokens), dtype=np.int64)
+        payload_lens[has_payload] = payload_ends[has_payload] - tokens[has_payload] - 2
+        self.stats['frames'] += len(tokens)
+        return tokens, opcodes, messages, payload_lens, payload_ends
+
+    def _match_responses(self, tx, rx, tokens, opcodes, messages, payload_ends, token_requests, rx_start, rx_end,
+                         n_requests):
+        '''
+        Matches the frames of each request to its responses, counting the
+        missing and extra response bytes
+        The length of a march response is only known from its end record, so
+        marches are read in order, after the responses of the frames before
+        them
+        returns the offset of each frame's response in the RX bytes, and the
+        (frame, program, fault records) of each march
+        '''
+        response_lens = np.zeros(len(tokens), dtype=np.int64)
+        response_lens[np.isin(opcodes, (FrameCodec.READ_ADDR, FrameCodec.READ_VAL, FrameCodec.READ_CLK))] = 2
+        is_read_block = opcodes == FrameCodec.READ_BLOCK
+        response_lens[is_read_block] = messages[is_read_block]
+        marches = []
+        for token in np.flatnonzero(opcodes == FrameCodec.MARCH).tolist():
+            request = token_requests[token]
+            request_first = np.searchsorted(token_requests, request, 'left')
+            offset = rx_start[request] + int(np.sum(response_lens[request_first:token]))
+            records, response_lens[token] = self._march_records(rx[offset:rx_end[request]])
+            marches += [(token, tx[tokens[token]+2:payload_ends[token]], records)]
+        response_offsets = self._response_offsets(response_lens, token_requests, rx_start, n_requests)
+        consumed = rx_start + np.bincount(token_requests, weights=response_lens, minlength=n_requests).astype(np.int64)
+        self.stats['missing_bytes'] += int(np.sum(np.maximum(consumed - rx_end, 0)))
+        self.stats['extra_bytes'] += int(np.sum(np.maximum(rx_end - consumed, 0)))
+        return response_offsets, marches
+
+    def _registers(self, opcodes, messages, payload_lens, marches):
+        '''
+        Follows the fpga registers through the frames, from their values at
+        the end of the last chunk
+        returns arrays of the address before each frame, and the clk factor
+        and segment of each frame
+        '''
+        # blocks move the address on by their length, and marches leave it
+        # at the end of their last element
+        is_march = opcodes == FrameCodec.MARCH
+        march_ends = np.zeros(len(opcodes), dtype=np.int64)
+        for token, program, records in marches:
+            try:
+                end_addr = march_end_addr(decode_march(program), self.n_addr)
+            except ValueError:
+                end_addr = None
+            march_ends[token] = self.addr if end_addr is None else end_addr
+        addr_anchors = (opcodes == FrameCodec.SET_ADDR) | is_march
+        anchor_values = np.where(is_march, march_ends, messages % self.n_addr)
+        increments = np.where(opcodes == FrameCodec.READ_BLOCK, messages, 0) + \
+            np.where(opcodes == FrameCodec.WRITE_BLOCK, payload_lens, 0)
+        addr_after = self._forward_fill(addr_anchors, anchor_values, self.addr, increments) % self.n_addr
+        addr_before = np.concatenate([[self.addr], addr_after[:-1]]).astype(np.int64)
+
+        # each SET_CLK starts a segment
+        clk_set = opcodes == FrameCodec.SET_CLK
+        clks = self._forward_fill(clk_set, messages & 0xff, self.clk_factor)
+        segments = self.segment + np.cumsum(clk_set)
+        delay_set = np.flatnonzero(opcodes == FrameCodec.SET_DELAY)
+        if len(opcodes):
+            self.addr = int(addr_after[-1])
+            self.clk_factor = int(clks[-1])
+            self.segment = int(segments[-1])
+        if len(delay_set):
+            self.delay_factor = int(messages[delay_set[-1]] & 0xff)
+        return addr_before, clks, segments
+
+    def _memory_events(self, tx, rx, tokens, opcodes, messages, payload_lens, addr_before, response_offsets,
+                       response_ends):
+        '''
+        Lists the memory writes and reads of the frames
+        `response_ends` is the end of the responses of each frame's request
+        returns arrays of the frame, address, value (-1 if not received) and
+        whether it is a read of each event, in order
+        '''
+        # (frame, index within the frame, addr, value, is read) of each kind
+        events = []
+        writes = np.flatnonzero(opcodes == FrameCodec.WRITE_VAL)
+        events += [(writes, np.zeros(len(writes), dtype=np.int64), addr_before[writes], messages[writes] & 0xff,
+                    np.zeros(len(writes), dtype=bool))]
+        block_tokens, block_idxs = self._expand(np.flatnonzero(opcodes == FrameCodec.WRITE_BLOCK), payload_lens)
+        events += [(block_tokens, block_idxs, (addr_before[block_tokens] + block_idxs) % self.n_addr,
+                    tx[tokens[block_tokens] + 2 + block_idxs].astype(np.int64), np.zeros(len(block_tokens), dtype=bool))]
+        reads = np.flatnonzero(opcodes == FrameCodec.READ_VAL)
+        events += [(reads, np.zeros(len(reads), dtype=np.int64), addr_before[reads],
+                    self._responses(rx, response_offsets[reads] + 1, response_ends[reads]),
+                    np.ones(len(reads), dtype=bool))]
+        block_tokens, block_idxs = self._expand(np.flatnonzero(opcodes == FrameCodec.READ_BLOCK), messages)
+        events += [(block_tokens, block_idxs, (addr_before[block_tokens] + block_idxs) % self.n_addr,
+                    self._responses(rx, response_offsets[block_tokens] + block_idxs, response_ends[block_tokens]),
+                    np.ones(len(block_tokens), dtype=bool))]
+
+        # each kind is in order and a frame has events of one kind
+        event_tokens, event_idxs, addrs, values, is_read = [np.concatenate(column) for column in zip(*events)]
+        order = np.argsort(event_tokens, kind='stable')
+        self.stats['reads'] += int(np.sum(is_read))
+        self.stats['writes'] += int(np.sum(~is_read))
+        return event_tokens[order], addrs[order], values[order], is_read[order]
+
+    def _parse(self, tx, tx_requests, tx_end):
+        '''
+        Finds the first byte of each frame in the TX bytes
+        A byte with a two-byte opcode starts a frame unless it is the second
+        byte of one, so frames alternate within runs of such bytes. Block and
+        march payloads are skipped, re-aligning the frames after them
+        returns the frame offsets and the end of each frame's payload
+        '''
+        n = len(tx)
+        opcodes = tx >> 4
+        two = self.two_byte[opcodes]
+        anchor = np.ones(n, dtype=bool)
+        anchor[1:] = (tx_requests[1:] != tx_requests[:-1]) | ~two[:-1]
+        idxs = np.arange(n)
+        anchor_idxs = np.maximum.accumulate(np.where(anchor, idxs, 0)) if n else idxs
+
+        # a payload opcode starts a frame if it is aligned with the last
+        # anchor or payload end before it, and is not inside a payload
+        candidates = np.flatnonzero((opcodes == FrameCodec.WRITE_BLOCK) | (opcodes == FrameCodec.MARCH))
+        lengths = np.zeros(len(candidates), dtype=np.int64)
+        complete = candidates + 1 < tx_end[candidates]
+        lengths[complete] = ((tx[candidates[complete]].astype(np.int64) & 0xf) << 8) | tx[candidates[complete]+1]
+        ends = np.minimum(candidates + 2 + lengths, tx_end[candidates])
+        payload_starts, payload_ends = self._payloads(candidates, anchor_idxs[candidates], ends, complete)
+        if len(payload_starts):
+            realigned = np.full(n, -1, dtype=np.int64)
+            realigned[payload_ends[payload_ends < n]] = payload_ends[payload_ends < n]
+            origins = np.maximum(anchor_idxs, np.maximum.accumulate(realigned))
+            inside = np.zeros(n + 1, dtype=np.int64)
+            np.add.at(inside, payload_starts + 2, 1)
+            np.add.at(inside, payload_ends, -1)
+            start = ((idxs - origins) & 1 == 0) & (np.cumsum(inside[:-1]) <= 0)
+        else:
+            start = (idxs - anchor_idxs) & 1 == 0
+
+        # drop NOPs and truncated frames
+        tokens = np.flatnonzero(start & (opcodes > 0) & (opcodes <= FrameCodec.SET_BAUD))
+        tokens = tokens[~two[tokens] | (tokens + 1 < tx_end[tokens])]
+        token_payload_ends = np.zeros(len(tokens), dtype=np.int64)
+        token_payload_ends[np.searchsorted(tokens, payload_starts)] = payload_ends
+        return tokens, token_payload_ends
+
+    @staticmethod
+    def _payloads(candidates, anchors, ends, complete, max_iterations=16):
+        '''
+        Selects the payload opcodes that start frames, in order: a candidate
+        is accepted if it is complete, not inside the last accepted payload
+        and aligned with the later of its anchor and that payload's end
+        Each candidate only depends on those accepted before it, so the
+        accepted set is the unique fixed point of applying this rule to all
+        candidates at once (usually reached in a few passes; the sequential
+        rule is used if not)
+        returns the starts and ends of the accepted payloads
+        '''
+        accepted = complete.copy()
+        for i in range(max_iterations):
+            # end of the last accepted payload before each candidate
+            last_end = np.where(accepted, ends, 0)
+            pos = np.zeros(len(candidates), dtype=np.int64)
+            if len(candidates):
+                pos[1:] = np.maximum.accumulate(last_end)[:-1]
+            valid = complete & (candidates >= pos) & ((candidates - np.maximum(anchors, pos)) % 2 == 0)
+            if np.array_equal(valid, accepted):
+                return candidates[accepted], ends[accepted]
+            accepted = valid
+        payload_starts, payload_ends = [], []
+        pos = 0
+        for c, a, end, ok in zip(candidates.tolist(), anchors.tolist(), ends.tolist(), complete.tolist()):
+            if c < pos or (c - max(a, pos)) % 2 or not ok:
+                continue
+            payload_starts += [c]
+            payload_ends += [end]
+            pos = end
+        return np.array(payload_starts, dtype=np.int64), np.array(payload_ends, dtype=np.int64)
+
+    @staticmethod
+    def _forward_fill(is_set, set_values, initial, increments=None):
+        '''
+        Returns the value of a register after each token, set by tokens
+        `is_set` (and incremented by `increments`)
+        '''
+        idxs = np.arange(len(is_set))
+        last_set = np.maximum.accumulate(np.where(is_set, idxs, -1)) if len(idxs) else idxs
+        values = np.where(last_set >= 0, set_values[np.maximum(last_set, 0)], initial)
+        if increments is not None:
+            total = np.cumsum(increments)
+            values = values + total - np.where(last_set >= 0, total[np.maximum(last_set, 0)], 0)
+        return values.astype(np.int64)
+
+    @staticmethod
+    def _response_offsets(response_lens, token_requests, rx_start, n_requests):
+        '''
+        Returns the offset of each token's response in the RX bytes
+        '''
+        ends = np.cumsum(response_lens)
+        starts = ends - response_lens
+        first_tokens = np.searchsorted(token_requests, np.arange(n_requests), 'left')
+        request_base = np.concatenate([starts, [ends[-1] if len(ends) else 0]])[first_tokens]
+        return rx_start[token_requests] + starts - request_base[token_requests]
+
+    @staticmethod
+    def _march_records(rx):
+        '''
+        Returns the 4-byte fault records of a march response and its length
+        '''
+        records = rx[:len(rx)//4*4].reshape(-1,4)
+        end = np.flatnonzero(records[:,2] & 0x80)
+        if not len(end):
+            return records, len(records)*4 + 4 # missing end record
+        return records[:end[0]], (end[0] + 1)*4
+
+    @staticmethod
+    def _expand(tokens, counts):
+        '''
+        Returns (token, index) for each value of multi-value tokens
+        '''
+        counts = counts[tokens]
+        expanded = np.repeat(tokens, counts)
+        idxs = np.arange(len(expanded)) - np.repeat(np.cumsum(counts) - counts, counts)
+        return expanded, idxs
+
+    @staticmethod
+    def _responses(rx, offsets, ends):
+        '''
+        Returns the response bytes at `offsets` (-1 if not received)
+        '''
+        received = offsets < ends
+        values = np.full(len(offsets), -1, dtype=np.int64)
+        values[received] = rx[offsets[received]]
+        return values
+
+    def _memory_values(self):
+        return np.where(self.memory.valid(), self.memory.values.astype(np.int64), -1)
+
+    def _addr_order(self, addrs):
+        '''
+        Returns the indices that sort `addrs`, keeping the order of events at
+        the same address (a radix sort of 16-bit addresses)
+        '''
+        return np.argsort(addrs.astype(np.uint16) if self.n_addr <= 1<<16 else addrs, kind='stable')
+
+    def _apply(self, addrs, values, is_read, requests, segments, clks):
+        '''
+        Applies memory events in order to the shadow memory, collecting
+        the faults of the reads
+        As in `CryoSRAM`, a read expects the last value written to its
+        address, and read values only update the memory once the responses
+        to their request are received
+        '''
+        if not len(addrs):
+            return
+        # events are in request order, so this groups them by address then request
+        order = self._addr_order(addrs)
+        sorted_addrs, sorted_values, sorted_requests = addrs[order], values[order], requests[order]
+        idxs = np.arange(len(order))
+        addr_first = np.ones(len(order), dtype=bool)
+        addr_first[1:] = sorted_addrs[1:] != sorted_addrs[:-1]
+        request_first = addr_first.copy()
+        request_first[1:] |= sorted_requests[1:] != sorted_requests[:-1]
+        request_starts = np.maximum.accumulate(np.where(request_first, idxs, 0))
+
+        # memory at the start of each request is the last value of the previous one
+        start_values = np.empty(len(order), dtype=np.int64)
+        start_values[1:] = sorted_values[:-1]
+        start_values[addr_first] = self._memory_values()[sorted_addrs[addr_first]]
+        last_writes = np.maximum.accumulate(np.where(is_read[order], -1, idxs))
+        written = last_writes >= request_starts
+        expected = np.empty(len(order), dtype=np.int64)
+        expected[order] = np.where(written, sorted_values[np.maximum(last_writes, 0)], start_values[request_starts])
+        addr_last = np.ones(len(order), dtype=bool)
+        addr_last[:-1] = addr_first[1:]
+        self.memory.values[sorted_addrs[addr_last]] = np.maximum(sorted_values[addr_last], 0)
+        self.memory.known[sorted_addrs[addr_last]] = np.where(sorted_values[addr_last] >= 0, 0xff, 0)
+
+        # the reads, and their order by address
+        read_order = (np.cumsum(is_read) - 1)[order[is_read[order]]]
+        addrs, reads, expected = addrs[is_read], values[is_read], expected[is_read]
+        segments, clks = segments[is_read], clks[is_read]
+        if not len(addrs):
+            return
+        passes = self._passes(addrs, segments, read_order)
+        self._collect(addrs, reads, expected, segments, clks, passes)
+
+    def _passes(self, addrs, segments, addr_order):
+        '''
+        Returns the pass of each read: the number of reads of its address
+        before it in its segment (counting those of earlier chunks)
+        `addr_order` sorts the reads by address, keeping their order
+        '''
+        # segments only increase, so each address is sorted by segment
+        sorted_addrs, sorted_segments = addrs[addr_order], segments[addr_order]
+        group_first = np.ones(len(addr_order), dtype=bool)
+        group_first[1:] = (sorted_addrs[1:] != sorted_addrs[:-1]) | (sorted_segments[1:] != sorted_segments[:-1])
+        group_starts = np.maximum.accumulate(np.where(group_first, np.arange(len(addr_order)), 0))
+        passes = np.empty(len(addr_order), dtype=np.int64)
+        passes[addr_order] = np.arange(len(addr_order)) - group_starts
+
+        carried = segments == self.count_segment
+        passes[carried] += self.counts[addrs[carried]]
+        if segments[-1] != self.count_segment:
+            self.count_segment = int(segments[-1])
+            self.counts[:] = 0
+        current = segments == self.count_segment
+        self.counts += np.bincount(addrs[current], minlength=self.n_addr)
+        return passes
+
+    def _collect(self, addrs, reads, expected, segments, clks, passes):
+        '''
+        Adds reads to the faults and bitmaps of their stages (by test and
+        pass, see `stage_name`)
+        '''
+        # passes after the last stage name of a test are in that stage
+        stage_idxs = passes.copy()
+        bounds = np.concatenate([[0], np.flatnonzero(segments[1:] != segments[:-1]) + 1, [len(segments)]])
+        for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            names = self.stage_names.get(self.test_name(int(segments[start])))
+            if names:
+                stage_idxs[start:end] = np.minimum(stage_idxs[start:end], len(names) - 1)
+
+        # reads grouped by segment (so clk factor) and stage, in order
+        is_fault = (expected >= 0) & (reads != expected)
+        keys = (segments - segments[0])*(int(stage_idxs.max()) + 1) + stage_idxs
+        order = np.argsort(keys, kind='stable')
+        group_bounds = np.flatnonzero(keys[order][1:] != keys[order][:-1]) + 1
+        for group in np.split(order, group_bounds):
+            segment, clk, stage_idx = int(segments[group[0]]), int(clks[group[0]]), int(stage_idxs[group[0]])
+            test = self.test_name(segment)
+            stage = self.stage_name(test, stage_idx, 'pass {}'.format(stage_idx))
+            if stage is None:
+                continue
+            faults, bitmaps = self._stage(test, clk, stage)
+            fault_idxs = group[is_fault[group]]
+            faults += list(zip(addrs[fault_idxs].tolist(), expected[fault_idxs].tolist(),
+                               optional(reads[fault_idxs])))
+            if bitmaps is not None:
+                bitmaps.add(addrs[group], reads[group], expected[group])
+
+    def _stage(self, test, clk, stage):
+        '''
+        Returns the faults list and bitmaps `BitCounts` of a stage (None if
+        bitmaps are not kept)
+        '''
+        faults = self.faults.setdefault(test, {}).setdefault(clk, {}).setdefault(stage, [])
+        if not self.keep_bitmaps:
+            return faults, None
+        stage_bitmaps = self.bitmaps.setdefault(test, {}).setdefault(clk, {})
+        if stage not in stage_bitmaps:
+            stage_bitmaps[stage] = BitCounts(self.n_addr)
+        return faults, stage_bitmaps[stage]
+
+    def _march(self, program, records, segment, clk):
+        '''
+        Collects the faults of a march run by the fpga (see `march_results`)
+        The k-th read op of the march is in the k-th stage of the test
+        '''
+        self.stats['marches'] += 1
+        try:
+            march = decode_march(program)
+        except ValueError:
+            self.memory.invalidate()
+            return
+        stages = [op[2] for direction, ops in march for op in ops if op[0] == 'r']
+        faults = dict([(stage, []) for stage in stages])
+        bitmaps = dict([(stage, BitCounts(self.n_addr)) for stage in stages]) if self.keep_bitmaps else {}
+        values, invalid = march_results(march, records, self.n_addr, faults, bitmaps)
+        test = self.test_name(segment)
+        for k, stage in enumerate(faults.keys()):
+            name = self.stage_name(test, k, stage)
+            if name is None:
+                continue
+            stage_faults, stage_bitmaps = self._stage(test, clk, name)
+            stage_faults += faults[stage]
+            if stage_bitmaps is not None:
+                stage_bitmaps += bitmaps[stage]
+        if values is not None:
+            self.memory.write_block(np.arange(self.n_addr), values)
+
+def replay_summary(faults, bitmaps):
+    '''
+    Prints the reads and faults of each replayed test stage
+    '''
+    print('test\tclk\tstage\treads\tfaults')
+    for test in faults.keys():
+        for clk in faults[test].keys():
+            for stage, fault_list in faults[test][clk].items():
+                n_reads = len(bitmaps.get(test, {}).get(clk, {}).get(stage, []))
+                print('{}\t{}\t{}\t{}\t{}'.format(test, clk, stage, n_reads, len(fault_list)))
+
+def main(args):
+    if len(args) < 2:
+        print('Usage: ./replay.py <capture file> [<capture file> ...]')
+        return
+    for filename in args[1:]:
+        r = Replay()
+        faults, bitmaps = r.replay(filename)
+        print(filename)
+        replay_summary(faults, bitmaps)
+        print('{} frames in {:.2f}s ({:.3g} frames/s), {}'.format(
+            r.stats['frames'], r.stats['seconds'], r.stats['frames']/max(r.stats['seconds'], 1e-9),
+            ', '.join(['{} {}'.format(key, value) for key, value in r.stats.items()
+                       if key not in ('frames', 'seconds')])))
+
+if __name__ == '__main__':
+    main(sys.argv)
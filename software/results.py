@@ -0,0 +1,201 @@
+'''
+Persistent store of test results across runs (an sqlite database)
+Run with e.g.:
+  store = ResultStore('data/results.sqlite')
+  store.add_run(faults, bitmaps, chip='chip A', board='ttyUSB1', delay_factor=4)
+  faults = store.faults(addr=0x10, last=50) # numpy structured array
+'''
+import os
+import time
+import sqlite3
+import numpy as np
+
+class ResultStore :
+    '''
+    Stores the results of `run_test_suite` (faults[test][clk_factor][stage])
+    in an sqlite database with tables of :
+      runs - run_id, time, chip, board, directory
+      stages - reads and faults of each test stage in a run
+      faults - each fault (addr, expected, read)
+      bit_errors - each bit error of a fault (bit index 0 is the most
+        significant bit, error +1 read 1 expected 0, -1 read 0 expected 1)
+    Faults and bit errors are indexed by address, so a query of one address
+    across many runs does not scan the whole table
+    The loaders return numpy structured arrays (e.g. for
+    `pandas.DataFrame(array)`)
+    '''
+    schema = [
+        '''CREATE TABLE IF NOT EXISTS runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT, time TEXT, chip TEXT, board TEXT, directory TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS stages (
+            run_id INTEGER, test TEXT, stage TEXT, clk_factor INTEGER, delay_factor INTEGER,
+            n_reads INTEGER, n_faults INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS faults (
+            run_id INTEGER, test TEXT, stage TEXT, clk_factor INTEGER, delay_factor INTEGER,
+            addr INTEGER, expected INTEGER, read INTEGER)''',
+        '''CREATE TABLE IF NOT EXISTS bit_errors (
+            run_id INTEGER, test TEXT, stage TEXT, clk_factor INTEGER, delay_factor INTEGER,
+            addr INTEGER, bit INTEGER, error INTEGER)''',
+        'CREATE INDEX IF NOT EXISTS runs_chip ON runs (chip, run_id)',
+        'CREATE INDEX IF NOT EXISTS stages_run ON stages (run_id, test, clk_factor)',
+        'CREATE INDEX IF NOT EXISTS faults_addr ON faults (addr, run_id)',
+        'CREATE INDEX IF NOT EXISTS faults_run ON faults (run_id, test, clk_factor)',
+        'CREATE INDEX IF NOT EXISTS bit_errors_addr ON bit_errors (addr, bit, run_id)',
+        'CREATE INDEX IF NOT EXISTS bit_errors_run ON bit_errors (run_id, test, clk_factor)',
+    ]
+    key_columns = ['run_id', 'test', 'stage', 'clk_factor', 'delay_factor']
+    dtypes = {
+        'run_id' : int, 'time' : object, 'chip' : object, 'board' : object, 'directory' : object,
+        'test' : object, 'stage' : object, 'clk_factor' : int, 'delay_factor' : int,
+        'n_reads' : int, 'n_faults' : int, 'addr' : int, 'expected' : int, 'read' : int,
+        'bit' : int, 'error' : int
+    }
+
+    def __init__(self, filename='data/results.sqlite', timeout=60):
+        '''
+        Opens (or creates) the database `filename`
+        `timeout` [s] is how long to wait for another process writing to it
+        '''
+        directory = os.path.dirname(filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.filename = filename
+        self.db = sqlite3.connect(filename, timeout=timeout)
+        for statement in self.schema:
+            self.db.execute(statement)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def add_run(self, faults, bitmaps=None, chip=None, board=None, delay_factor=None, directory=None, run_time=None):
+        '''
+        Stores the results of one `run_test_suite`
+        `faults` (and `bitmaps`, for the number of reads) are indexed by
+          [test][clk_factor][stage]
+        `run_time` defaults to now
+        returns the run_id
+        '''
+        run_time = time.strftime('%Y-%m-%d %H:%M:%S') if run_time is None else run_time
+        with self.db:
+            run_id = self.db.execute('INSERT INTO runs (time, chip, board, directory) VALUES (?, ?, ?, ?)',
+                                     (run_time, chip, board, directory)).lastrowid
+            for test in faults.keys():
+                for clk_factor in faults[test].keys():
+                    for stage, fault_list in faults[test][clk_factor].items():
+                        key = (run_id, test, stage, clk_factor, delay_factor)
+                        n_reads = None
+                        if bitmaps is not None:
+                            n_reads = len(bitmaps[test][clk_factor][stage])
+                        self.db.execute('INSERT INTO stages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        key + (n_reads, len(fault_list)))
+                        self._add_faults(key, fault_list)
+        return run_id
+
+    def _add_faults(self, key, fault_list):
+        '''
+        Inserts the faults and bit errors of one test stage
+        '''
+        if not len(fault_list):
+            return
+        self.db.executemany('INSERT INTO faults VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            [key + tuple(fault) for fault in fault_list])
+        known = np.array([fault for fault in fault_list if fault[1] is not None and fault[2] is not None],
+                         dtype=int).reshape(-1,3)
+        expected, read = known[:,1].astype(np.uint8), known[:,2].astype(np.uint8)
+        flipped = np.unpackbits((expected ^ read)[:,np.newaxis], axis=1)
+        fault_idxs, bits = np.nonzero(flipped)
+        errors = 2*np.unpackbits(read[:,np.newaxis], axis=1)[fault_idxs, bits].astype(int) - 1
+        self.db.executemany('INSERT INTO bit_errors VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            [key + row for row in zip(known[fault_idxs,0].tolist(), bits.tolist(), errors.tolist())])
+
+    def run_ids(self, chip=None, board=None, last=None):
+        '''
+        Returns the run_ids (oldest first) of a chip and/or board, only the
+        `last` runs if given
+        '''
+        where, args = self._where(chip=chip, board=board)
+        query = 'SELECT run_id FROM runs {} ORDER BY run_id DESC'.format(where)
+        if last is not None:
+            query += ' LIMIT {:d}'.format(last)
+        return [row[0] for row in self.db.execute(query, args)][::-1]
+
+    def _where(self, **kwargs):
+        '''
+        Returns an sql WHERE clause and its arguments matching each keyword
+        that is not None (a list matches any of its values)
+        '''
+        clauses = []
+        args = []
+        for column, value in kwargs.items():
+            if value is None:
+                continue
+            if isinstance(value, (list, tuple, np.ndarray)):
+                clauses += ['{} IN ({})'.format(column, ','.join(['?']*len(value)))]
+                args += list(value)
+            else:
+                clauses += ['{} = ?'.format(column)]
+                args += [value]
+        return ('WHERE ' + ' AND '.join(clauses) if len(clauses) else ''), args
+
+    def _select(self, table, columns, chip=None, board=None, last=None, **kwargs):
+        '''
+        Returns the rows of `table` matching the keyword arguments as a numpy
+        structured array
+        `chip`, `board` and `last` select runs (see `run_ids`)
+        '''
+        if chip is not None or board is not None or last is not None:
+            run_ids = self.run_ids(chip=chip, board=board, last=last)
+            if kwargs.get('run_id') is not None:
+                run_ids = [run_id for run_id in np.atleast_1d(kwargs['run_id']).tolist() if run_id in run_ids]
+            kwargs['run_id'] = run_ids
+        where, args = self._where(**kwargs)
+        rows = self.db.execute('SELECT {} FROM {} {} ORDER BY run_id'.format(','.join(columns), table, where),
+                               args).fetchall()
+        dtype = [(column, self.dtypes[column]) for column in columns]
+        array = np.empty(len(rows), dtype=dtype)
+        for idx, column in enumerate(columns):
+            values = [row[idx] for row in rows]
+            if self.dtypes[column] == int:
+                values = [-1 if value is None else value for value in values]
+            array[column] = values
+        return array
+
+    def runs(self, chip=None, board=None, last=None):
+        '''
+        Returns the runs as a structured array of run_id, time, chip, board,
+        directory
+        '''
+        return self._select('runs', ['run_id', 'time', 'chip', 'board', 'directory'], chip=chip, board=board,
+                            last=last)
+
+    def stages(self, run_id=None, test=None, stage=None, clk_factor=None, chip=None, board=None, last=None):
+        '''
+        Returns the test stages as a structured array of run_id, test, stage,
+        clk_factor, delay_factor, n_reads, n_faults (-1 if unknown)
+        '''
+        return self._select('stages', self.key_columns + ['n_reads', 'n_faults'], run_id=run_id, test=test,
+                            stage=stage, clk_factor=clk_factor, chip=chip, board=board, last=last)
+
+    def faults(self, addr=None, run_id=None, test=None, stage=None, clk_factor=None, chip=None, board=None,
+               last=None):
+        '''
+        Returns the faults as a structured array of run_id, test, stage,
+        clk_factor, delay_factor, addr, expected, read (-1 if unknown)
+        Each argument selects matching faults (a list matches any of its
+        values), `last` selects the last runs of `chip`/`board`, e.g.
+          store.faults(addr=0x10, chip='chip A', last=50)
+        '''
+        return self._select('faults', self.key_columns + ['addr', 'expected', 'read'], addr=addr, run_id=run_id,
+                            test=test, stage=stage, clk_factor=clk_factor, chip=chip, board=board, last=last)
+
+    def bit_errors(self, addr=None, bit=None, run_id=None, test=None, stage=None, clk_factor=None, chip=None,
+                   board=None, last=None):
+        '''
+        Returns the bit errors as a structured array of run_id, test, stage,
+        clk_factor, delay_factor, addr, bit, error
+        Arguments select as in `faults`
+        '''
+        return self._select('bit_errors', self.key_columns + ['addr', 'bit', 'error'], addr=addr, bit=bit,
+                            run_id=run_id, test=test, stage=stage, clk_factor=clk_factor, chip=chip, board=board,
+                            last=last)
@@ -6,6 +6,6 @@ setup(name='cryosram',
       version='1.0.0',
       description='A small collection for cryosram testing',
       author='Peter Madigan',
-      scripts=['cryoCMOS.py','plotting.py','test_suite.py'],
+      scripts=['cryoCMOS.py','plotting.py','test_suite.py','benchmark.py','sram_sim.py','capture.py','march.py','async_sram.py','results.py','replay.py','metrics.py','bitcounts.py'],
       install_requires=['pyserial','bitarray','numpy','matplotlib','ipython']
 )
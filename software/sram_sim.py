@@ -0,0 +1,491 @@
+import os
+import time
+import collections
+import select
+import threading
+import numpy as np
+
+class SimFPGA :
+    '''
+    In-process emulator of the FPGA serial protocol (see `top.v`)
+    Can be used in place of a `Serial` object with `read(<nbytes>)` and
+    `write(<bytes>)`
+    Keeps the address, memory, clk_factor and read delay registers and
+    queues the same 2-byte responses as the firmware. Bytes are assumed to
+    arrive back-to-back at `baudrate` within a single `write` call; any byte
+    arriving while the FPGA is still busy with a previous command (SRAM cycle
+    or transmitting a response) is dropped, as it would be by the firmware
+    (dropped non-NOP bytes are counted in `n_dropped`)
+    If `realtime`, `write` sleeps for the time the bytes take on the wire
+    (and any march run by them)
+    If `wallclock`, bytes arrive at the host's clock and `write` only sleeps
+    for their time on the wire, so bytes written before the FPGA is ready
+    again are dropped (as with a real board and too short a `rw_delay`)
+    `faults` is a list of fault models (see `StuckAtFault`, etc.)
+    `baudrate` is the host side of the uart (set it as for a `Serial`). The
+    FPGA side is set by SET_BAUD (and returns to the last confirmed rate
+    `baud_timeout` of host time after an unconfirmed change). Bytes are lost
+    if the two differ by more than `baud_tolerance`, or if the host rate is
+    above `max_baudrate` (the fastest rate the usb-uart bridge passes)
+    `latency` [s] delays responses by a fixed time, like the latency timer of
+    a usb-uart bridge (`read` waits for them)
+    Reads and writes may be made from different threads
+    '''
+    NOP = 0x0
+    SET_ADDR = 0x1
+    WRITE_VAL = 0x2
+    READ_ADDR = 0x3
+    READ_VAL = 0x4
+    SET_CLK = 0x5
+    READ_CLK = 0x6
+    SET_DELAY = 0x7
+    WRITE_BLOCK = 0x8
+    READ_BLOCK = 0x9
+    MARCH = 0xA
+    SET_BAUD = 0xB
+    two_byte_messages = (SET_ADDR, WRITE_VAL, SET_CLK, SET_DELAY, WRITE_BLOCK, READ_BLOCK, MARCH, SET_BAUD)
+    max_march_len = 128 # program bytes stored by the fpga
+    min_clks_per_bit = 8
+    baud_timeout = 0.5 # [s]
+    baud_tolerance = 0.03
+
+    fpga_clk = 100e6 # [Hz]
+    n_addr = 2**9
+
+    def __init__(self, baudrate=1e6, realtime=False, faults=None, memory=None, wallclock=False, max_baudrate=None, latency=0.):
+        self.baudrate = baudrate
+        self.max_baudrate = max_baudrate
+        self.default_baudrate = baudrate
+        self.realtime = realtime
+        self.wallclock = wallclock
+        self.faults = [] if faults is None else list(faults)
+        self.memory = np.zeros(self.n_addr, dtype=np.uint8)
+        if memory is not None:
+            self.memory[:] = memory
+        self.rx_bytes = bytearray()
+        self.latency = latency
+        self.rx_total = 0 # response bytes queued since creation
+        self.rx_ready = collections.deque() # (host time [s], rx_total) when responses reach the host
+        self.lock = threading.Lock() # reads and writes may come from different threads
+        self.reset()
+
+        self.n_frames = 0
+        self.n_dropped = 0
+
+    def __getstate__(self):
+        '''
+        Pickle without the lock (e.g. to pass a sim to another process)
+        '''
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def reset(self):
+        '''
+        Return registers to their power-on values (top button)
+        '''
+        self.address = 0
+        self.clk_factor = 25
+        self.read_delay = 4
+        self.fpga_baudrate = self.confirmed_baudrate = self.default_baudrate
+        self.baud_deadline = None # [s] host time an unconfirmed fpga_baudrate is reverted
+        self.first_byte = None
+        self.block_remaining = 0 # values left in a WRITE_BLOCK
+        self.march_remaining = 0 # program bytes left in a MARCH
+        self.march_program = bytearray()
+        self.time = 0. # [s] time of last received byte
+        self.busy_until = 0. # [s] time fpga returns to waiting
+        self.time_origin = time.time() # [s] host time of `time` 0 (if `wallclock`)
+
+    def byte_time(self):
+        '''
+        Time for one 8N1 byte on the wire
+        '''
+        return 10./self.baudrate
+
+    def link_ok(self):
+        '''
+        True if bytes pass between the host and the FPGA at their current
+        baud rates
+        '''
+        if self.max_baudrate is not None and self.baudrate > self.max_baudrate:
+            return False
+        return abs(self.fpga_baudrate/self.baudrate - 1) <= self.baud_tolerance
+
+    def read_cycle_time(self):
+        return (4*self.clk_factor + self.read_delay + 1)/self.fpga_clk
+
+    def write_cycle_time(self):
+        return (4*self.clk_factor + 1)/self.fpga_clk
+
+    def sram_write(self, value):
+        '''
+        Write cycle at current address, passing through fault models
+        '''
+        old = int(self.memory[self.address])
+        for fault in self.faults:
+            value = fault.write(self, self.address, old, value)
+        self.memory[self.address] = value
+
+    def sram_read(self):
+        '''
+        Read cycle at current address, passing through fault models
+        '''
+        value = int(self.memory[self.address])
+        for fault in self.faults:
+            value = fault.read(self, self.address, value)
+        return value
+
+    def write(self, write_bytes):
+        '''
+        Process received bytes and queue responses
+        '''
+        with self.lock:
+            n_rx = len(self.rx_bytes)
+            byte_time = self.byte_time()
+            if self.wallclock:
+                t = t_start = max(self.time, time.time() - self.time_origin)
+            else:
+                t = t_start = max(self.time, self.busy_until)
+            if self.baud_deadline is not None and time.time() > self.baud_deadline:
+                self.fpga_baudrate = self.confirmed_baudrate
+                self.baud_deadline = None
+            link_ok = self.link_ok()
+            for byte in bytearray(write_bytes):
+                t += byte_time
+                if not link_ok:
+                    # garbled
+                    self.n_dropped += 1
+                    continue
+                if self.march_remaining:
+                    # march program
+                    if t < self.busy_until:
+                        self.n_dropped += 1
+                        continue
+                    if len(self.march_program) < self.max_march_len:
+                        self.march_program.append(byte)
+                    self.march_remaining -= 1
+                    if not self.march_remaining:
+                        self.busy_until = t + self.run_march()
+                    continue
+                if self.block_remaining:
+                    # block data - one byte can be held while a write cycle finishes
+                    start = max(t, self.busy_until)
+                    self.block_remaining -= 1
+                    if start - t >= byte_time:
+                        self.n_dropped += 1
+                        continue
+                    self.sram_write(byte)
+                    self.address = (self.address + 1) % self.n_addr
+                    self.busy_until = start + self.write_cycle_time()
+                    continue
+                if self.first_byte is None:
+                    if t < self.busy_until:
+                        if byte:
+                            self.n_dropped += 1
+                        continue
+                    opcode = byte >> 4
+                    if opcode in self.two_byte_messages:
+                        self.first_byte = byte
+                        continue
+                    if opcode == self.READ_ADDR:
+                        self.n_frames += 1
+                        self.rx_bytes += bytearray([(opcode << 4) | (self.address >> 8), self.address & 0xff])
+                        self.busy_until = t + 2*byte_time
+                    elif opcode == self.READ_VAL:
+                        self.n_frames += 1
+                        self.rx_bytes += bytearray([opcode << 4, self.sram_read()])
+                        self.busy_until = t + max(byte_time, self.read_cycle_time()) + byte_time
+                    elif opcode == self.READ_CLK:
+                        self.n_frames += 1
+                        self.rx_bytes += bytearray([opcode << 4, self.clk_factor])
+                        self.busy_until = t + 2*byte_time
+                    continue
+
+                opcode, high = self.first_byte >> 4, self.first_byte & 0xf
+                self.first_byte = None
+                self.n_frames += 1
+                if opcode == self.SET_ADDR:
+                    self.address = ((high & 0x1) << 8) | byte
+                elif opcode == self.WRITE_VAL:
+                    self.sram_write(byte)
+                    self.busy_until = t + self.write_cycle_time()
+                elif opcode == self.SET_CLK:
+                    self.clk_factor = byte
+                elif opcode == self.SET_DELAY:
+                    self.read_delay = byte
+                elif opcode == self.WRITE_BLOCK:
+                    self.block_remaining = (high << 8) | byte
+                elif opcode == self.READ_BLOCK:
+                    n = (high << 8) | byte
+                    for i in range(n):
+                        self.rx_bytes.append(self.sram_read())
+                        self.address = (self.address + 1) % self.n_addr
+                    self.busy_until = t + n*(self.read_cycle_time() + byte_time)
+                elif opcode == self.MARCH:
+                    self.march_remaining = (high << 8) | byte
+                    self.march_program = bytearray()
+                elif opcode == self.SET_BAUD:
+                    clks_per_bit = (high << 8) | byte
+                    if clks_per_bit == int(round(self.fpga_clk/self.fpga_baudrate)):
+                        self.confirmed_baudrate = self.fpga_baudrate
+                        self.baud_deadline = None
+                    elif clks_per_bit >= self.min_clks_per_bit:
+                        self.fpga_baudrate = self.fpga_clk/clks_per_bit
+                        self.baud_deadline = time.time() + self.baud_timeout
+                        link_ok = self.link_ok()
+            self.time = t
+            self._responses_queued(len(self.rx_bytes) - n_rx)
+        if self.wallclock:
+            time.sleep(t - t_start)
+        elif self.realtime:
+            time.sleep(max(t, self.busy_until) - t_start)
+        return len(write_bytes)
+
+    def run_march(self):
+        '''
+        Run the stored march program over all addresses (see `top.v`)
+        Queues a 4-byte record for each failed read and an end record
+        Returns the time taken [s]
+        '''
+        program = self.march_program
+        elapsed = 0.
+        n_faults = 0
+        ptr = 0
+        element = 0
+        while ptr < len(program):
+            header = program[ptr]
+            n_ops = header & 0x7f
+            ops = [(program[i], program[i+1] if i+1 < len(program) else 0)
+                   for i in range(ptr+1, ptr+1+2*n_ops, 2) if i < len(program)]
+            addrs = range(self.n_addr-1, -1, -1) if header & 0x80 else range(self.n_addr)
+            for addr in (addrs if n_ops else []):
+                self.address = addr
+                for op_idx, (kind, data) in enumerate(ops):
+                    if kind & 0x1:
+                        value = self.sram_read()
+                        elapsed += self.read_cycle_time()
+                        if value != data:
+                            n_faults += 1
+                            self.rx_bytes += bytearray([(self.MARCH << 4) | ((element & 0x7) << 1) | (addr >> 8),
+                                                        addr & 0xff, op_idx, value])
+                            elapsed += 4*self.byte_time()
+                    else:
+                        self.sram_write(data)
+                        elapsed += self.write_cycle_time()
+            ptr += 1 + 2*n_ops
+            element += 1
+        n_faults = min(n_faults, 0xffff)
+        self.rx_bytes += bytearray([self.MARCH << 4, n_faults >> 8, 0x80, n_faults & 0xff])
+        return elapsed + 4*self.byte_time()
+
+    def _responses_queued(self, n_bytes):
+        '''
+        Records when `n_bytes` new response bytes reach the host (after
+        `latency`)
+        '''
+        if n_bytes:
+            self.rx_total += n_bytes
+            self.rx_ready.append((time.time() + self.latency, self.rx_total))
+
+    def read(self, n_bytes):
+        '''
+        Return up to `n_bytes` queued response bytes
+        With a `latency`, waits until the bytes have reached the host
+        '''
+        while True:
+            with self.lock:
+                n_bytes = min(n_bytes, len(self.rx_bytes))
+                target = self.rx_total - len(self.rx_bytes) + n_bytes
+                while len(self.rx_ready) and self.rx_ready[0][1] <= self.rx_total - len(self.rx_bytes):
+                    self.rx_ready.popleft()
+                wait = 0.
+                for ready, total in self.rx_ready:
+                    if total >= target:
+                        wait = ready - time.time()
+                        break
+                if wait <= 0:
+                    return_bytes = bytes(self.rx_bytes[:n_bytes])
+                    del self.rx_bytes[:n_bytes]
+                    return return_bytes
+            time.sleep(wait)
+
+    def reset_input_buffer(self):
+        '''
+        Discard queued response bytes
+        '''
+        with self.lock:
+            self.rx_bytes = bytearray()
+            self.rx_ready.clear()
+
+class PtyFPGA :
+    '''
+    Serves a `SimFPGA` on a pseudo-terminal, so that it can be opened as a
+    serial port (`PtyFPGA().port`, e.g. with `Serial(port)`) for testing
+    (POSIX only)
+    '''
+
+    def __init__(self, sim=None):
+        import tty
+        self.sim = SimFPGA() if sim is None else sim
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.master)
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, name='PtyFPGA')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        '''
+        Pass bytes written to the port to the simulation and return its
+        responses
+        '''
+        while self.running:
+            ready, _, _ = select.select([self.master], [], [], 0.1)
+            if not ready:
+                continue
+            try:
+                write_bytes = os.read(self.master, 4096)
+            except OSError:
+                break
+            self.sim.write(write_bytes)
+            read_bytes = self.sim.read(len(self.sim.rx_bytes))
+            if len(read_bytes):
+                os.write(self.master, read_bytes)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
+
+class FaultModel :
+    '''
+    Base class for SRAM fault models used by `SimFPGA`
+    `addrs` is an address or list of addresses (None for all addresses) and
+    `bits` is a bitmask of affected bits
+    '''
+
+    def __init__(self, addrs=None, bits=0xff):
+        if addrs is None or isinstance(addrs, (list, tuple, set, range, np.ndarray)):
+            self.addrs = None if addrs is None else set(np.asarray(addrs).ravel().tolist())
+        else:
+            self.addrs = set([addrs])
+        self.bits = bits
+
+    def applies(self, addr):
+        return self.addrs is None or addr in self.addrs
+
+    def write(self, sim, addr, old, new):
+        '''
+        Returns the value stored by a write of `new` over `old`
+        '''
+        return new
+
+    def read(self, sim, addr, value):
+        '''
+        Returns the value seen by a read of stored `value`
+        '''
+        return value
+
+class StuckAtFault(FaultModel) :
+    '''
+    Bits always hold `value` (0 or 1)
+    '''
+
+    def __init__(self, addrs=None, bits=0xff, value=0):
+        FaultModel.__init__(self, addrs, bits)
+        self.value = value
+
+    def force(self, value):
+        return (value | self.bits) if self.value else (value & ~self.bits & 0xff)
+
+    def write(self, sim, addr, old, new):
+        return self.force(new) if self.applies(addr) else new
+
+    def read(self, sim, addr, value):
+        return self.force(value) if self.applies(addr) else value
+
+class TransitionFault(FaultModel) :
+    '''
+    Bits fail to make a 0 -> 1 (`rising`) or 1 -> 0 transition
+    '''
+
+    def __init__(self, addrs=None, bits=0xff, rising=True):
+        FaultModel.__init__(self, addrs, bits)
+        self.rising = rising
+
+    def write(self, sim, addr, old, new):
+        if not self.applies(addr):
+            return new
+        if self.rising:
+            failed = ~old & new & self.bits
+        else:
+            failed = old & ~new & self.bits
+        return new ^ failed
+
+class CouplingFault(FaultModel) :
+    '''
+    A transition of the `aggressor_bits` at `aggressor` forces the victim
+    bits (`addrs`, `bits`) to `value`
+    `rising` selects the aggressor transition (0 -> 1 if True, 1 -> 0 if
+    False, either if None)
+    '''
+
+    def __init__(self, aggressor, addrs, bits=0xff, aggressor_bits=0xff, rising=None, value=1):
+        FaultModel.__init__(self, addrs, bits)
+        self.aggressor = aggressor
+        self.aggressor_bits = aggressor_bits
+        self.rising = rising
+        self.value = value
+
+    def write(self, sim, addr, old, new):
+        if addr != self.aggressor:
+            return new
+        if self.rising is None:
+            transition = (old ^ new) & self.aggressor_bits
+        elif self.rising:
+            transition = ~old & new & self.aggressor_bits
+        else:
+            transition = old & ~new & self.aggressor_bits
+        if transition:
+            for victim in (range(sim.n_addr) if self.addrs is None else self.addrs):
+                if victim == addr:
+                    continue
+                if self.value:
+                    sim.memory[victim] |= self.bits
+                else:
+                    sim.memory[victim] &= ~self.bits & 0xff
+        return new
+
+class TimingFault(FaultModel) :
+    '''
+    Reads of the bits return `value` when the SRAM is driven faster than
+    `min_clk_factor` or latched earlier than `min_delay`
+    If `write_fails`, writes at too high a speed also leave the bits unchanged
+    '''
+
+    def __init__(self, addrs=None, bits=0xff, min_clk_factor=1, min_delay=0, value=0, write_fails=False):
+        FaultModel.__init__(self, addrs, bits)
+        self.min_clk_factor = min_clk_factor
+        self.min_delay = min_delay
+        self.value = value
+        self.write_fails = write_fails
+
+    def write(self, sim, addr, old, new):
+        if self.write_fails and self.applies(addr) and sim.clk_factor < self.min_clk_factor:
+            return (new & ~self.bits & 0xff) | (old & self.bits)
+        return new
+
+    def read(self, sim, addr, value):
+        if not self.applies(addr):
+            return value
+        if sim.clk_factor < self.min_clk_factor or sim.read_delay < self.min_delay:
+            return (value | self.bits) if self.value else (value & ~self.bits & 0xff)
+        return value
@@ -1,8 +1,12 @@
 #!/usr/bin/ipython -i
 import os
 import sys
+import pickle
+import random
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from cryoCMOS import *
 from plotting import *
+from results import ResultStore
 from serial import Serial, SerialException
 from serial.tools.list_ports import comports
 
@@ -19,7 +23,183 @@ def quick_serial(port='/dev/ttyUSB1',baudrate=1e6, timeout=1):
     '''
     return Serial(port=port, baudrate=baudrate, timeout=timeout)    
 
-def run_test_suite(c, clk_factors=[25, 10, 5, 3, 2, 1]):
+def find_boards(vid=0x0403, pid=0x6010, interface=1):
+    '''
+    Returns the serial port names of connected boards
+    The BASYS3 usb (FTDI FT2232) has two interfaces, JTAG and UART, and
+    only the UART `interface` is returned
+    '''
+    ports = []
+    for port in comports():
+        if port.vid != vid or port.pid != pid:
+            continue
+        if port.location and not port.location.endswith('.{}'.format(interface)):
+            continue
+        ports += [port.device]
+    return sorted(ports)
+
+def run_board(board, io, directory, clk_factors=[25, 10, 5, 3, 2, 1], read_delay=4, calibrate=False,
+              calibration_dir='data/calibration', store=None, chip=None, resume=False, baudrates=None, **kwargs):
+    '''
+    Runs `run_test_suite` on one board, logging to `directory`/<board>
+    `io` is a serial port name or an io object
+    Command delays are loaded from `calibration_dir`/<board>.json if it
+    exists, or measured (and saved there) first if `calibrate` (see
+    `CryoSRAM.calibrate_delay`)
+    If `store` (a database file name) is given, the results are added to it
+    as a run of `chip` (see `results.ResultStore`)
+    If `resume`, progress is checkpointed to `directory`/<board>/checkpoint.pkl
+    and a suite interrupted there is continued (see `run_test_suite`). The
+    checkpoint is deleted when the suite completes
+    If `baudrates` is given, the fastest of them that works is used (see
+    `CryoSRAM.negotiate_baud`, delays should be calibrated at that rate)
+    Extra keyword arguments are passed to `CryoSRAM`
+    '''
+    board_dir = os.path.join(directory, board)
+    try:
+        os.makedirs(board_dir)
+    except OSError:
+        pass
+    log = CryoLogger(directory=board_dir, name=board)
+    try:
+        if isinstance(io, str):
+            io = quick_serial(port=io)
+        c = CryoSRAM(io=io, log=log, **kwargs)
+        c.set_delay(read_delay)
+        if baudrates is not None:
+            c.negotiate_baud(baudrates)
+        delay_file = os.path.join(calibration_dir, board + '.json')
+        if calibrate:
+            try:
+                os.makedirs(calibration_dir)
+            except OSError:
+                pass
+            c.calibrate_delay(clk_factors, filename=delay_file)
+        elif os.path.exists(delay_file):
+            c.load_delays(delay_file)
+        checkpoint = os.path.join(board_dir, 'checkpoint.pkl') if resume else None
+        faults, bitmaps = run_test_suite(c, clk_factors=clk_factors, checkpoint=checkpoint)
+        if store is not None:
+            results = ResultStore(store)
+            try:
+                run_id = results.add_run(faults, bitmaps, chip=chip, board=board, delay_factor=read_delay,
+                                         directory=board_dir)
+                log.info('Saved results to {} (run {})'.format(store, run_id))
+            finally:
+                results.close()
+        return faults, bitmaps
+    finally:
+        log.close()
+
+def run_boards(boards=None, clk_factors=[25, 10, 5, 3, 2, 1], directory=None, chips=None, processes=False, **kwargs):
+    '''
+    Runs `run_test_suite` on several boards at once (a thread per board, or
+    a process if `processes`)
+    `boards` is a dict of board name : serial port name or io object, or a
+      list of serial port names (defaults to `find_boards()`)
+    `chips` maps board names to the name of the chip on that board (defaults
+      to the board name)
+    Each board logs to its own directory in `directory`
+    Extra keyword arguments are passed to `run_board` (e.g. `store` to save
+    the results of each board)
+    returns dicts indexed by chip :
+      faults[chip][test][clk_factor][stage]
+      bitmaps[chip][test][clk_factor][stage]
+    and a dict of board name : exception for boards that failed
+    '''
+    if boards is None:
+        boards = find_boards()
+    if not isinstance(boards, dict):
+        boards = dict([(os.path.basename(port), port) for port in boards])
+    if directory is None:
+        directory = 'data/' + time.strftime('%Y_%m_%d')
+    chips = {} if chips is None else chips
+
+    faults = {}
+    bitmaps = {}
+    errors = {}
+    if not len(boards):
+        return faults, bitmaps, errors
+    executor_class = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with executor_class(max_workers=len(boards)) as executor:
+        futures = dict([(board, executor.submit(run_board, board, io, directory, clk_factors,
+                                                chip=chips.get(board, board), **kwargs))
+                        for board, io in boards.items()])
+        for board, future in futures.items():
+            chip = chips.get(board, board)
+            try:
+                faults[chip], bitmaps[chip] = future.result()
+            except Exception as error:
+                errors[board] = error
+    return faults, bitmaps, errors
+
+class Checkpoint :
+    '''
+    Progress of a test suite, saved to `filename` after each (test,
+    clk_factor) unit so an interrupted suite can be resumed
+    Holds the faults and bitmaps of completed units, the `random` state and
+    a snapshot of the `CryoSRAM` memory after the last unit
+    '''
+
+    def __init__(self, filename):
+        '''
+        Loads the progress in `filename` if it exists
+        '''
+        self.filename = filename
+        self.completed = []
+        self.faults = {}
+        self.bitmaps = {}
+        self.random_state = None
+        self.memory = None
+        if os.path.exists(filename):
+            with open(filename, 'rb') as f:
+                state = pickle.load(f)
+            self.completed = state['completed']
+            self.faults = state['faults']
+            self.bitmaps = state['bitmaps']
+            self.random_state = state['random_state']
+            self.memory = state['memory']
+
+    def done(self, test_name, clk_factor):
+        return (test_name, clk_factor) in self.completed
+
+    def restore(self, c):
+        '''
+        Restores the memory snapshot and `random` state of the last unit
+        The fpga address is unknown after a restore
+        '''
+        if self.random_state is not None:
+            random.setstate(self.random_state)
+        if self.memory is not None:
+            c.memory.values[:], c.memory.known[:] = self.memory
+            c.fpga_addr = None
+            c.log.info('Resuming from {} ({} units completed)'.format(self.filename, len(self.completed)))
+
+    def save(self, c, test_name, clk_factor, faults, bitmaps):
+        '''
+        Records a completed unit and writes the checkpoint (replacing the
+        file only once it is complete)
+        '''
+        self.faults.setdefault(test_name, {})[clk_factor] = faults
+        self.bitmaps.setdefault(test_name, {})[clk_factor] = bitmaps
+        self.completed += [(test_name, clk_factor)]
+        self.random_state = random.getstate()
+        self.memory = (c.memory.values.copy(), c.memory.known.copy())
+        state = dict(completed=self.completed, faults=self.faults, bitmaps=self.bitmaps,
+                     random_state=self.random_state, memory=self.memory)
+        with open(self.filename + '.tmp', 'wb') as f:
+            pickle.dump(state, f, protocol=2)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def remove(self):
+        '''
+        Deletes the checkpoint file once the suite is complete, so the next
+        run starts afresh
+        '''
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
+
+def run_test_suite(c, clk_factors=[25, 10, 5, 3, 2, 1], checkpoint=None):
     '''
     Runs primary tests on `CryoSRAM` object
     These are:
@@ -29,6 +209,10 @@ def run_test_suite(c, clk_factors=[25, 10, 5, 3, 2, 1]):
      - `rand_test`
     For each test, the clk speed is scanned over the values specified by 
       `clk_factors`
+    If `checkpoint` (a file name) is given, progress is saved there after
+      each test and clk factor, and a suite that was interrupted is resumed
+      from it, skipping the completed units (see `Checkpoint`). The file is
+      deleted when the suite completes
     '''
     tests = [
         c.mats_test,
@@ -38,32 +222,142 @@ def run_test_suite(c, clk_factors=[25, 10, 5, 3, 2, 1]):
     ]
     faults = {}
     bitmaps = {}
+    if checkpoint is not None:
+        checkpoint = Checkpoint(checkpoint)
+        checkpoint.restore(c)
     c.log.info(' ~~ Test suite start ~~')
     for test in tests:
-        faults[test.__name__], bitmaps[test.__name__] = run_clk_scan(c, test, clk_factors=clk_factors)
+        faults[test.__name__], bitmaps[test.__name__] = run_clk_scan(c, test, clk_factors=clk_factors,
+                                                                     checkpoint=checkpoint)
+    if checkpoint is not None:
+        checkpoint.remove()
     c.log.info(' ~~ Test suite end ~~')
     return faults, bitmaps
 
-def run_clk_scan(c, test, clk_factors=[25, 10, 5, 3, 2, 1]):
+def run_clk_scan(c, test, clk_factors=[25, 10, 5, 3, 2, 1], checkpoint=None):
     '''
     Repeats test while scanning the clk through specified values
+    Clk factors completed in `checkpoint` (a `Checkpoint`) are not repeated,
+    and each new one is saved to it
     '''
     faults = {}
     bitmaps = {}
     c.log.info(' ~~ Clock scan start ~~')
     for clk_factor in clk_factors:
+        if checkpoint is not None and checkpoint.done(test.__name__, clk_factor):
+            c.log.info('Skip {} at clk factor {} (completed)'.format(test.__name__, clk_factor))
+            faults[clk_factor] = checkpoint.faults[test.__name__][clk_factor]
+            bitmaps[clk_factor] = checkpoint.bitmaps[test.__name__][clk_factor]
+            continue
         c.log.info('Set clk to {} MHz'.format(100/(4*clk_factor)))
         c.set_clk(clk_factor)
         if c.read_clk() != clk_factor:
             c.log.error('Clk not set! Is {} MHz'.format(100/(4*c.clk_factor)))
             raise RuntimeError
         faults[clk_factor], bitmaps[clk_factor] = test()
+        if checkpoint is not None:
+            checkpoint.save(c, test.__name__, clk_factor, faults[clk_factor], bitmaps[clk_factor])
     c.log.info(' ~~ Clock scan end ~~')
     return faults, bitmaps
 
-def generate_plots(c, test_suite_results, show_plots=False):
+def shmoo_point(c, test):
+    '''
+    Runs `test` and returns its byte and bit error rates (faults per read,
+    bit errors per bit read) and number of reads
+    '''
+    faults, bitmaps = test()
+    n_reads = sum([len(bitmap) for bitmap in bitmaps.values()]) if bitmaps is not None else 0
+    n_faults = sum([len(fault_list) for fault_list in faults.values()])
+    n_bit_errors = sum([count_bit_errors(fault_list) for fault_list in faults.values()])
+    return n_faults/max(n_reads, 1), n_bit_errors/max(8*n_reads, 1), n_reads
+
+def run_shmoo(c, clk_factors=range(1, 26), delay_factors=range(0, 16), test=None, screen=None, step=4,
+              max_error_rate=0.):
+    '''
+    Maps the (clk_factor, delay_factor) operating region adaptively
+    Points are first tested on a coarse grid (every `step` values of each
+    axis, and the last), then each cell of the grid whose corners do not all
+    pass or all fail is tested on a grid of half the step, until neighbouring
+    values are reached. Cells with uniform corners are not tested further
+    At each point the short `screen` test (defaults to `c.pattern_test`) is
+    run first, and the full `test` (defaults to `c.mats_test`) only if the
+    screen passes. A point passes if its error rate is at most
+    `max_error_rate`
+    returns dict of :
+      clk_factors, delay_factors - the axes
+      byte_error_rate, bit_error_rate - arrays [clk, delay] of the last test
+        run at each point (nan if not tested)
+      tested - array of 0 (not tested), 1 (failed the screen) or 2 (full test)
+      passed - array of pass (1) / fail (0) of each point, untested points
+        take the result of the corners of their cell
+      n_tested - number of points tested
+    '''
+    test = c.mats_test if test is None else test
+    screen = c.pattern_test if screen is None else screen
+    clk_factors, delay_factors = list(clk_factors), list(delay_factors)
+    shape = (len(clk_factors), len(delay_factors))
+    byte_error_rate = np.full(shape, np.nan)
+    bit_error_rate = np.full(shape, np.nan)
+    tested = np.zeros(shape, dtype=int)
+    passed = np.zeros(shape, dtype=int)
+    clk_factor, delay_factor = c.clk_factor, c.delay_factor
+
+    def grid(n, step):
+        return sorted(set(range(0, n, step)) | set([n-1]))
+
+    def measure(i, j):
+        if tested[i,j]:
+            return
+        c.log.info('Shmoo clk factor {} delay {}'.format(clk_factors[i], delay_factors[j]))
+        c.set_clk(clk_factors[i])
+        c.set_delay(delay_factors[j])
+        tested[i,j] = 1
+        byte_error_rate[i,j], bit_error_rate[i,j], n_reads = shmoo_point(c, screen)
+        if byte_error_rate[i,j] <= max_error_rate:
+            tested[i,j] = 2
+            byte_error_rate[i,j], bit_error_rate[i,j], n_reads = shmoo_point(c, test)
+        passed[i,j] = byte_error_rate[i,j] <= max_error_rate
+
+    c.log.info(' ~~ Shmoo start ~~')
+    clk_grid, delay_grid = grid(shape[0], step), grid(shape[1], step)
+    for i in clk_grid:
+        for j in delay_grid:
+            measure(i, j)
+    while True:
+        boundary = []
+        for i0, i1 in zip(clk_grid[:-1], clk_grid[1:]):
+            for j0, j1 in zip(delay_grid[:-1], delay_grid[1:]):
+                corners = passed[[i0, i0, i1, i1], [j0, j1, j0, j1]]
+                if np.any(corners != corners[0]):
+                    boundary += [(i0, i1, j0, j1)]
+                else:
+                    cell = (slice(i0, i1+1), slice(j0, j1+1))
+                    passed[cell] = np.where(tested[cell] > 0, passed[cell], corners[0])
+        if step == 1:
+            break
+        step = max(step//2, 1)
+        for i0, i1, j0, j1 in boundary:
+            for i in grid(i1 - i0 + 1, step):
+                for j in grid(j1 - j0 + 1, step):
+                    measure(i0 + i, j0 + j)
+        clk_grid, delay_grid = grid(shape[0], step), grid(shape[1], step)
+
+    c.set_clk(clk_factor)
+    c.set_delay(delay_factor)
+    n_tested = int(np.sum(tested > 0))
+    c.log.info('Tested {} of {} points ({} full tests)'.format(n_tested, tested.size, int(np.sum(tested == 2))))
+    c.log.info(' ~~ Shmoo end ~~')
+    return dict(clk_factors=clk_factors, delay_factors=delay_factors, byte_error_rate=byte_error_rate,
+                bit_error_rate=bit_error_rate, tested=tested, passed=passed, n_tested=n_tested)
+
+def generate_plots(c, test_suite_results, show_plots=False, processes=None, multipage=False):
     '''
     Basic method to generate basic plots from run_test_suite
+    Plots are rendered headless in a pool of `processes` processes (see
+    `render_plots`), skipping files whose inputs are unchanged since they
+    were saved. Use `multipage` for one pdf per test instead of a file per
+    plot, or `show_plots` to draw each with pyplot (in this process)
+    returns list of saved filenames
     '''
     outdir = c.log.directory + '/plots_'+ c.log.filename
     try:
@@ -75,33 +369,51 @@ def generate_plots(c, test_suite_results, show_plots=False):
     faults = test_suite_results[0]
     bitmaps = test_suite_results[1]
     
+    jobs = []
     tests = faults.keys()
     for test in tests:
-        c.log.info('Saving {} results'.format(test))
         test_outdir = outdir + '/' + test
-        try:
-            os.mkdir(test_outdir)
-            c.log.info('Saving to {}'.format(test_outdir))
-        except OSError:
-            pass
+        if not multipage:
+            try:
+                os.mkdir(test_outdir)
+                c.log.info('Saving to {}'.format(test_outdir))
+            except OSError:
+                pass
 
-        clk_speeds = faults[test].keys()
-        test_stages = faults[test][clk_speeds[0]].keys()
+        figures = []
+        clk_speeds = sorted(faults[test].keys())
+        test_stages = list(faults[test][clk_speeds[0]].keys()) if len(clk_speeds) else []
         for test_stage in test_stages:
-            plot_test_scan(faults[test], test_stage, label='Clk test scan ({} - stage {})'.format(test, test_stage), xlabel='clk factor', show=show_plots)
-            plt.savefig(test_outdir + '/clk_scan_{}.pdf'.replace(' ','_').replace('->','to').format(test_stage))
-            if not show_plots:
-                plt.close()
-            
+            stage_name = test_stage.replace(' ','_').replace('->','to')
+            scan = dict([(clk_speed, {test_stage: faults[test][clk_speed][test_stage]}) for clk_speed in clk_speeds])
+            figures += [(test_outdir + '/clk_scan_{}.pdf'.format(stage_name), 'test_scan',
+                         (scan, test_stage, 'clk factor'), 'Clk test scan ({} - stage {})'.format(test, test_stage))]
             for clk_speed in clk_speeds:
-                plot_bit_map(bitmaps[test][clk_speed][test_stage], label='Bit map ({} - stage {}) @ {} clk factor'.format(test, test_stage, clk_speed), show=show_plots)
-                plt.savefig(test_outdir + '/bit_map_{}_{}.pdf'.format(test_stage.replace(' ','_').replace('->','to'), clk_speed))
-                if not show_plots:
-                    plt.close()
-                plot_bit_error_map(faults[test][clk_speed][test_stage], label='Bit error map ({} - stage {}) @ {} clk factor'.format(test, test_stage, clk_speed), weight_by_error=True, show=show_plots)
-                plt.savefig(test_outdir + '/bit_errors_{}_{}.pdf'.format(test_stage.replace(' ','_').replace('->','to'), clk_speed))
-                if not show_plots:
-                    plt.close()
+                figures += [(test_outdir + '/bit_map_{}_{}.pdf'.format(stage_name, clk_speed), 'bit_map',
+                             (bitmaps[test][clk_speed][test_stage],),
+                             'Bit map ({} - stage {}) @ {} clk factor'.format(test, test_stage, clk_speed))]
+                figures += [(test_outdir + '/bit_errors_{}_{}.pdf'.format(stage_name, clk_speed), 'bit_error_map',
+                             (faults[test][clk_speed][test_stage], True),
+                             'Bit error map ({} - stage {}) @ {} clk factor'.format(test, test_stage, clk_speed))]
+
+        if show_plots:
+            for filename, kind, args, label in figures:
+                fig = plt.figure(label)
+                draw_functions[kind](fig, *args)
+                fig.savefig(filename)
+            plt.show()
+        elif multipage:
+            jobs += [(outdir + '/{}.pdf'.format(test), [figure[1:] for figure in figures])]
+        else:
+            jobs += [(figure[0], [figure[1:]]) for figure in figures]
+
+    if show_plots:
+        return []
+    start = time.time()
+    rendered = render_plots(jobs, cache_file=outdir + '/plot_cache.json', processes=processes)
+    c.log.info('Saved {} plot files in {:.1f}s ({} unchanged)'.format(len(rendered), time.time() - start,
+                                                                     len(jobs) - len(rendered)))
+    return rendered
 
 def main(args):
     out_dir = 'data/'+time.strftime('%Y_%m_%d')
@@ -125,9 +437,13 @@ def main(args):
     print('Available helper functions:')
     print(' list_ports() - {}'.format(list_ports))
     print(' quick_serial() - {}'.format(quick_serial))
-    print(' run_test_suite(<cryoSRAM obj>, clk_factors=[25,10,5,3,2,1]) - {}'.format(run_test_suite))
+    print(' run_test_suite(<cryoSRAM obj>, clk_factors=[25,10,5,3,2,1], checkpoint=None) - {}'.format(run_test_suite))
     print(' run_clk_scan(<cryoSRAM obj>, <cryoSRAM test method>, clk_factors=[25,10,5,3,2,1]) - {}'.format(run_clk_scan))
-    print(' generate_plots(<cryoSRAM obj>, <run_test_suite results>) - {}'.format(generate_plots))
+    print(' run_shmoo(<cryoSRAM obj>, clk_factors=range(1,26), delay_factors=range(16)) - {}'.format(run_shmoo))
+    print(' generate_plots(<cryoSRAM obj>, <run_test_suite results>, multipage=False) - {}'.format(generate_plots))
+    print(' find_boards() - {}'.format(find_boards))
+    print(' run_boards(<ports or dict of name : port>, clk_factors=[25,10,5,3,2,1], store=None) - {}'.format(run_boards))
+    print(' ResultStore(filename="data/results.sqlite") - {}'.format(ResultStore))
     print('')
     print('Available objects:')
     print(' c - {}'.format(c))
@@ -137,15 +453,21 @@ def main(args):
     print('')
     print('Standard tests:')
     print(' c.serial_test() - test serial comms with fpga')
+    print(' c.negotiate_baud(baudrates=(12e6, 6e6, 4e6, 3e6, 2e6)) - switch to the fastest reliable uart rate')
+    print(' c.calibrate_delay(clk_factors=[25], filename=None) - find the shortest safe wait after each command')
+    print(' c.bisect_map(setting="clk_factor", block=1) - lowest passing clk factor (or delay) of each address')
     print(' c.mats_test() - standard MATS++ test')
     print(' c.pattern_test(test_values=[<85,1,2,4...128,170>]) - write pattern '
           ' and verify')
     print(' c.single_bit_test(test_values=[<1,2,4...128>]) - flips the specified'
           ' bits at each address')
     print(' c.rand_test(n_static=5, n_dynamic=10e3) - issues random read / writes')
+    print(' c.rand_stream(n_dynamic=1e7, seed=None) - random read / writes, yielding only faults (bounded memory)')
+    print(' c.march_test(algorithm="March C-") - march test from notation or one of {}'.format(sorted(march_algorithms.keys())))
     print('')
     print('Plotting help:')
     print(' plot_bit_error_map(fault_list, label="Bit error map", weight_by_error=False) - Show 2D histogram counting bit errors')
+    print(' plot_bit_map(bitmaps[stage], label="Bit map") - Show 2D histograms of the bit values read (BitCounts)')
     print('plot_test_scan(faults, desc, label="Test scan", xlabel="") - Plot bit and byte errors across scan')
     print('')
     print('To perform EVERYTHING, just type:')
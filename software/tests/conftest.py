@@ -0,0 +1,48 @@
+'''
+Fixtures of the host stack against an in-process `SimFPGA`
+Run from the software directory with:
+  python -m pytest -q tests
+'''
+import os
+import sys
+import logging
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cryoCMOS import CryoSRAM, CryoLogger
+from sram_sim import SimFPGA, StuckAtFault, TransitionFault, CouplingFault
+
+@pytest.fixture
+def make_board(tmp_path):
+    '''
+    Returns a function creating a `CryoSRAM` on `sim` (a new `SimFPGA` if
+    None), logging quietly to its own directory under `tmp_path`
+    Loggers are closed at the end of the test
+    '''
+    logs = []
+    def make(sim=None, log_kwargs={}, **kwargs):
+        directory = tmp_path / 'board{}'.format(len(logs))
+        directory.mkdir()
+        log = CryoLogger(directory=str(directory), **log_kwargs)
+        log.stdout.setLevel(logging.WARNING)
+        logs.append(log)
+        return CryoSRAM(io=SimFPGA() if sim is None else sim, log=log, **kwargs)
+    yield make
+    for log in logs:
+        log.close()
+
+@pytest.fixture
+def faulty_sim():
+    '''
+    Returns a function creating a `SimFPGA` with stuck-at, transition and
+    coupling faults (extra keyword arguments are passed to `SimFPGA`)
+    '''
+    def make(**kwargs):
+        return SimFPGA(faults=[StuckAtFault(addrs=[5, 200], bits=0x01, value=1), TransitionFault(addrs=[9, 10], bits=0x80),
+                               CouplingFault(aggressor=20, addrs=21, bits=0x02)], **kwargs)
+    return make
+
+@pytest.fixture
+def board(make_board):
+    return make_board()
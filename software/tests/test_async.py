@@ -0,0 +1,68 @@
+'''
+AsyncCryoSRAM with requests in flight on a pseudo-terminal
+'''
+import asyncio
+import logging
+import random
+import pytest
+from serial import Serial
+from cryoCMOS import CryoLogger
+from async_sram import AsyncCryoSRAM
+from sram_sim import PtyFPGA
+
+window = 16
+
+def requests(c, values):
+    '''
+    Queues writes and reads of `c` (a `CryoSRAM` or `AsyncCryoSRAM`)
+    Each address is read once, as a read queued behind another read of its
+    address expects the written value, not the value read before
+    Returns the result of each
+    '''
+    return [c.write_block(0, values[:256]), c.read_block(0, 8, stage='first'),
+            c.write_block(256, values[256:]), c.read_block(200, 100, stage='block')] + \
+        [c.read_block(addr, 2, stage='small') for addr in range(300, 364, 2)] + \
+        [c.set_addr(9), c.write_value(0x00), c.write_value(0xff), c.read_value(stage='value'),
+         c.read_addr(), c.set_clk(10), c.read_clk(), c.read_block(400, 32, stage='last')]
+
+@pytest.fixture
+def pty_board(tmp_path, faulty_sim):
+    pty = PtyFPGA(faulty_sim())
+    io = Serial(port=pty.port, baudrate=1e6, timeout=1)
+    log = CryoLogger(directory=str(tmp_path))
+    log.stdout.setLevel(logging.WARNING)
+    yield AsyncCryoSRAM(io=io, log=log, window=window)
+    log.close()
+    io.close()
+    pty.close()
+
+def test_async_matches_sync(make_board, faulty_sim, pty_board):
+    random.seed(0)
+    values = [random.randrange(256) for i in range(512)]
+    board = make_board(faulty_sim())
+    expected = requests(board, values)
+
+    c = pty_board
+    # the frames awaiting responses when each request is written
+    in_flight = []
+    write = c.io.write
+    def recording_write(tx_bytes):
+        in_flight.append((c.transport.in_flight_frames, len(c.transport.in_flight)))
+        return write(tx_bytes)
+    c.io.write = recording_write
+
+    async def run():
+        results = await asyncio.gather(*requests(c, values))
+        await c.close()
+        return results
+    results = asyncio.run(run())
+    assert results == expected
+    assert c.read_records == board.read_records
+    assert any([expected != read for stage, addr, expected, read in c.read_records])
+    assert c.io.in_waiting == 0
+
+    # reads were pipelined, and only a request larger than the window was
+    # in flight on its own above it
+    assert max([n_requests for frames, n_requests in in_flight]) > 1
+    assert all([frames <= window or n_requests == 0 for frames, n_requests in in_flight])
+    assert max([frames for frames, n_requests in in_flight]) == 100
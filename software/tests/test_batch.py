@@ -0,0 +1,31 @@
+'''
+Batched commands and their NOP padding
+'''
+import math
+from cryoCMOS import FrameCodec
+
+def block_padding(board, n):
+    '''
+    NOP bytes queued after a batched READ_BLOCK of `n` values
+    '''
+    board.begin_batch()
+    board.read_block(0, n)
+    frame = FrameCodec.frame(FrameCodec.READ_BLOCK, n)
+    padding = len(board.tx_buffer) - board.tx_buffer.index(frame) - len(frame)
+    board.end_batch()
+    return padding
+
+def test_fresh_board_pads_for_reset_delay(make_board):
+    # no set_delay: the host must assume the fpga reset value
+    board = make_board()
+    assert board.delay_factor == board.io.read_delay == 4
+    byte_time = board._byte_time()
+    cycle_time = (4*board.clk_factor + 2 + 4)/board.fpga_clk
+    expected = int(math.ceil(512*(cycle_time + byte_time)/byte_time)) + board.pad_margin
+    assert block_padding(board, 512) == expected
+    assert block_padding(board, 512) > block_padding(make_board(delay_factor=0), 512)
+
+def test_padding_matches_set_delay(make_board):
+    board = make_board()
+    board.set_delay(4)
+    assert block_padding(make_board(), 100) == block_padding(board, 100)
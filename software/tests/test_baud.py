@@ -0,0 +1,49 @@
+'''
+SET_BAUD and baud rate negotiation against the simulated fpga
+'''
+import time
+import pytest
+from sram_sim import SimFPGA
+
+baud_timeout = 0.05 # [s] shortened on both sides so the tests are quick
+
+def make_baud_board(make_board, **sim_kwargs):
+    sim = SimFPGA(**sim_kwargs)
+    sim.baud_timeout = baud_timeout
+    board = make_board(sim)
+    board.baud_timeout = baud_timeout
+    return board
+
+# 12 MBaud runs at 12.5 MBaud on the fpga, outside the sim's `baud_tolerance`
+@pytest.mark.parametrize('max_baudrate, baudrate', [(None, 6e6), (4e6, 4e6), (1.5e6, 1e6)])
+def test_negotiate_baud(make_board, max_baudrate, baudrate):
+    board = make_baud_board(make_board, max_baudrate=max_baudrate)
+    assert board.negotiate_baud() == baudrate
+    assert board.io.baudrate == board.baudrate == baudrate
+    time.sleep(2*baud_timeout)
+    # the new rate was confirmed, so the fpga keeps it
+    assert board.io.confirmed_baudrate == board.io.fpga_baudrate
+    assert board.io.fpga_baudrate == pytest.approx(baudrate, rel=board.io.baud_tolerance)
+    faults, bitmaps = board.serial_test()
+    assert not len(faults['serial'])
+
+def test_unconfirmed_baud_reverts(make_board):
+    board = make_baud_board(make_board)
+    board.set_baud(4e6, confirm=False)
+    assert board.io.fpga_baudrate == 4e6
+    time.sleep(2*baud_timeout)
+    board.set_baud(1e6, confirm=False) # back on the host side only
+    assert board.io.fpga_baudrate == board.io.confirmed_baudrate == 1e6
+    assert board.read_clk() == 25
+
+def test_set_baud_confirmed(make_board):
+    board = make_baud_board(make_board)
+    board.set_baud(2e6)
+    time.sleep(2*baud_timeout)
+    assert board.io.confirmed_baudrate == 2e6
+    board.write_block(0, [0x5a]*8)
+    assert board.read_block(0, 8) == [0x5a]*8
+
+def test_set_baud_above_limit(board):
+    with pytest.raises(ValueError):
+        board.set_baud(board.fpga_clk/board.min_baud_divider*1.2)
@@ -0,0 +1,67 @@
+'''
+The benchmark suite and its regression flags against a saved baseline
+'''
+import json
+import pytest
+import benchmark
+
+@pytest.fixture
+def small_suite(monkeypatch):
+    '''
+    Replaces the suite with a few quick cases
+    '''
+    cases = {
+        'codec decode': benchmark.codec_case('decode', n=2000),
+        'codec encode': benchmark.codec_case('encode', n=2000),
+        'logger binary': benchmark.logger_case(n=500, binary=True),
+    }
+    monkeypatch.setattr(benchmark, 'suite_cases', lambda: dict(cases))
+    return cases
+
+def test_measure():
+    results = benchmark.measure(benchmark.codec_case('decode', n=1000), repeat=2)
+    assert results['ops'] == 1000 and results['ops_per_s'] == pytest.approx(1000/results['seconds'])
+    assert results['peak_bytes'] > 0 and results['allocations'] >= 0
+
+def test_regressions_flagged(small_suite, tmp_path, capsys):
+    filename = str(tmp_path / 'baseline.json')
+    results, regressions = benchmark.bench_suite(save=True, filename=filename)
+    assert regressions == [] and 'Saved baseline' in capsys.readouterr().out
+    with open(filename) as f:
+        baseline = json.load(f)
+    assert sorted(baseline.keys()) == sorted(small_suite.keys())
+
+    # a baseline far slower or larger than any run is never a regression
+    for name in baseline:
+        baseline[name]['ops_per_s'] /= 100
+        baseline[name]['peak_bytes'] *= 100
+    # a much faster baseline flags throughput, a much smaller one flags memory
+    baseline['codec decode']['ops_per_s'] *= 1e6
+    baseline['logger binary']['peak_bytes'] /= 1e6
+    # cases without a baseline are not flagged
+    del baseline['codec encode']
+    with open(filename, 'w') as f:
+        json.dump(baseline, f)
+    results, regressions = benchmark.bench_suite(filename=filename)
+    assert sorted(regressions) == ['codec decode', 'logger binary']
+    out = capsys.readouterr().out
+    assert out.count('REGRESSION') == 2 and '2 regressions' in out
+    # the baseline is only written with `save`
+    with open(filename) as f:
+        assert json.load(f) == baseline
+
+def test_tolerance(small_suite, tmp_path):
+    filename = str(tmp_path / 'baseline.json')
+    results = benchmark.bench_suite(save=True, filename=filename)[0]
+    with open(filename) as f:
+        baseline = json.load(f)
+    # 3x the measured throughput is a regression only with a tight tolerance
+    baseline['codec decode']['ops_per_s'] = 3*results['codec decode']['ops_per_s']
+    with open(filename, 'w') as f:
+        json.dump(baseline, f)
+    assert 'codec decode' in benchmark.bench_suite(tolerance=0.3, filename=filename)[1]
+    assert 'codec decode' not in benchmark.bench_suite(tolerance=0.9, filename=filename)[1]
+
+def test_missing_baseline(small_suite, tmp_path):
+    results, regressions = benchmark.bench_suite(filename=str(tmp_path / 'none.json'))
+    assert regressions == [] and sorted(results.keys()) == sorted(small_suite.keys())
@@ -0,0 +1,41 @@
+'''
+Per-block limits found by bisect_map against per-address timing faults
+'''
+import numpy as np
+from sram_sim import SimFPGA, TimingFault
+
+def test_bisect_clk_factor(make_board):
+    # block : slowest clk factor that fails (255 fails everywhere)
+    limits = {0: 4, 1: 11, 3: 29, 7: 255}
+    faults = [TimingFault(addrs=range(64*block, 64*block + 64), bits=0x10, min_clk_factor=limit + 1)
+              for block, limit in limits.items()]
+    # one weak address sets the limit of its block
+    faults += [TimingFault(addrs=200, bits=0x01, min_clk_factor=40)]
+    board = make_board(SimFPGA(faults=faults))
+    board.set_clk(25)
+    checks = []
+    check_blocks = board._check_blocks
+    def counting_check_blocks(*args):
+        checks.append(1)
+        return check_blocks(*args)
+    board._check_blocks = counting_check_blocks
+    result = board.bisect_map('clk_factor', block=64)
+
+    expected = np.ones(512, dtype=int)
+    for block, limit in limits.items():
+        expected[64*block:64*block + 64] = limit + 1
+    expected[192:256] = 40
+    expected[448:512] = -1
+    assert result.tolist() == expected.tolist()
+    # each step checks the blocks testing one value together
+    assert len(checks) <= 1 + 8*len(np.unique(expected))
+    assert board.io.clk_factor == board.clk_factor == 25
+
+def test_bisect_delay_factor(make_board):
+    faults = [TimingFault(addrs=range(0, 100), bits=0x80, min_delay=3),
+              TimingFault(addrs=range(300, 400), bits=0x02, min_delay=9)]
+    board = make_board(SimFPGA(faults=faults))
+    result = board.bisect_map('delay_factor', values=range(0, 16), block=100)
+    # the last 12 addresses are not in a full block
+    assert result.tolist() == [3]*100 + [0]*200 + [9]*100 + [0]*100 + [-1]*12
+    assert board.io.read_delay == board.delay_factor == 4
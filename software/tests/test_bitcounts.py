@@ -0,0 +1,46 @@
+'''
+BitCounts accumulation and the collection of read records at each flush
+'''
+import numpy as np
+from bitcounts import BitCounts, merge_counts
+from sram_sim import SimFPGA, StuckAtFault
+
+def test_add():
+    counts = BitCounts(4)
+    counts.add([1, 1, 2, 3], [0x81, 0x80, None, 0x00], [0x80, 0x80, 0x00, None])
+    assert len(counts) == 3
+    assert counts.ones[1].tolist() == [2, 0, 0, 0, 0, 0, 0, 1]
+    assert counts.zeros[1].tolist() == [0, 2, 2, 2, 2, 2, 2, 1]
+    assert counts.errors_01[1].tolist() == [0]*7 + [1]
+    assert counts.errors_10.sum() == 0
+    assert counts.zeros[3].tolist() == [1]*8
+
+def test_merge():
+    rng = np.random.default_rng(0)
+    addrs, reads, expected = rng.integers(0, 16, (3, 1000))
+    expected[::2] = reads[::2]
+    total = BitCounts(16)
+    total.add(addrs, reads, expected)
+    parts = [BitCounts(16), BitCounts(16)]
+    parts[0].add(addrs[:400], reads[:400], expected[:400])
+    parts[1].add(addrs[400:], reads[400:], expected[400:])
+    assert merge_counts(parts) == total
+    assert int(total.errors_01.sum() + total.errors_10.sum()) == \
+        int(np.unpackbits((reads ^ expected).astype(np.uint8)).sum())
+
+def test_records_collected_at_flush(make_board):
+    board = make_board(SimFPGA(faults=[StuckAtFault(addrs=7, bits=0x01, value=1)]))
+    board.max_batch_bytes = 256
+    flushes = []
+    collect_records = board.collect_records
+    def counting_collect_records(read_records, faults, bitmaps):
+        flushes.append(len(read_records))
+        collect_records(read_records, faults, bitmaps)
+    board.collect_records = counting_collect_records
+    faults, bitmaps = board.rand_test(n_static=1, n_dynamic=2000)
+    assert len(flushes) > 10 and max(flushes) <= 512
+    assert not len(board.read_records)
+    assert len(bitmaps['rand_static']) == 512
+    assert len(bitmaps['rand_dynamic']) == sum(flushes) - 512
+    assert all([addr == 7 and read == expected | 0x01
+                for addr, expected, read in faults['rand_static'] + faults['rand_dynamic']])
@@ -0,0 +1,46 @@
+'''
+WRITE_BLOCK and READ_BLOCK transfers against the simulated fpga
+'''
+import numpy as np
+import pytest
+from sram_sim import SimFPGA, StuckAtFault
+
+def test_write_read_block(board):
+    values = list(range(100, 140))
+    board.write_block(490, values) # wraps to address 17
+    addrs = (490 + np.arange(len(values))) % 512
+    assert board.io.memory[addrs].tolist() == values
+    assert board.read_block(490, len(values)) == values
+    assert board.curr_addr == board.fpga_addr == 18
+
+def test_block_longer_than_memory(board):
+    values = np.random.default_rng(0).integers(0, 256, 512).tolist()
+    board.write_block(0, values)
+    assert board.read_block(0, 600) == values + values[:88]
+
+def test_block_batched(make_board):
+    board = make_board(SimFPGA(faults=[StuckAtFault(addrs=7, bits=0x01, value=1)]))
+    board.begin_batch()
+    board.write_block(0, [0x10]*16)
+    assert board.read_block(0, 16, stage='check') is None
+    records = board.end_batch()
+    assert [record[1] for record in records] == list(range(16))
+    assert [record[3] for record in records] == [0x10]*7 + [0x11] + [0x10]*8
+    assert all([record[2] == 0x10 for record in records])
+
+def test_block_transfers_off(make_board):
+    boards = [make_board(block_transfers=block_transfers) for block_transfers in (True, False)]
+    for board in boards:
+        board.write_block(300, [0xa5, 0x5a]*10)
+    assert np.array_equal(boards[0].io.memory, boards[1].io.memory)
+    assert boards[0].read_block(300, 20) == boards[1].read_block(300, 20)
+    assert boards[0].io.n_frames < boards[1].io.n_frames
+
+@pytest.mark.parametrize('start', [-1, 512])
+def test_start_out_of_range(board, start):
+    with pytest.raises(ValueError):
+        board.set_addr(start)
+    with pytest.raises(ValueError):
+        board.write_block(start, [0])
+    with pytest.raises(ValueError):
+        board.read_block(start, 1)
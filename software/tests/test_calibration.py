@@ -0,0 +1,59 @@
+'''
+Delay calibration against the simulated fpga at wall clock time
+'''
+import pytest
+from cryoCMOS import CryoSRAM
+from sram_sim import SimFPGA, TimingFault
+
+opcodes = (CryoSRAM.WRITE_VAL, CryoSRAM.READ_VAL)
+
+def timing_board(make_board):
+    # reads of bit 2 fail below clk factor 3, and bytes sent while the fpga
+    # is busy are dropped
+    board = make_board(SimFPGA(wallclock=True, faults=[TimingFault(bits=0x04, min_clk_factor=3)]))
+    board.rw_delay = 1e-4 # [s] shortened so the search is quick
+    return board
+
+def test_calibrate_delay(make_board, tmp_path):
+    board = timing_board(make_board)
+    filename = str(tmp_path / 'delays.json')
+    results = board.calibrate_delay(clk_factors=[25, 100, 2], opcodes=opcodes, n=16, n_check=64, filename=filename)
+    sim = board.io
+    for clk_factor in (25, 100):
+        sim.clk_factor = clk_factor
+        assert board.rw_delays[CryoSRAM.WRITE_VAL, clk_factor] >= sim.write_cycle_time()
+        assert board.rw_delays[CryoSRAM.READ_VAL, clk_factor] >= sim.read_cycle_time()
+        for opcode in opcodes:
+            delay, error_rate, speedup = results[opcode, clk_factor]
+            assert delay == board.rw_delays[opcode, clk_factor] < board.rw_delay
+            assert error_rate == 0
+    # reads fail at any wait at clk factor 2
+    assert sorted(board.rw_delays.keys()) == sorted([(opcode, clk) for opcode in opcodes for clk in (25, 100)])
+
+    loaded = make_board()
+    loaded.load_delays(filename)
+    assert loaded.rw_delays == board.rw_delays
+    assert make_board(rw_delays=filename).rw_delays == board.rw_delays
+
+@pytest.mark.parametrize('fail', [False, True])
+def test_calibrate_restores_state(make_board, fail):
+    board = timing_board(make_board)
+    board.set_clk(10)
+    board.optimize = False
+    board.begin_batch()
+    board.write_block(0, [1, 2, 3])
+    if fail:
+        def failing_errors(*args, **kwargs):
+            raise RuntimeError('serial error')
+        board._calibration_errors = failing_errors
+        with pytest.raises(RuntimeError):
+            board.calibrate_delay(clk_factors=[25], opcodes=opcodes, n=4, n_check=8)
+    else:
+        board.calibrate_delay(clk_factors=[25], opcodes=opcodes, n=4, n_check=8)
+    assert board.batching and not board.optimize
+    assert board.clk_factor == 10
+    board.end_batch()
+    assert board.io.clk_factor == board.read_clk() == 10
+    if fail:
+        # the queued block was sent before the first calibration trial
+        assert board.io.memory[:3].tolist() == [1, 2, 3]
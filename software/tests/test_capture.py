@@ -0,0 +1,63 @@
+'''
+Binary captures written through the background writer of `CryoLogger`
+'''
+import os
+import gzip
+import logging
+import numpy as np
+import pytest
+import capture
+from cryoCMOS import CryoLogger
+
+def make_logger(tmp_path, **kwargs):
+    log = CryoLogger(directory=str(tmp_path), binary=True, async_flush=True, **kwargs)
+    log.stdout.setLevel(logging.WARNING)
+    return log
+
+def random_calls(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(int(rng.integers(2)), rng.integers(0, 256, int(rng.integers(1, 40)), dtype=np.uint8).tobytes())
+            for k in range(n)]
+
+@pytest.mark.parametrize('max_buffer_len', [16, 10000])
+def test_async_binary_round_trip(tmp_path, max_buffer_len):
+    # with a large buffer nothing is handed off until close()
+    log = make_logger(tmp_path, max_buffer_len=max_buffer_len)
+    calls = random_calls(500)
+    for direction, data in calls:
+        log.store_msg(direction, data)
+    if max_buffer_len > len(calls):
+        assert log.writer_stats()['written'] == 0
+    log.close()
+    assert log.writer_stats()['written'] == len(calls) and log.writer_stats()['dropped'] == 0
+
+    records = capture.load_capture(os.path.join(log.directory, log.dat_filename))
+    assert len(records) == sum([(len(data) + 1)//2 for direction, data in calls])
+    assert np.all(np.diff(records['time']) >= 0)
+    for direction in (capture.TX, capture.RX):
+        assert capture.capture_bytes(records, direction) == \
+            b''.join([data for call_direction, data in calls if call_direction == direction])
+
+def test_async_binary_exports_csv(tmp_path):
+    log = make_logger(tmp_path, max_buffer_len=16)
+    calls = random_calls(50)
+    for direction, data in calls:
+        log.store_msg(direction, data)
+    log.close()
+    with gzip.open(log.export_csv(), 'rt') as f:
+        rows = [line.rstrip('\n').split(', ') for line in f]
+    # consecutive calls in one direction at the same time share a row
+    assert ''.join([bits for row in rows for bits in row[2:]]) == ''.join([CryoLogger.to01(data) for direction, data in calls])
+    assert all([row[1] in capture.directions for row in rows])
+
+def test_board_capture_matches_sync(make_board, faulty_sim):
+    boards = [make_board(faulty_sim(), log_kwargs=dict(binary=True, async_flush=async_flush, max_buffer_len=64))
+              for async_flush in (False, True)]
+    streams = []
+    for board in boards:
+        board.mats_test()
+        board.log.close()
+        records = capture.load_capture(os.path.join(board.log.directory, board.log.dat_filename))
+        streams.append([capture.capture_bytes(records, direction) for direction in (capture.TX, capture.RX)])
+    assert streams[0] == streams[1]
+    assert len(streams[0][0]) and len(streams[0][1])
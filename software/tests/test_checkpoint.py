@@ -0,0 +1,72 @@
+'''
+Checkpoint and resume of run_test_suite
+'''
+import os
+import random
+import pytest
+from test_suite import run_board, run_test_suite, Checkpoint
+
+clk_factors = [25, 10]
+
+def test_resume_matches_uninterrupted(make_board, faulty_sim, tmp_path):
+    random.seed(1)
+    reference = run_test_suite(make_board(faulty_sim()), clk_factors=clk_factors)
+
+    # interrupt the suite in the second unit of rand_test
+    random.seed(1)
+    board = make_board(faulty_sim())
+    rand_test = board.rand_test
+    calls = []
+    def interrupted_rand_test(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise RuntimeError('serial error')
+        return rand_test(*args, **kwargs)
+    interrupted_rand_test.__name__ = 'rand_test'
+    board.rand_test = interrupted_rand_test
+    filename = str(tmp_path / 'checkpoint.pkl')
+    with pytest.raises(RuntimeError):
+        run_test_suite(board, clk_factors=clk_factors, checkpoint=filename)
+    checkpoint = Checkpoint(filename)
+    assert len(checkpoint.completed) == 3*len(clk_factors) + 1
+    assert checkpoint.done('rand_test', 25) and not checkpoint.done('rand_test', 10)
+    assert not os.path.exists(filename + '.tmp')
+
+    # a new board (and python session) resumes with the same results
+    random.seed(2)
+    board = make_board(faulty_sim())
+    resumed = run_test_suite(board, clk_factors=clk_factors, checkpoint=filename)
+    assert resumed == reference
+    assert not os.path.exists(filename)
+
+def test_completed_suite_reruns(make_board, faulty_sim, tmp_path):
+    filename = str(tmp_path / 'checkpoint.pkl')
+    board = make_board(faulty_sim())
+    run_test_suite(board, clk_factors=clk_factors, checkpoint=filename)
+    assert not os.path.exists(filename)
+    n_frames = board.io.n_frames
+    # a second run repeats every unit rather than returning the saved results
+    run_test_suite(board, clk_factors=clk_factors, checkpoint=filename)
+    assert board.io.n_frames > 1.9*n_frames
+    assert not os.path.exists(filename)
+
+def test_run_board_resume_removes_checkpoint(faulty_sim, tmp_path):
+    faults, bitmaps = run_board('board', faulty_sim(), str(tmp_path), clk_factors=[25], resume=True,
+                                calibration_dir=str(tmp_path / 'calibration'))
+    assert faults['mats_test'][25]['0 -> 1']
+    assert not os.path.exists(str(tmp_path / 'board' / 'checkpoint.pkl'))
+
+def test_checkpoint_restore(board, tmp_path):
+    filename = str(tmp_path / 'checkpoint.pkl')
+    board.write_block(0, list(range(256))*2)
+    random.seed(3)
+    state = random.getstate()
+    Checkpoint(filename).save(board, 'pattern_test', 25, {'pattern': []}, {})
+    random.seed(4)
+    board.memory.invalidate()
+    checkpoint = Checkpoint(filename)
+    checkpoint.restore(board)
+    assert random.getstate() == state
+    assert board.memory.get_block(range(512)) == list(range(256))*2
+    assert board.fpga_addr is None
+    assert checkpoint.faults == {'pattern_test': {25: {'pattern': []}}}
@@ -0,0 +1,40 @@
+'''
+FrameCodec encoding and decoding round trips
+'''
+import numpy as np
+from cryoCMOS import FrameCodec
+
+def test_encode_decode_round_trip():
+    rng = np.random.default_rng(0)
+    opcodes = rng.integers(0, 16, 1000)
+    messages = rng.integers(0, 2**12, 1000)
+    decoded_opcodes, decoded_messages = FrameCodec.decode(FrameCodec.encode(opcodes, messages))
+    assert np.array_equal(decoded_opcodes, opcodes)
+    assert np.array_equal(decoded_messages, messages)
+
+def test_encode_matches_frame():
+    opcodes = [FrameCodec.SET_ADDR, FrameCodec.WRITE_VAL, FrameCodec.READ_BLOCK, FrameCodec.SET_BAUD]
+    messages = [0x1ff, 0xa5, 0xfff, 8]
+    frames = b''.join([FrameCodec.frame(opcode, message) for opcode, message in zip(opcodes, messages)])
+    assert FrameCodec.encode(opcodes, messages) == frames
+
+def test_encode_pad():
+    data = FrameCodec.encode([FrameCodec.SET_ADDR, FrameCodec.READ_VAL], [3, 0], pad=[2, 1])
+    assert data == FrameCodec.frame(FrameCodec.SET_ADDR, 3) + b'\x00'*2 + FrameCodec.READ_VAL_FRAME + b'\x00'
+
+def test_frame_tables():
+    assert FrameCodec.SET_ADDR_FRAMES[0x123] == FrameCodec.frame(FrameCodec.SET_ADDR, 0x123)
+    assert FrameCodec.WRITE_VAL_FRAMES[0xff] == bytes([0x20, 0xff])
+    assert FrameCodec.READ_VAL_FRAME == bytes([0x40, 0x00])
+
+def test_decode_message():
+    assert FrameCodec.decode_message(FrameCodec.frame(FrameCodec.READ_ADDR, 0x1ab)) == 0x1ab
+    assert FrameCodec.decode_message(b'\x30') is None
+
+def test_decode_responses():
+    opcodes = [FrameCodec.READ_ADDR, FrameCodec.READ_VAL] + [FrameCodec.READ_BLOCK]*3 + [FrameCodec.READ_CLK]
+    read_bytes = FrameCodec.frame(FrameCodec.READ_ADDR, 0x1ff) + FrameCodec.frame(FrameCodec.READ_VAL, 0x42) + \
+        bytes([1, 2, 3]) + FrameCodec.frame(FrameCodec.READ_CLK, 25)
+    assert FrameCodec.decode_responses(read_bytes, opcodes) == [0x1ff, 0x42, 1, 2, 3, 25]
+    # missing responses are None
+    assert FrameCodec.decode_responses(read_bytes[:5], opcodes) == [0x1ff, 0x42, 1, None, None, None]
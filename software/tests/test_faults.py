@@ -0,0 +1,76 @@
+'''
+The fault models of the simulated SRAM
+'''
+import pytest
+from sram_sim import SimFPGA, StuckAtFault, TransitionFault, CouplingFault, TimingFault
+
+def write(sim, addr, value):
+    sim.address = addr
+    sim.sram_write(value)
+
+def read(sim, addr):
+    sim.address = addr
+    return sim.sram_read()
+
+@pytest.mark.parametrize('value, written, stored', [(1, 0x00, 0x81), (0, 0xff, 0x7e)])
+def test_stuck_at(value, written, stored):
+    sim = SimFPGA(faults=[StuckAtFault(addrs=[3, 4], bits=0x81, value=value)])
+    for addr in (2, 3, 4):
+        write(sim, addr, written)
+    assert [read(sim, addr) for addr in (2, 3, 4)] == [written, stored, stored]
+    # the bits also read stuck if the memory was changed underneath
+    sim.memory[3] = written
+    assert read(sim, 3) == stored
+
+def test_stuck_at_every_address():
+    sim = SimFPGA(faults=[StuckAtFault(bits=0x10, value=1)])
+    assert all([read(sim, addr) == 0x10 for addr in range(sim.n_addr)])
+
+@pytest.mark.parametrize('rising', [True, False])
+def test_transition(rising):
+    sim = SimFPGA(faults=[TransitionFault(addrs=9, bits=0x80, rising=rising)])
+    start = 0x00 if rising else 0xff
+    for addr in (9, 10):
+        write(sim, addr, start)
+        write(sim, addr, start ^ 0xff)
+    # only the faulty transition of bit 7 fails, the other bits change
+    assert read(sim, 9) == (start ^ 0x7f) and read(sim, 10) == start ^ 0xff
+    write(sim, 9, start ^ 0x80)
+    # the reverse transition is fine
+    write(sim, 11, start ^ 0xff)
+    write(sim, 11, start)
+    assert read(sim, 11) == start
+
+@pytest.mark.parametrize('rising, value, transition, victim', [
+    (None, 1, (0x00, 0x01), 0x02), (None, 1, (0x01, 0x00), 0x02), (True, 1, (0x01, 0x00), 0x00),
+    (False, 1, (0x01, 0x00), 0x02), (None, 0, (0x00, 0x01), 0x00), (None, 1, (0x00, 0x80), 0x00)])
+def test_coupling(rising, value, transition, victim):
+    sim = SimFPGA(faults=[CouplingFault(aggressor=20, addrs=21, bits=0x02, aggressor_bits=0x01, rising=rising,
+                                        value=value)])
+    write(sim, 20, transition[0])
+    write(sim, 21, 0x00 if value else 0x02)
+    write(sim, 20, transition[1])
+    assert read(sim, 20) == transition[1]
+    assert read(sim, 21) == victim
+
+def test_coupling_spares_aggressor():
+    sim = SimFPGA(faults=[CouplingFault(aggressor=20, addrs=None, bits=0x40)])
+    write(sim, 20, 0x01)
+    assert read(sim, 20) == 0x01
+    assert all([read(sim, addr) == 0x40 for addr in range(sim.n_addr) if addr != 20])
+
+def test_timing():
+    sim = SimFPGA(faults=[TimingFault(addrs=5, bits=0x0c, min_clk_factor=10, min_delay=3),
+                          TimingFault(addrs=6, bits=0x01, min_clk_factor=10, value=1, write_fails=True)])
+    for addr in (5, 6, 7):
+        write(sim, addr, 0xfc)
+    sim.clk_factor, sim.read_delay = 10, 3
+    assert [read(sim, addr) for addr in (5, 6, 7)] == [0xfc, 0xfc, 0xfc]
+    sim.read_delay = 2
+    assert read(sim, 5) == 0xf0
+    sim.clk_factor, sim.read_delay = 9, 4
+    assert [read(sim, addr) for addr in (5, 6, 7)] == [0xf0, 0xfd, 0xfc]
+    # too fast a write leaves the bits of addr 6 unchanged
+    write(sim, 6, 0x03)
+    sim.clk_factor = 10
+    assert read(sim, 6) == 0x02
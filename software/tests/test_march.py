@@ -0,0 +1,38 @@
+'''
+March notation parsing and formatting
+'''
+import pytest
+from march import parse_march, format_march, decode_march, march_algorithms
+
+def without_stages(march):
+    return [(direction, [op[:2] for op in ops]) for direction, ops in march]
+
+@pytest.mark.parametrize('name', sorted(march_algorithms.keys()))
+@pytest.mark.parametrize('background', [0x00, 0x55])
+def test_format_parse_round_trip(name, background):
+    march = parse_march(name, background)
+    parsed = parse_march(format_march(march))
+    assert without_stages(parsed) == without_stages(march)
+    assert format_march(parsed) == format_march(march)
+
+@pytest.mark.parametrize('name', sorted(march_algorithms.keys()))
+def test_formatted_matches_program(board, name):
+    # hex values are named as in fpga programs
+    march = parse_march(name, 0x33)
+    assert decode_march(board.encode_march(march)) == parse_march(format_march(march))
+
+def test_parse():
+    march = parse_march('⇕(w0); ^(r0, w1); down(R1,w0); ↕(r0)', background=0x0f)
+    assert march == [
+        (1, [('w', 0x0f)]),
+        (1, [('r', 0x0f, 'M1.0 r0'), ('w', 0xf0)]),
+        (-1, [('r', 0xf0, 'M2.0 r1'), ('w', 0x0f)]),
+        (1, [('r', 0x0f, 'M3.0 r0')]),
+    ]
+    assert parse_march('⇑(w5a,ra5)') == [(1, [('w', 0x5a), ('r', 0xa5, 'M0.1 ra5')])]
+    assert format_march(march) == '⇑(w0f); ⇑(r0f,wf0); ⇓(rf0,w0f); ⇑(r0f)'
+
+@pytest.mark.parametrize('notation', ['⇑(w2)', 'sideways(w0)', '⇑(w0', '⇑(x0)', '⇑(w0,)', '⇑(w123)'])
+def test_parse_errors(notation):
+    with pytest.raises(ValueError):
+        parse_march(notation)
@@ -0,0 +1,32 @@
+'''
+MARCH programs run by the simulated fpga against the host engine
+'''
+import numpy as np
+import pytest
+from march import parse_march
+
+@pytest.mark.parametrize('algorithm', ['MATS+', 'March C-', 'March SS'])
+def test_fpga_matches_host(make_board, faulty_sim, algorithm):
+    march = parse_march(algorithm)
+    results = {}
+    for engine in ('host', 'fpga'):
+        board = make_board(faulty_sim())
+        faults, bitmaps = board.run_march(march, engine=engine)
+        results[engine] = (faults, bitmaps, board.io.memory.copy(), board.memory.values.copy())
+    host, fpga = results['host'], results['fpga']
+    assert any([len(stage_faults) for stage_faults in host[0].values()])
+    assert host[0] == fpga[0]
+    assert host[1] == fpga[1]
+    assert np.array_equal(host[2], fpga[2])
+    assert np.array_equal(host[3], fpga[3])
+
+def test_fpga_march_frames(board):
+    board.run_march(parse_march('March C-'), engine='fpga')
+    # one MARCH frame and its program, instead of frames for each address
+    assert board.io.n_frames < 10
+
+def test_march_too_long(board):
+    with pytest.raises(ValueError):
+        board.encode_march([(1, [('w', 0)])]*(board.max_march_elements + 1))
+    with pytest.raises(ValueError):
+        board.encode_march([(1, [('r', 0, 'r0')]*(board.max_march_ops + 1))])
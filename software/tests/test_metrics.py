@@ -0,0 +1,96 @@
+'''
+Metrics counters of the CryoSRAM command path and logger flushes
+'''
+import json
+import pytest
+from metrics import Metrics
+from cryoCMOS import FrameCodec
+
+def test_command_counters():
+    metrics = Metrics(1e-4, {1: 'ONE'})
+    metrics.command(1, tx_bytes=2, rx_bytes=2, rx_expected=2, seconds=1e-3)
+    metrics.command(1, tx_bytes=2, rx_bytes=1, rx_expected=2, seconds=3e-2)
+    metrics.command(1)
+    metrics.command(2, tx_bytes=2)
+    metrics.sleep(0.5)
+    metrics.flush(0.25, 100)
+    summary = metrics.summary()
+    one = summary['commands']['ONE']
+    assert (one['count'], one['tx_bytes'], one['rx_bytes'], one['short_reads'], one['missing_bytes'], one['timed']) == \
+        (3, 4, 3, 1, 1, 2)
+    assert one['mean_latency'] == pytest.approx(1.55e-2) and one['max_latency'] == 3e-2
+    assert summary['commands']['2']['mean_latency'] is None and summary['commands']['2']['p99_latency'] is None
+    assert (summary['frames'], summary['tx_bytes'], summary['rx_bytes'], summary['short_reads']) == (4, 6, 3, 1)
+    assert (summary['sleeps'], summary['sleep_time']) == (1, 0.5)
+    assert (summary['log_flushes'], summary['log_flush_time'], summary['log_flush_records']) == (1, 0.25, 100)
+    metrics.reset()
+    assert metrics.summary()['commands'] == {} and metrics.summary()['sleeps'] == 0
+
+def test_latency_histogram():
+    metrics = Metrics(1e-4)
+    for seconds in [1e-7, 2e-6, 2e-6, 2e-6, 5e-3, 100.]:
+        metrics.command('key', seconds=seconds)
+    hist = metrics.summary()['commands']['key']['histogram']
+    edges = metrics.bin_edges()
+    assert sum(hist) == 6 and len(hist) == len(edges) == metrics.n_bins
+    # each latency is in the bin below its upper edge, longer ones in the last bin
+    assert hist[0] == 1 and hist[-1] == 1 and hist[metrics._bin(2e-6)] == 3
+    assert edges[metrics._bin(5e-3) - 1] <= 5e-3 < edges[metrics._bin(5e-3)]
+    assert metrics.percentile(hist, 50) == edges[metrics._bin(2e-6)]
+    assert metrics.percentile(hist, 99) == edges[-1]
+
+def test_board_counters(make_board, tmp_path):
+    board = make_board(metrics=True)
+    board.metrics.reset()
+    board.set_addr(3)
+    board.write_value(0x5a)
+    assert board.read_value() == 0x5a
+    board.set_addr(3) # already set, so not sent
+    summary = board.metrics.summary()
+    commands = summary['commands']
+    assert [commands[FrameCodec.names[opcode]]['count'] for opcode in (board.SET_ADDR, board.WRITE_VAL, board.READ_VAL)] \
+        == [1, 1, 1]
+    assert summary['frames'] == 3 and summary['tx_bytes'] == 6 and summary['rx_bytes'] == 2
+    assert summary['sleeps'] == 3 and summary['sleep_time'] == pytest.approx(3*board.rw_delay)
+    assert commands['READ_VAL']['timed'] == 1 and commands['READ_VAL']['mean_latency'] >= board.rw_delay
+
+    board.metrics.save(str(tmp_path / 'metrics.json'))
+    with open(str(tmp_path / 'metrics.json')) as f:
+        assert json.load(f)['commands']['READ_VAL']['count'] == 1
+
+def test_batch_counters(make_board):
+    board = make_board(metrics=True)
+    board.metrics.reset()
+    board.begin_batch()
+    for addr in range(10):
+        board.set_addr(addr)
+        board.write_value(addr)
+        board.read_value(stage='read')
+    board.end_batch()
+    commands = board.metrics.summary()['commands']
+    assert [commands[name]['count'] for name in ('SET_ADDR', 'WRITE_VAL', 'READ_VAL', 'batch')] == [10, 10, 10, 1]
+    # queued commands are not timed, the batch is
+    assert commands['READ_VAL']['timed'] == 0 and commands['batch']['timed'] == 1
+    assert commands['batch']['rx_bytes'] == 20 and commands['batch']['short_reads'] == 0
+    assert board.metrics.summary()['frames'] == 30
+
+def test_short_reads(make_board):
+    board = make_board(metrics=True)
+    board.metrics.reset()
+    read = board.io.read
+    board.io.read = lambda n: read(n)[:1]
+    board.read_value()
+    commands = board.metrics.summary()['commands']
+    assert commands['READ_VAL']['short_reads'] == 1 and commands['READ_VAL']['missing_bytes'] == 1
+
+@pytest.mark.parametrize('log_kwargs', [dict(max_buffer_len=10), dict(binary=True, max_buffer_len=10),
+                                        dict(async_flush=True, max_buffer_len=10)])
+def test_log_flushes(make_board, log_kwargs):
+    board = make_board(log_kwargs=log_kwargs, metrics=True)
+    board.metrics.reset()
+    for addr in range(20):
+        board.set_addr(addr)
+        board.write_value(addr)
+    board.log.flush_buffer()
+    summary = board.metrics.summary()
+    assert summary['log_flushes'] >= 2 and summary['log_flush_records'] >= 40
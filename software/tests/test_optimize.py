@@ -0,0 +1,19 @@
+'''
+Dropping redundant SET_ADDR frames (optimize) against sending them all
+'''
+import random
+import pytest
+from test_suite import run_test_suite
+
+@pytest.mark.parametrize('engine', ['host', 'fpga'])
+def test_optimize_same_faults(make_board, faulty_sim, engine):
+    results = {}
+    for optimize in (False, True):
+        random.seed(0)
+        board = make_board(faulty_sim(), engine=engine, optimize=optimize)
+        results[optimize] = run_test_suite(board, clk_factors=[25, 5]), board.io.n_frames, board.io.n_dropped
+    assert results[True][0] == results[False][0]
+    assert results[True][1] < results[False][1]
+    assert results[True][2] == results[False][2] == 0
+    faults, bitmaps = results[True][0]
+    assert any([len(stage_faults) for stage_faults in faults['mats_test'][25].values()])
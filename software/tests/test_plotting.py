@@ -0,0 +1,100 @@
+'''
+Bit error and bit map histograms against the original per-byte string path
+'''
+import os
+import numpy as np
+import pytest
+import plotting
+from benchmark import string_bit_errors, string_bit_map
+from bitcounts import BitCounts
+from test_suite import generate_plots
+
+bins = [np.linspace(0,8,65), range(0,65)]
+
+def string_histograms(bit_errors):
+    x = [bit_idx/8. + int(addr/64) for addr, bit_idx, error in bit_errors]
+    y = [addr%64 for addr, bit_idx, error in bit_errors]
+    w = [error for addr, bit_idx, error in bit_errors]
+    return np.histogram2d(x,y,bins)[0], np.histogram2d(x,y,bins,weights=w)[0]
+
+def random_faults(n, seed=0):
+    rng = np.random.default_rng(seed)
+    addrs, expected, actual = rng.integers(0, 2**9, n), rng.integers(0, 2**8, n), rng.integers(0, 2**8, n)
+    # some reads without errors, and every address and bit boundary
+    actual[::7] = expected[::7]
+    addrs[:4] = [0, 63, 64, 511][:n]
+    return list(zip(addrs.tolist(), expected.tolist(), actual.tolist()))
+
+@pytest.mark.parametrize('n', [1, 10, 5000])
+def test_bit_error_histograms(n):
+    faults = random_faults(n)
+    counts, net = plotting.bit_error_histograms(faults)
+    string_counts, string_net = string_histograms(string_bit_errors(faults))
+    assert np.array_equal(counts, string_counts) and np.array_equal(net, string_net)
+    assert sorted(plotting.collect_bit_errors(faults)) == sorted(string_bit_errors(faults))
+    assert plotting.count_bit_errors(faults) == len(string_bit_errors(faults))
+
+def test_bit_error_histograms_of_bitcounts():
+    faults = random_faults(5000)
+    counts = BitCounts(512)
+    addrs, expected, actual = zip(*faults)
+    counts.add(addrs, actual, expected)
+    string_counts, string_net = string_histograms(string_bit_errors(faults))
+    assert all([np.array_equal(a, b) for a, b in zip(plotting.bit_error_histograms(counts), (string_counts, string_net))])
+
+def test_bit_error_histograms_skip_unknown():
+    faults = random_faults(100)
+    counts, net = plotting.bit_error_histograms(faults + [(3, None, 0xff), (4, 0x00, None)])
+    string_counts, string_net = string_histograms(string_bit_errors(faults))
+    assert np.array_equal(counts, string_counts) and np.array_equal(net, string_net)
+    assert not plotting.bit_error_histograms([])[0].any()
+
+def test_find_bit_errors():
+    for expected, actual in [(0x00, 0x00), (0x00, 0x81), (0xff, 0x7e), (0x0f, 0xf0)]:
+        assert plotting.find_bit_errors(expected, actual) == \
+            [(bit_error, bit_idx) for addr, bit_idx, bit_error in string_bit_errors([(0, expected, actual)])]
+        assert plotting.convert_to_bitmap(actual) == [(int(bit), i) for i, bit in enumerate(format(actual,'08b'))]
+
+def test_bit_map_histograms():
+    bit_map = [(addr, actual) for addr, expected, actual in random_faults(5000)]
+    x, y, w = string_bit_map(bit_map)
+    values, counts = plotting.bit_map_histograms(bit_map)
+    assert np.array_equal(values, np.histogram2d(x,y,bins,weights=w)[0])
+    assert np.array_equal(counts, np.histogram2d(x,y,bins)[0])
+
+def shmoo_jobs(directory, rate=0.5):
+    shmoo = dict(clk_factors=[2, 4], delay_factors=[0, 1], byte_error_rate=np.array([[rate, 0], [0, 0]]),
+                 passed=np.array([[False, True], [True, True]]))
+    faults = random_faults(100)
+    return [(str(directory / 'shmoo.pdf'), [('shmoo', (shmoo,), 'Shmoo')]),
+            (str(directory / 'errors.pdf'), [('bit_error_map', (faults, True), 'Bit errors'),
+                                             ('bit_map', ([(addr, actual) for addr, expected, actual in faults],),
+                                              'Bit map')])]
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_render_plots_cache(tmp_path, processes):
+    cache_file = str(tmp_path / 'plot_cache.json')
+    jobs = shmoo_jobs(tmp_path)
+    filenames = [filename for filename, figures in jobs]
+    assert sorted(plotting.render_plots(jobs, cache_file, processes)) == sorted(filenames)
+    assert all([open(filename, 'rb').read(4) == b'%PDF' for filename in filenames])
+    # unchanged inputs are a cache hit
+    assert plotting.render_plots(shmoo_jobs(tmp_path), cache_file, processes) == []
+    # changed inputs, or a missing file, are a miss
+    assert plotting.render_plots(shmoo_jobs(tmp_path, rate=0.25), cache_file, processes) == [filenames[0]]
+    os.remove(filenames[1])
+    assert plotting.render_plots(shmoo_jobs(tmp_path, rate=0.25), cache_file, processes) == [filenames[1]]
+    # without a cache file everything is rendered
+    assert len(plotting.render_plots(shmoo_jobs(tmp_path, rate=0.25), None, processes)) == 2
+
+def test_generate_plots_skips_unchanged(make_board, faulty_sim):
+    board = make_board(faulty_sim())
+    results = ({'mats_test': {}}, {'mats_test': {}})
+    for clk_factor in (25, 5):
+        board.set_clk(clk_factor)
+        results[0]['mats_test'][clk_factor], results[1]['mats_test'][clk_factor] = board.mats_test()
+    rendered = generate_plots(board, results, processes=0)
+    # a clk scan, and a bit map and bit error map at each clk factor, per stage
+    assert len(rendered) == (1 + 2*2)*len(results[0]['mats_test'][25])
+    assert all([os.path.exists(filename) for filename in rendered])
+    assert generate_plots(board, results, processes=0) == []
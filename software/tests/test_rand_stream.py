@@ -0,0 +1,63 @@
+'''
+rand_stream against itself with other chunk sizes and against rand_test
+'''
+import random
+import tracemalloc
+from sram_sim import SimFPGA, StuckAtFault
+
+def stuck_sim():
+    # every address has a bit stuck at 1, so about half of all reads fail
+    return SimFPGA(faults=[StuckAtFault(addrs=range(512), bits=0x01, value=1)])
+
+def recorded_ops(board):
+    '''
+    Records the single value ops of `board` in the returned list
+    '''
+    ops = []
+    for name in ('set_addr', 'write_value', 'read_value'):
+        def record(*args, name=name, method=getattr(board, name), **kwargs):
+            ops.append((name,) + args)
+            return method(*args, **kwargs)
+        setattr(board, name, record)
+    return ops
+
+def test_same_seed_across_chunks(make_board, faulty_sim):
+    results = []
+    for chunk in (4096, 1000, 333):
+        board = make_board(faulty_sim())
+        ops = recorded_ops(board)
+        faults = list(board.rand_stream(n_static=1, n_dynamic=3000, seed=7, chunk=chunk))
+        results.append((ops, faults, board.io.memory.tolist()))
+    assert results[1] == results[0] and results[2] == results[0]
+    ops, faults, memory = results[0]
+    assert len(ops) > 3000 and len(faults)
+    board = make_board(faulty_sim())
+    assert list(board.rand_stream(n_static=1, n_dynamic=3000, seed=8)) != faults
+
+def test_fault_counts_match_rand_test(make_board):
+    n_static, n_dynamic = 4, 20000
+    random.seed(0)
+    faults, bitmaps = make_board(stuck_sim()).rand_test(n_static=n_static, n_dynamic=n_dynamic)
+    stream = list(make_board(stuck_sim()).rand_stream(n_static=n_static, n_dynamic=n_dynamic, seed=0))
+    for stage in ('rand_static', 'rand_dynamic'):
+        stream_faults = [(addr, expected, read) for record_stage, addr, expected, read in stream
+                         if record_stage == stage]
+        assert all([read == expected | 0x01 for addr, expected, read in stream_faults])
+        # the ops differ, so the counts agree to within their sampling noise
+        assert abs(len(stream_faults) - len(faults[stage])) < 0.1*len(faults[stage])
+    assert len(faults['rand_static']) > 0.4*n_static*512
+
+def peak_memory(board, n_dynamic):
+    tracemalloc.start()
+    try:
+        for record in board.rand_stream(n_static=0, n_dynamic=n_dynamic, seed=0, chunk=1024):
+            pass
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_peak_memory_bounded(make_board):
+    # a binary capture, as the .csv.gz logger buffers up to `max_buffer_len` rows
+    small = peak_memory(make_board(stuck_sim(), log_kwargs=dict(binary=True)), 5000)
+    large = peak_memory(make_board(stuck_sim(), log_kwargs=dict(binary=True)), 20000)
+    assert large < 1.5*small
@@ -0,0 +1,61 @@
+'''
+Replay of captures against the results of the live tests
+'''
+import os
+import random
+import pytest
+from replay import Replay
+
+def capture_file(board):
+    board.log.close()
+    return os.path.join(board.log.directory, board.log.dat_filename)
+
+@pytest.mark.parametrize('binary', [False, True])
+@pytest.mark.parametrize('engine', ['host', 'fpga'])
+def test_replay_matches_live(make_board, faulty_sim, binary, engine):
+    random.seed(0)
+    board = make_board(faulty_sim(), log_kwargs=dict(binary=binary), engine=engine)
+    names = ['mats_test', 'pattern_test', 'single_bit_test', 'rand_test']
+    live = {}
+    for clk_factor, name in zip([25, 10, 5, 3], names):
+        board.set_clk(clk_factor)
+        live[name] = (clk_factor,) + getattr(board, name)()
+    replay = Replay(segment_names=names)
+    faults, bitmaps = replay.replay(capture_file(board))
+    assert replay.stats['missing_bytes'] == replay.stats['extra_bytes'] == replay.stats['stray_bytes'] == 0
+    # host reads, including the unverified read back before rand_test
+    if engine == 'host':
+        assert replay.stats['reads'] == sum([len(counts) for clk_factor, live_faults, live_bitmaps in live.values()
+                                             for counts in live_bitmaps.values()]) + 512
+
+    for name in names:
+        clk_factor, live_faults, live_bitmaps = live[name]
+        assert list(faults[name][clk_factor].keys()) == list(live_faults.keys())
+        for stage in live_faults.keys():
+            assert sorted(faults[name][clk_factor][stage]) == sorted(live_faults[stage])
+            assert bitmaps[name][clk_factor][stage] == live_bitmaps[stage]
+    assert sum([len(stage_faults) for stage_faults in live['mats_test'][1].values()])
+    assert sum([len(stage_faults) for stage_faults in live['rand_test'][1].values()])
+
+def test_replay_passes(make_board, faulty_sim):
+    # without stage names, reads are in passes (fpga marches by read op)
+    board = make_board(faulty_sim())
+    board.set_clk(10)
+    board.single_bit_test()
+    board.set_clk(5)
+    board.march_test('March C-', engine='fpga')
+    board.set_clk(3)
+    live_faults, live_bitmaps = board.single_bit_test()
+    faults, bitmaps = Replay(segment_names=['single_bit_test', 'march_test'], stage_names={}).replay(capture_file(board))
+    assert list(faults['single_bit_test'][10].keys()) == ['pass {}'.format(k) for k in range(10)]
+    assert [bitmaps['segment 2'][3]['pass {}'.format(k)] for k in range(10)] == list(live_bitmaps.values())
+    assert list(faults['march_test'][5].keys())[0].startswith('M1.0 r')
+
+def test_replay_chunks(make_board, faulty_sim):
+    board = make_board(faulty_sim(), log_kwargs=dict(binary=True))
+    for clk_factor in (25, 5):
+        board.set_clk(clk_factor)
+        board.mats_test()
+    filename = capture_file(board)
+    results = [Replay().replay(filename, chunk_bytes=chunk_bytes) for chunk_bytes in (1, 1<<22)]
+    assert results[0] == results[1]
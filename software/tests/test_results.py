@@ -0,0 +1,60 @@
+'''
+ResultStore round trips of test results
+'''
+import numpy as np
+from results import ResultStore
+from sram_sim import SimFPGA, StuckAtFault, TransitionFault
+
+def run_tests(board, clk_factors=(25, 5)):
+    faults, bitmaps = {}, {}
+    for test in (board.mats_test, board.pattern_test):
+        for clk_factor in clk_factors:
+            board.set_clk(clk_factor)
+            result = test()
+            faults.setdefault(test.__name__, {})[clk_factor] = result[0]
+            bitmaps.setdefault(test.__name__, {})[clk_factor] = result[1]
+    return faults, bitmaps
+
+def test_add_run_round_trip(make_board, tmp_path):
+    board = make_board(SimFPGA(faults=[StuckAtFault(addrs=[3, 300], bits=0x81, value=1),
+                                       TransitionFault(addrs=40, bits=0x10)]))
+    faults, bitmaps = run_tests(board)
+    store = ResultStore(str(tmp_path / 'results.sqlite'))
+    run_id = store.add_run(faults, bitmaps, chip='chip A', board='sim', delay_factor=4, run_time='2021-01-01 00:00:00')
+    store.add_run(faults, chip='chip B', board='sim')
+
+    runs = store.runs(chip='chip A')
+    assert runs['run_id'].tolist() == [run_id]
+    assert runs['time'].tolist() == ['2021-01-01 00:00:00']
+    assert store.run_ids(board='sim') == [run_id, run_id + 1]
+
+    stages = store.stages(run_id=run_id)
+    for row in stages:
+        assert row['delay_factor'] == 4
+        assert row['n_reads'] == len(bitmaps[row['test']][row['clk_factor']][row['stage']])
+        assert row['n_faults'] == len(faults[row['test']][row['clk_factor']][row['stage']])
+    assert len(stages) == sum([len(faults[test][clk_factor]) for test in faults for clk_factor in faults[test]])
+    assert np.all(store.stages(chip='chip B')['n_reads'] == -1)
+
+    stored = store.faults(run_id=run_id)
+    expected = [(test, stage, clk_factor) + tuple(fault) for test in faults for clk_factor in faults[test]
+                for stage in faults[test][clk_factor] for fault in faults[test][clk_factor][stage]]
+    assert len(expected)
+    assert sorted(zip(stored['test'], stored['stage'], stored['clk_factor'].tolist(), stored['addr'].tolist(),
+                      stored['expected'].tolist(), stored['read'].tolist())) == sorted(expected)
+
+    # each flipped bit of a fault is a bit error, +1 for a read of 1
+    errors = store.bit_errors(run_id=run_id, addr=3)
+    assert len(errors) and set(errors['bit'].tolist()) <= {0, 7}
+    assert np.all(errors['error'] == 1)
+    assert len(store.faults(addr=[3, 300], chip='chip B')) == len(store.faults(addr=[3, 300], run_id=run_id))
+    store.close()
+
+def test_missing_reads(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.sqlite'))
+    run_id = store.add_run({'serial_test': {25: {'serial': [(5, 5, None), (6, 0x0f, 0x0e)]}}})
+    stored = store.faults(run_id=run_id)
+    assert stored['read'].tolist() == [-1, 0x0e]
+    errors = store.bit_errors(run_id=run_id)
+    assert list(zip(errors['addr'].tolist(), errors['bit'].tolist(), errors['error'].tolist())) == [(6, 7, -1)]
+    store.close()
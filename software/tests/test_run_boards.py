@@ -0,0 +1,42 @@
+'''
+Several simulated boards run by run_boards against single board runs
+'''
+import pytest
+from sram_sim import SimFPGA, StuckAtFault
+from test_suite import run_board, run_boards
+
+clk_factors = [25, 5]
+fixed_tests = ['mats_test', 'pattern_test', 'single_bit_test']
+
+def stuck_sim():
+    return SimFPGA(faults=[StuckAtFault(addrs=300, bits=0x10, value=0)])
+
+def fault_addrs(faults):
+    return set([addr for clk_faults in faults.values() for stage_faults in clk_faults.values()
+                for addr, expected, read in stage_faults])
+
+def n_static_reads(bitmaps):
+    return sum([len(clk_bitmaps['rand_static']) for clk_bitmaps in bitmaps.values()])
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_boards_match_single_runs(tmp_path, faulty_sim, processes):
+    sims = {'a': faulty_sim, 'b': stuck_sim}
+    kwargs = dict(clk_factors=clk_factors, calibration_dir=str(tmp_path / 'calibration'))
+    single = dict([(board, run_board(board, sim(), str(tmp_path / 'single'), **kwargs))
+                   for board, sim in sims.items()])
+    faults, bitmaps, errors = run_boards(dict([(board, sim()) for board, sim in sims.items()]),
+                                         directory=str(tmp_path / 'boards'), chips={'b': 'chip_b'},
+                                         processes=processes, **kwargs)
+    assert errors == {}
+    assert sorted(faults.keys()) == ['a', 'chip_b']
+    for board, chip in [('a', 'a'), ('b', 'chip_b')]:
+        single_faults, single_bitmaps = single[board]
+        for test in fixed_tests:
+            assert faults[chip][test] == single_faults[test]
+            assert bitmaps[chip][test] == single_bitmaps[test]
+        # random values differ between runs, but not the faulty addresses
+        # each board can report or the number of static reads
+        assert fault_addrs(faults[chip]['rand_test']) <= fault_addrs(single_faults['mats_test'])
+        assert n_static_reads(bitmaps[chip]['rand_test']) == n_static_reads(single_bitmaps['rand_test'])
+    assert fault_addrs(faults['chip_b']['mats_test']) == set([300])
+    assert set([5, 200]) <= fault_addrs(faults['a']['mats_test']) < set(range(300))
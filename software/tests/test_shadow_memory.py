@@ -0,0 +1,50 @@
+'''
+ShadowMemory values and its mask of known bits
+'''
+import numpy as np
+import pytest
+from cryoCMOS import ShadowMemory
+
+def test_dict_interface():
+    memory = ShadowMemory(8, {1: 0x12, 2: None, 20: 0x34})
+    assert len(memory) == 8
+    assert memory[1] == 0x12 and memory[2] is None and memory[0] is None
+    memory[2] = 0
+    memory[1] = None
+    assert memory.items() == [(addr, 0 if addr == 2 else None) for addr in range(8)]
+    assert memory.known.tolist() == [0, 0, 0xff, 0, 0, 0, 0, 0]
+    with pytest.raises(ValueError):
+        ShadowMemory(8, [1, 2])
+
+def test_known_mask():
+    memory = ShadowMemory(4)
+    memory.write_block([0, 1, 2], [0x0f, 0xa5, 0xff])
+    assert memory.valid().tolist() == [True, True, True, False]
+    # a value with only some known bits is unknown, but its known bits are expected
+    memory.known[1] = 0xf0
+    assert memory[1] is None and memory.get_block([0, 1, 2]) == [0x0f, None, 0xff]
+    assert memory.bits()[1].tolist() == [1, 0, 1, 0, -1, -1, -1, -1]
+    assert memory.bits()[0].tolist() == [0, 0, 0, 0, 1, 1, 1, 1]
+    assert memory.bits()[3].tolist() == [-1]*8
+    memory.invalidate([0])
+    assert memory.valid().tolist() == [False, False, True, False]
+    # values are kept while unknown and return with the mask
+    memory.known[0] = 0xff
+    assert memory[0] == 0x0f
+    memory.invalidate()
+    assert not np.any(memory.known)
+
+def test_compare():
+    assert ShadowMemory.compare([1, None, 3, None], [1, None, 4, 5]).tolist() == [False, False, True, True]
+    flips = ShadowMemory.bit_flips([0x80, 0x01], [0x00, 0x03])
+    assert flips.tolist() == [[-1, 0, 0, 0, 0, 0, 0, 0], [0, 0, 0, 0, 0, 0, 1, 0]]
+
+def test_board_tracks_known_values(board):
+    board.write_block(0, [7]*16)
+    assert board.memory.get_block(range(16)) == [7]*16
+    assert not np.any(board.memory.valid()[16:])
+    assert board.read_block(0, 16) == [7]*16
+    # a read value replaces the expected one
+    board.io.memory[3] = 8
+    assert board.read_block(3, 1) == [8]
+    assert board.memory[3] == 8
@@ -0,0 +1,22 @@
+'''
+Adaptive shmoo of a simulated fpga with a known operating region
+'''
+import numpy as np
+from sram_sim import SimFPGA, TimingFault
+from test_suite import run_shmoo
+
+def test_shmoo_region(make_board):
+    # reads of bit 2 fail below clk factor 8 or delay factor 6
+    board = make_board(SimFPGA(faults=[TimingFault(bits=0x04, min_clk_factor=8, min_delay=6)]))
+    board.set_clk(20)
+    board.set_delay(4)
+    shmoo = run_shmoo(board, clk_factors=range(1, 26), delay_factors=range(0, 16))
+    clk_factors, delay_factors = np.array(shmoo['clk_factors']), np.array(shmoo['delay_factors'])
+    expected = (clk_factors[:,np.newaxis] >= 8) & (delay_factors[np.newaxis,:] >= 6)
+    assert np.array_equal(shmoo['passed'], expected.astype(int))
+    assert shmoo['n_tested'] == np.sum(shmoo['tested'] > 0) < expected.size/3
+    # the full test only runs where the screen passed
+    assert np.all(shmoo['passed'][shmoo['tested'] == 2] == 1)
+    assert np.all(shmoo['byte_error_rate'][shmoo['tested'] == 1] > 0)
+    assert np.all(np.isnan(shmoo['byte_error_rate'][shmoo['tested'] == 0]))
+    assert board.io.clk_factor == 20 and board.io.read_delay == 4
@@ -0,0 +1,25 @@
+'''
+The simulated fpga across threads and processes
+'''
+from concurrent.futures import ProcessPoolExecutor
+from cryoCMOS import FrameCodec
+from sram_sim import SimFPGA, StuckAtFault
+
+def read_back(sim):
+    '''
+    Writes a block to `sim` and reads it back (in a worker process)
+    '''
+    sim.write(FrameCodec.frame(FrameCodec.SET_ADDR, 0) + FrameCodec.frame(FrameCodec.WRITE_BLOCK, 16) + bytes(range(16)))
+    sim.write(FrameCodec.frame(FrameCodec.SET_ADDR, 0) + FrameCodec.frame(FrameCodec.READ_BLOCK, 16))
+    return sim, bytes(sim.read(16))
+
+def test_sim_through_process_pool():
+    sim = SimFPGA(faults=[StuckAtFault(addrs=3, bits=0x80, value=1)])
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        returned, read_bytes = executor.submit(read_back, sim).result()
+    assert list(read_bytes) == [value | 0x80 if addr == 3 else value for addr, value in enumerate(range(16))]
+    # the worker's lock was recreated, so the returned sim still works
+    assert returned.lock is not sim.lock
+    assert returned.n_frames == 4 and sim.n_frames == 0
+    with returned.lock:
+        pass